@@ -0,0 +1,97 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the batched `grid_sample` face warping of `ImageProcessor.affine_transform_batch` against the OpenCV LANCZOS
+warping of `ImageProcessor.affine_transform`, in time and in PSNR, for every warp quality, e.g.
+
+python -m eval.benchmark_alignment --video_path assets/demo1_video.mp4
+"""
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from latentsync.utils.image_processor import WARP_QUALITIES, ImageProcessor
+from latentsync.utils.util import read_video
+
+
+def psnr(reference: torch.Tensor, faces: torch.Tensor) -> float:
+    mse = ((reference.float() - faces.float()) ** 2).mean().item()
+    return 10 * np.log10(255**2 / max(mse, 1e-10))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face alignment warping benchmark")
+    parser.add_argument("--video_path", type=str, default="assets/demo1_video.mp4")
+    parser.add_argument("--resolution", type=int, default=256)
+    parser.add_argument("--num_frames", type=int, default=64)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    video_frames = read_video(args.video_path, use_decord=False)[: args.num_frames]
+    image_processor = ImageProcessor(args.resolution, device=args.device)
+
+    # The landmarks are detected once, both paths warp with the same matrices
+    reference_faces, affine_matrices = [], []
+    opencv_time = 0.0
+    face_w, face_h = image_processor.restorer.face_size
+    for frame in video_frames:
+        lmk3 = image_processor.get_alignment_points(frame)
+        affine_matrix = image_processor.restorer.get_affine_matrix(lmk3, smooth=True)
+        start_time = time.perf_counter()
+        face = cv2.warpAffine(
+            frame,
+            affine_matrix,
+            (face_w, face_h),
+            flags=cv2.INTER_LANCZOS4,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=[127, 127, 127],
+        )
+        face = cv2.resize(face, (args.resolution, args.resolution), interpolation=cv2.INTER_LANCZOS4)
+        opencv_time += time.perf_counter() - start_time
+        reference_faces.append(torch.from_numpy(face).permute(2, 0, 1))
+        affine_matrices.append(affine_matrix)
+    reference_faces = torch.stack(reference_faces)
+
+    print(f"{'warping':<12}{'ms/frame':>10}{'speedup':>10}{'psnr (dB)':>12}{'max diff':>10}")
+    print(f"{'opencv':<12}{opencv_time / len(video_frames) * 1000:>10.2f}{1.0:>9.2f}x{'-':>12}{'-':>10}")
+    for quality in WARP_QUALITIES:
+        faces = []
+        image_processor.affine_transform_batch(video_frames[:1], affine_matrices[:1], quality=quality)  # warm up
+        if args.device.startswith("cuda"):
+            torch.cuda.synchronize()
+        start_time = time.perf_counter()
+        for start in range(0, len(video_frames), args.batch_size):
+            batch_faces, _, _ = image_processor.affine_transform_batch(
+                video_frames[start : start + args.batch_size],
+                affine_matrices[start : start + args.batch_size],
+                quality=quality,
+            )
+            faces.append(batch_faces)
+        batch_time = time.perf_counter() - start_time
+        faces = torch.cat(faces)
+        max_diff = (reference_faces.int() - faces.int()).abs().max().item()
+        print(
+            f"{quality:<12}{batch_time / len(video_frames) * 1000:>10.2f}{opencv_time / batch_time:>9.2f}x"
+            f"{psnr(reference_faces, faces):>12.2f}{max_diff:>10d}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the batched whisper embedding extraction of `Audio2Feature.audio2feat` against the segment by segment
+`Audio2Feature._audio2feat`, in time and in max difference of the embeddings, e.g.
+
+python -m eval.benchmark_audio_encoding --audio_paths assets/demo1_audio.wav
+"""
+
+import argparse
+import time
+
+import torch
+
+from latentsync.whisper.audio2feature import Audio2Feature
+
+
+def timed(function, *args):
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start_time = time.perf_counter()
+    result = function(*args)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return result, time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Whisper embedding extraction benchmark")
+    parser.add_argument("--whisper_model_path", type=str, default="checkpoints/whisper/tiny.pt")
+    parser.add_argument(
+        "--audio_paths", type=str, nargs="*", default=[f"assets/demo{i}_audio.wav" for i in range(1, 4)]
+    )
+    parser.add_argument("--segment_batch_sizes", type=int, nargs="*", default=[1, 8])
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    audio_encoder = Audio2Feature(model_path=args.whisper_model_path, device=device)
+
+    print(f"{'audio':<28}{'batch':>6}{'reference (s)':>15}{'batched (s)':>13}{'speedup':>10}{'max diff':>12}")
+    for audio_path in args.audio_paths:
+        reference, reference_time = timed(audio_encoder._audio2feat, audio_path)
+        for segment_batch_size in args.segment_batch_sizes:
+            audio_encoder.segment_batch_size = segment_batch_size
+            embeddings, batched_time = timed(audio_encoder.audio2feat, audio_path)
+            if embeddings.shape != reference.shape:
+                max_diff = float("nan")
+            else:
+                max_diff = (embeddings.float().cpu() - reference.float()).abs().max().item()
+            print(
+                f"{audio_path[-28:]:<28}{segment_batch_size:>6}{reference_time:>15.3f}{batched_time:>13.3f}"
+                f"{reference_time / batched_time:>9.2f}x{max_diff:>12.3g}"
+            )
+
+
+if __name__ == "__main__":
+    main()
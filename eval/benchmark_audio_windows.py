@@ -0,0 +1,148 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Microbenchmark of the gathered audio windows against the per-frame loops they replace, on random whisper features,
+checking that both give the same windows, e.g.
+
+python -m eval.benchmark_audio_windows --seconds 60 600
+
+Besides the timed runs, the windows of `feature2chunks`, `get_sliced_features` and `crop_overlap_audio_window` are
+compared with the ones `get_sliced_feature` builds one by one at every `--check_fps`, for all the frames of inputs
+of up to 30 seconds, whose first and last windows are clamped to the edges of the features. The script exits with
+an error if any window differs.
+"""
+
+import argparse
+import sys
+import time
+
+import torch
+from einops import rearrange
+
+from latentsync.utils.util import make_audio_window
+from latentsync.whisper.audio2feature import Audio2Feature
+
+
+def make_audio_window_loop(audio_embeddings: torch.Tensor, window_size: int):
+    audio_window = []
+    end_idx = audio_embeddings.shape[1] - window_size + 1
+    for i in range(end_idx):
+        audio_window.append(audio_embeddings[:, i : i + window_size, :])
+    audio_window = torch.stack(audio_window)
+    return rearrange(audio_window, "f b w d -> b f w d")
+
+
+def timed(function, *args):
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start_time
+
+
+def report(name, reference, reference_time, result, result_time):
+    equal = torch.equal(reference, result)
+    print(
+        f"{name:<36}{reference_time * 1000:>12.2f}{result_time * 1000:>12.2f}{reference_time / result_time:>9.1f}x"
+        f"{str(equal):>8}"
+    )
+    return equal
+
+
+def sliced_features_loop(audio_encoder, feature_array, vid_indices, fps):
+    return torch.stack([audio_encoder.get_sliced_feature(feature_array, i, fps=fps)[0] for i in vid_indices])
+
+
+def check_windows(audio_encoder, feature_array, fps):
+    """Compares every gathered window of `feature_array` at `fps` with the loops, returns the names of the failures"""
+    failures = []
+    chunks = audio_encoder.feature2chunks_loop(feature_array, fps)
+    indexer = audio_encoder.feature2chunks(feature_array, fps)
+    if len(indexer) != len(chunks) or not torch.equal(indexer[:], torch.stack(chunks)):
+        failures.append("feature2chunks")
+
+    # Frames at both edges, where the windows are clamped, and a shuffled selection in between
+    num_chunks = len(chunks)
+    edges = [0, 1, 2, num_chunks - 3, num_chunks - 2, num_chunks - 1]
+    vid_indices = [index for index in edges if 0 <= index < num_chunks] + torch.randperm(num_chunks)[:16].tolist()
+    reference = sliced_features_loop(audio_encoder, feature_array, vid_indices, fps)
+    if not torch.equal(audio_encoder.get_sliced_features(feature_array, vid_indices, fps=fps), reference):
+        failures.append("get_sliced_features")
+
+    # crop_overlap_audio_window always slices at 25 FPS
+    if fps == 25:
+        for start_index in [0, num_chunks // 2, max(num_chunks - audio_encoder.num_frames, 0)]:
+            frame_indices = range(start_index, start_index + audio_encoder.num_frames)
+            reference = sliced_features_loop(audio_encoder, feature_array, frame_indices, fps)
+            if not torch.equal(audio_encoder.crop_overlap_audio_window(feature_array, start_index), reference):
+                failures.append(f"crop_overlap_audio_window at {start_index}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audio window microbenchmark")
+    parser.add_argument("--whisper_model_path", type=str, default="checkpoints/whisper/tiny.pt")
+    parser.add_argument("--seconds", type=int, nargs="*", default=[10, 60, 600])
+    parser.add_argument("--fps", type=int, default=25)
+    parser.add_argument("--check_fps", type=float, nargs="*", default=[25, 24, 23.976, 29.97, 30, 50, 60])
+    parser.add_argument(
+        "--check_lengths", type=int, nargs="*", default=[1, 7, 50, 101, 1501], help="In whisper features (50/s)."
+    )
+    args = parser.parse_args()
+
+    audio_encoder = Audio2Feature(model_path=args.whisper_model_path, device="cpu")
+    num_layers = audio_encoder.model.dims.n_audio_layer + 1
+
+    passed = True
+    print(f"{'':<36}{'loop (ms)':>12}{'gather (ms)':>12}{'speedup':>10}{'equal':>8}")
+    for seconds in args.seconds:
+        feature_array = torch.randn(seconds * 50, num_layers, audio_encoder.embedding_dim)
+
+        chunks, loop_time = timed(audio_encoder.feature2chunks_loop, feature_array, args.fps)
+        indexer = audio_encoder.feature2chunks(feature_array, args.fps)
+        windows, gather_time = timed(lambda: indexer[:])
+        passed &= report(f"feature2chunks {seconds}s", torch.stack(chunks), loop_time, windows, gather_time)
+
+        start_index = seconds * args.fps // 2
+        reference, loop_time = timed(
+            lambda: torch.stack(
+                [
+                    audio_encoder.get_sliced_feature(feature_array, i, fps=25)[0]
+                    for i in range(start_index, start_index + audio_encoder.num_frames)
+                ]
+            )
+        )
+        window, gather_time = timed(audio_encoder.crop_overlap_audio_window, feature_array, start_index)
+        passed &= report(f"crop_overlap_audio_window {seconds}s", reference, loop_time, window, gather_time)
+
+        audio_embeddings = feature_array[None, :, 0]
+        reference, loop_time = timed(make_audio_window_loop, audio_embeddings, 10)
+        window, gather_time = timed(make_audio_window, audio_embeddings, 10)
+        passed &= report(f"make_audio_window {seconds}s", reference, loop_time, window, gather_time)
+
+    for fps in args.check_fps:
+        # Integral rates as ints, like the callers pass them
+        fps = int(fps) if fps == int(fps) else fps
+        for length in args.check_lengths:
+            feature_array = torch.randn(length, num_layers, audio_encoder.embedding_dim)
+            failures = check_windows(audio_encoder, feature_array, fps)
+            passed &= not failures
+            status = f"FAIL: {', '.join(failures)} differ" if failures else "ok"
+            print(f"windows at {fps} FPS of {length} features - {status}")
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
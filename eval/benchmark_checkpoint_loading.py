@@ -0,0 +1,106 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the time to load the UNet and the peak RSS of the process between the former loading (random init, full
+unpickling and a deep copy of the state dict) and `UNet3DConditionModel.from_pretrained`, on the .pt checkpoint and
+on its safetensors conversion (see `tools/convert_checkpoint_to_safetensors.py`), e.g.
+
+python -m eval.benchmark_checkpoint_loading --ckpt_paths checkpoints/latentsync_unet.pt \
+    checkpoints/latentsync_unet.safetensors
+
+Every measurement runs in a fresh process, so that the peak RSS is its own.
+"""
+
+import argparse
+import copy
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import torch
+from omegaconf import OmegaConf
+
+from latentsync.models.unet import UNet3DConditionModel
+
+
+def load_legacy(model_config: dict, ckpt_path: str, device: str, dtype: torch.dtype):
+    unet = UNet3DConditionModel.from_config(model_config).to(device)
+    ckpt = torch.load(ckpt_path, map_location=device)
+    state_dict = copy.deepcopy(ckpt["state_dict"] if "state_dict" in ckpt else ckpt)
+    unet.load_state_dict(state_dict, strict=False)
+    return unet.to(dtype=dtype)
+
+
+def load_fast(model_config: dict, ckpt_path: str, device: str, dtype: torch.dtype):
+    unet, _ = UNet3DConditionModel.from_pretrained(model_config, ckpt_path, device=device, dtype=dtype)
+    return unet
+
+
+def measure(args):
+    model_config = OmegaConf.to_container(OmegaConf.load(args.unet_config_path).model)
+    dtype = torch.float16 if args.dtype == "fp16" else torch.float32
+    load = load_legacy if args.mode == "legacy" else load_fast
+    start_time = time.perf_counter()
+    load(model_config, args.ckpt_path, args.device, dtype)
+    if args.device == "cuda":
+        torch.cuda.synchronize()
+    load_time = time.perf_counter() - start_time
+    # ru_maxrss is in KiB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(json.dumps(dict(load_time=load_time, peak_rss=peak_rss)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UNet checkpoint loading benchmark")
+    parser.add_argument("--unet_config_path", type=str, default="configs/unet/second_stage.yaml")
+    parser.add_argument("--ckpt_paths", type=str, nargs="+", default=["checkpoints/latentsync_unet.pt"])
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--dtype", type=str, default="fp16", choices=["fp16", "fp32"])
+    parser.add_argument("--mode", type=str, default=None, choices=["legacy", "fast"], help=argparse.SUPPRESS)
+    parser.add_argument("--ckpt_path", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        return measure(args)
+
+    print(f"{'checkpoint':<48}{'loader':<8}{'time (s)':>10}{'peak RSS (GiB)':>16}")
+    for ckpt_path in args.ckpt_paths:
+        # The former loader only reads pickled checkpoints
+        modes = ["fast"] if ckpt_path.endswith(".safetensors") else ["legacy", "fast"]
+        for mode in modes:
+            command = [
+                sys.executable,
+                "-m",
+                "eval.benchmark_checkpoint_loading",
+                "--unet_config_path",
+                args.unet_config_path,
+                "--device",
+                args.device,
+                "--dtype",
+                args.dtype,
+                "--mode",
+                mode,
+                "--ckpt_path",
+                ckpt_path,
+            ]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{ckpt_path:<48}{mode:<8}{result['load_time']:>10.2f}{result['peak_rss'] / 2**30:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the wall time and the SyncNet confidence of inference variants against the default settings on the same
+inputs (the demo assets unless --video_path and --audio_path are given), e.g.
+
+python -m eval.benchmark_inference --inference_ckpt_path checkpoints/latentsync_unet.pt --guidance_scale 1.5
+"""
+
+import argparse
+import os
+import time
+from statistics import fmean
+
+import torch
+from accelerate.utils import set_seed
+from omegaconf import OmegaConf
+
+from eval.eval_sync_conf import syncnet_eval
+from eval.syncnet import SyncNetEval
+from eval.syncnet_detect import SyncNetDetector
+from latentsync.pipelines.lipsync_session import get_weight_dtype, load_pipeline
+
+
+def parse_guidance_variant(variant: str):
+    """START,END,EVERY -> pipeline kwargs"""
+    start, end, every = variant.split(",")
+    return dict(guidance_interval=(float(start), float(end)), guidance_every=int(every))
+
+
+DEMO_ASSETS = [(f"assets/demo{i}_video.mp4", f"assets/demo{i}_audio.wav") for i in range(1, 4)]
+
+
+def run_variant(pipeline, config, args, video_path, audio_path, video_out_path, variant_kwargs, dtype):
+    set_seed(args.seed)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start_time = time.perf_counter()
+    pipeline(
+        video_path=video_path,
+        audio_path=audio_path,
+        video_out_path=video_out_path,
+        num_frames=config.data.num_frames,
+        num_inference_steps=args.inference_steps,
+        guidance_scale=args.guidance_scale,
+        weight_dtype=dtype,
+        width=config.data.resolution,
+        height=config.data.resolution,
+        **variant_kwargs,
+    )
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inference benchmark")
+    parser.add_argument("--unet_config_path", type=str, default="configs/unet/second_stage.yaml")
+    parser.add_argument("--inference_ckpt_path", type=str, required=True)
+    parser.add_argument("--syncnet_ckpt_path", type=str, default="checkpoints/auxiliary/syncnet_v2.model")
+    parser.add_argument("--video_path", type=str, default=None)
+    parser.add_argument("--audio_path", type=str, default=None)
+    parser.add_argument("--output_dir", type=str, default="benchmark_results")
+    parser.add_argument("--inference_steps", type=int, default=20)
+    parser.add_argument("--guidance_scale", type=float, default=1.5)
+    parser.add_argument("--seed", type=int, default=1247)
+    parser.add_argument(
+        "--guidance_variants",
+        type=str,
+        nargs="*",
+        default=["0,0.5,1", "0,1,2", "0,1,3"],
+        help="Guidance schedules to compare, as START,END,EVERY.",
+    )
+    parser.add_argument(
+        "--deep_cache_intervals",
+        type=int,
+        nargs="*",
+        default=[2, 3],
+        help="Full UNet step intervals of the deep feature cache to compare.",
+    )
+    parser.add_argument(
+        "--warm_start_strengths",
+        type=float,
+        nargs="*",
+        default=[0.5, 0.7],
+        help="Strengths of the warm start of every window from the previous one to compare.",
+    )
+    args = parser.parse_args()
+
+    config = OmegaConf.load(args.unet_config_path)
+    os.makedirs(args.output_dir, exist_ok=True)
+    dtype = get_weight_dtype()
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    pipeline = load_pipeline(config, args.inference_ckpt_path, dtype)
+    syncnet = SyncNetEval(device=device)
+    syncnet.loadParameters(args.syncnet_ckpt_path)
+    syncnet_detector = SyncNetDetector(device=device)
+
+    if args.video_path is not None:
+        inputs = [(args.video_path, args.audio_path)]
+    else:
+        inputs = DEMO_ASSETS
+
+    variants = [("baseline", {})]
+    for variant in args.guidance_variants:
+        variants.append((f"guidance_{variant.replace(',', '_')}", parse_guidance_variant(variant)))
+    for interval in args.deep_cache_intervals:
+        variants.append((f"deep_cache_{interval}", dict(deep_cache_interval=interval)))
+    for strength in args.warm_start_strengths:
+        variants.append((f"warm_start_{strength}", dict(warm_start_strength=strength)))
+
+    results = []
+    for name, variant_kwargs in variants:
+        print(f"Running {name}: {variant_kwargs}")
+        wall_time = 0.0
+        conf_list = []
+        for index, (video_path, audio_path) in enumerate(inputs):
+            video_out_path = os.path.join(args.output_dir, f"{name}_{index}.mp4")
+            wall_time += run_variant(
+                pipeline, config, args, video_path, audio_path, video_out_path, variant_kwargs, dtype
+            )
+            _, conf = syncnet_eval(syncnet, syncnet_detector, video_out_path)
+            conf_list.append(conf)
+        results.append((name, wall_time, fmean(conf_list)))
+
+    baseline_time = results[0][1]
+    print(f"{'variant':<32}{'time (s)':>10}{'speedup':>10}{'sync conf':>12}")
+    for name, wall_time, conf in results:
+        print(f"{name:<32}{wall_time:>10.2f}{baseline_time / wall_time:>9.2f}x{conf:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the landmarks of `LandmarkTracker` against running the face detector on every frame, on the demo videos and
+on synthetic videos made by moving their frames, and reports the detector calls saved and the landmark drift in
+units of the inter-ocular distance, e.g.
+
+python -m eval.benchmark_landmark_tracking --keyframe_intervals 10 25 50
+"""
+
+import argparse
+import time
+
+import cv2
+import face_alignment
+import numpy as np
+import torch
+
+from latentsync.utils.face_tracking import LandmarkTracker
+from latentsync.utils.util import read_video
+
+DEMO_VIDEOS = [f"assets/demo{i}_video.mp4" for i in range(1, 4)]
+
+
+def make_synthetic_video(video_frames, amplitude, period):
+    """Moves the frames along a circle of `amplitude` px every `period` frames, with a jump in the middle."""
+    height, width = video_frames.shape[1:3]
+    moved_frames = []
+    for index, frame in enumerate(video_frames):
+        angle = 2 * np.pi * index / period
+        shift_x = amplitude * np.cos(angle) + (amplitude * 2 if index >= len(video_frames) // 2 else 0)
+        shift_y = amplitude * np.sin(angle)
+        matrix = np.array([[1, 0, shift_x], [0, 1, shift_y]], dtype=np.float64)
+        moved_frames.append(cv2.warpAffine(frame, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE))
+    return np.stack(moved_frames)
+
+
+def get_all_landmarks(get_landmarks, video_frames):
+    landmarks = []
+    start_time = time.perf_counter()
+    for frame in video_frames:
+        frame_landmarks = get_landmarks(frame)
+        landmarks.append(None if frame_landmarks is None else np.asarray(frame_landmarks))
+    return landmarks, time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Landmark tracking benchmark")
+    parser.add_argument("--video_paths", type=str, nargs="*", default=DEMO_VIDEOS)
+    parser.add_argument("--num_frames", type=int, default=250)
+    parser.add_argument("--keyframe_intervals", type=int, nargs="*", default=[10, 25, 50])
+    parser.add_argument("--synthetic_amplitude", type=float, default=20.0)
+    parser.add_argument("--synthetic_period", type=int, default=100)
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    fa = face_alignment.FaceAlignment(face_alignment.LandmarksType.TWO_D, flip_input=False, device=args.device)
+
+    def detect_landmarks(frame):
+        landmarks = fa.get_landmarks(frame)
+        return None if landmarks is None else landmarks[0]
+
+    print(
+        f"{'video':<28}{'interval':>10}{'detections':>12}{'saved':>8}{'speedup':>10}"
+        f"{'mean drift':>12}{'max drift':>11}"
+    )
+    for video_path in args.video_paths:
+        video_frames = read_video(video_path, use_decord=False)[: args.num_frames]
+        videos = [
+            (video_path, video_frames),
+            (
+                f"{video_path} (moved)",
+                make_synthetic_video(video_frames, args.synthetic_amplitude, args.synthetic_period),
+            ),
+        ]
+        for name, frames in videos:
+            full_landmarks, full_time = get_all_landmarks(detect_landmarks, frames)
+            for keyframe_interval in args.keyframe_intervals:
+                tracker = LandmarkTracker(fa, keyframe_interval=keyframe_interval)
+                tracked_landmarks, tracked_time = get_all_landmarks(tracker.get_landmarks, frames)
+
+                drifts = []
+                for full, tracked in zip(full_landmarks, tracked_landmarks):
+                    if full is None or tracked is None:
+                        continue
+                    inter_ocular = np.linalg.norm(full[36] - full[45])
+                    drifts.append(np.linalg.norm(full - tracked, axis=1).mean() / inter_ocular)
+                mean_drift = np.mean(drifts) if drifts else float("nan")
+                max_drift = np.max(drifts) if drifts else float("nan")
+                print(
+                    f"{name[-28:]:<28}{keyframe_interval:>10}{tracker.detector_calls:>12}"
+                    f"{tracker.detector_calls_saved:>8}{full_time / tracked_time:>9.2f}x"
+                    f"{mean_drift:>12.4f}{max_drift:>11.4f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the time of `AlignRestore.restore_img` against the full-frame `restore_img_full_frame` on a frame of a video
+resized to several resolutions, with a slowly moving face, and checks that their outputs match, e.g.
+
+python -m eval.benchmark_restore --video_path assets/demo1_video.mp4
+
+The script exits with an error if the outputs differ, eval/check_restore_equivalence.py covers more face positions.
+"""
+
+import argparse
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from latentsync.utils.affine_transform import AlignRestore, transformation_from_points
+
+
+def make_affine_matrices(restorer, width, height, num_frames, motion):
+    """Matrices aligning a face of a third of the frame height at the center, drifting by `motion` px per frame."""
+    face_w, face_h = restorer.face_size
+    scale = height / 3 / face_h
+    matrices = []
+    for index in range(num_frames):
+        lmks3 = restorer.face_template * scale
+        lmks3 += (width / 2 - face_w * scale / 2 + index * motion, height / 3 + index * motion)
+        matrix, _ = transformation_from_points(lmks3, restorer.face_template, smooth=False)
+        matrices.append(matrix)
+    return matrices
+
+
+def time_restore(restore_img, frame, faces, matrices):
+    outputs = []
+    start_time = time.perf_counter()
+    for face, matrix in zip(faces, matrices):
+        outputs.append(restore_img(frame, face, matrix))
+    return (time.perf_counter() - start_time) / len(faces), outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face restoring benchmark")
+    parser.add_argument("--video_path", type=str, default="assets/demo1_video.mp4")
+    parser.add_argument("--heights", type=int, nargs="*", default=[720, 1080, 2160])
+    parser.add_argument("--num_frames", type=int, default=50)
+    parser.add_argument("--motion", type=float, default=0.05, help="Face motion in pixels per frame.")
+    parser.add_argument("--mask_cache_tolerance", type=float, default=0.5)
+    args = parser.parse_args()
+
+    capture = cv2.VideoCapture(args.video_path)
+    ret, source_frame = capture.read()
+    capture.release()
+    if not ret:
+        raise RuntimeError(f"Could not read a frame from {args.video_path}")
+
+    passed = True
+    print(f"{'resolution':<14}{'full (ms)':>12}{'roi (ms)':>12}{'cached (ms)':>14}{'speedup':>10}{'max diff':>10}")
+    for height in args.heights:
+        width = round(source_frame.shape[1] * height / source_frame.shape[0])
+        frame = cv2.resize(source_frame, (width, height), interpolation=cv2.INTER_AREA)
+        restorer = AlignRestore()
+        matrices = make_affine_matrices(restorer, width, height, args.num_frames, args.motion)
+        faces = [cv2.warpAffine(frame, matrix, restorer.face_size, flags=cv2.INTER_LANCZOS4) for matrix in matrices]
+
+        full_time, full_outputs = time_restore(restorer.restore_img_full_frame, frame, faces, matrices)
+        roi_time, roi_outputs = time_restore(AlignRestore().restore_img, frame, faces, matrices)
+        cached_restorer = AlignRestore(mask_cache_tolerance=args.mask_cache_tolerance)
+        cached_time, _ = time_restore(cached_restorer.restore_img, frame, faces, matrices)
+
+        max_diff = max(
+            np.abs(full.astype(np.int32) - roi.astype(np.int32)).max() for full, roi in zip(full_outputs, roi_outputs)
+        )
+        print(
+            f"{f'{width}x{height}':<14}{full_time * 1000:>12.2f}{roi_time * 1000:>12.2f}{cached_time * 1000:>14.2f}"
+            f"{full_time / roi_time:>9.2f}x{max_diff:>10d}"
+        )
+        passed &= max_diff == 0
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Load test of `LipsyncServer`: for every concurrency level, as many clients submit synthetic jobs (the demo assets
+with different seeds) one after the other, and the throughput, the job latencies and the UNet batch sizes are
+reported, to show how the cross-job window batching scales with the concurrency, e.g.
+
+python -m eval.benchmark_server --inference_ckpt_path checkpoints/latentsync_unet.pt --concurrency 1 2 4 8
+"""
+
+import argparse
+import os
+import threading
+import time
+
+from omegaconf import OmegaConf
+
+from latentsync.pipelines.lipsync_server import LipsyncServer
+from latentsync.pipelines.lipsync_session import LipsyncSession
+
+DEMO_ASSETS = [(f"assets/demo{i}_video.mp4", f"assets/demo{i}_audio.wav") for i in range(1, 4)]
+
+
+def run_level(session, args, concurrency):
+    server = LipsyncServer(
+        session,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_concurrent_jobs=concurrency,
+    )
+
+    def client(client_index):
+        for job_index in range(args.jobs_per_client):
+            video_path, audio_path = DEMO_ASSETS[(client_index + job_index) % len(DEMO_ASSETS)]
+            video_out_path = os.path.join(args.output_dir, f"server_{concurrency}_{client_index}_{job_index}.mp4")
+            job = server.submit(
+                video_path,
+                audio_path,
+                video_out_path,
+                seed=client_index * args.jobs_per_client + job_index,
+                num_inference_steps=args.inference_steps,
+                guidance_scale=args.guidance_scale,
+            )
+            job.future.result()
+
+    start_time = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    wall_time = time.perf_counter() - start_time
+    metrics = server.metrics()
+    server.close()
+    return wall_time, metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inference server load test")
+    parser.add_argument("--unet_config_path", type=str, default="configs/unet/second_stage.yaml")
+    parser.add_argument("--inference_ckpt_path", type=str, required=True)
+    parser.add_argument("--output_dir", type=str, default="benchmark_results")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 2, 4, 8])
+    parser.add_argument("--jobs_per_client", type=int, default=2)
+    parser.add_argument("--max_batch_size", type=int, default=8)
+    parser.add_argument("--max_wait_ms", type=float, default=20.0)
+    parser.add_argument("--inference_steps", type=int, default=20)
+    parser.add_argument("--guidance_scale", type=float, default=1.5)
+    args = parser.parse_args()
+
+    config = OmegaConf.load(args.unet_config_path)
+    os.makedirs(args.output_dir, exist_ok=True)
+    session = LipsyncSession(config, args.inference_ckpt_path)
+
+    results = [(concurrency, *run_level(session, args, concurrency)) for concurrency in args.concurrency]
+
+    print(
+        f"{'clients':<9}{'jobs':>6}{'wall (s)':>10}{'jobs/s':>9}{'windows/s':>11}{'p50 (s)':>9}{'p95 (s)':>9}"
+        f"{'batch windows':>15}{'scaling':>9}"
+    )
+    base_throughput = results[0][2]["windows_per_second"]
+    for concurrency, wall_time, metrics in results:
+        scaling = metrics["windows_per_second"] / base_throughput if base_throughput > 0 else 0.0
+        print(
+            f"{concurrency:<9}{metrics['jobs_done']:>6}{wall_time:>10.1f}{metrics['jobs_per_second']:>9.3f}"
+            f"{metrics['windows_per_second']:>11.2f}{metrics['latency_p50']:>9.1f}{metrics['latency_p95']:>9.1f}"
+            f"{metrics['mean_batch_windows']:>15.2f}{scaling:>8.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
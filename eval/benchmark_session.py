@@ -0,0 +1,82 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the latency of a `LipsyncSession`: the time to load the models, the first request (which also pays for the
+CUDA context, kernel selection and allocator warm up) and the following requests on the warm session, e.g.
+
+python -m eval.benchmark_session --inference_ckpt_path checkpoints/latentsync_unet.pt --num_requests 5
+"""
+
+import argparse
+import os
+import time
+from statistics import fmean
+
+import torch
+from omegaconf import OmegaConf
+
+from latentsync.pipelines.lipsync_session import LipsyncSession
+
+
+def timed(function, *args, **kwargs):
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start_time = time.perf_counter()
+    result = function(*args, **kwargs)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return result, time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident session latency benchmark")
+    parser.add_argument("--unet_config_path", type=str, default="configs/unet/second_stage.yaml")
+    parser.add_argument("--inference_ckpt_path", type=str, required=True)
+    parser.add_argument("--video_path", type=str, default="assets/demo1_video.mp4")
+    parser.add_argument("--audio_path", type=str, default="assets/demo1_audio.wav")
+    parser.add_argument("--output_dir", type=str, default="benchmark_results")
+    parser.add_argument("--inference_steps", type=int, default=20)
+    parser.add_argument("--guidance_scale", type=float, default=1.5)
+    parser.add_argument("--num_requests", type=int, default=5)
+    args = parser.parse_args()
+
+    config = OmegaConf.load(args.unet_config_path)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    session, load_time = timed(LipsyncSession, config, args.inference_ckpt_path)
+
+    request_times = []
+    for index in range(args.num_requests):
+        _, request_time = timed(
+            session.run,
+            args.video_path,
+            args.audio_path,
+            os.path.join(args.output_dir, f"session_{index}.mp4"),
+            num_inference_steps=args.inference_steps,
+            guidance_scale=args.guidance_scale,
+        )
+        request_times.append(request_time)
+
+    print(f"{'model load':<24}{load_time:>10.2f}s")
+    print(f"{'first request':<24}{request_times[0]:>10.2f}s")
+    if len(request_times) > 1:
+        steady_times = request_times[1:]
+        print(f"{'steady state mean':<24}{fmean(steady_times):>10.2f}s")
+        print(f"{'steady state min/max':<24}{min(steady_times):>10.2f}s{max(steady_times):>10.2f}s")
+        print(f"{'per-run script (est.)':<24}{load_time + request_times[0]:>10.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Streams an audio file through `StreamingAudio2Feature` in fixed size chunks and reports the latency of every audio
+window (how much audio past the end of its frame had to arrive before it was emitted), the compute time per chunk,
+and the drift of the windows against the offline `audio2feat` + `feature2chunks` path, e.g.
+
+python -m eval.benchmark_streaming_audio --chunk_ms 40 --context_seconds 5 10 30
+"""
+
+import argparse
+import time
+from statistics import fmean
+
+import torch
+import torch.nn.functional as F
+
+from latentsync.whisper.audio2feature import Audio2Feature
+from latentsync.whisper.streaming import StreamingAudio2Feature
+from latentsync.whisper.whisper.audio import SAMPLE_RATE
+
+
+def stream(streamer: StreamingAudio2Feature, audio_samples: torch.Tensor, chunk_samples: int, fps: int):
+    windows_list = []
+    latencies = []
+    push_times = []
+    for start in range(0, len(audio_samples), chunk_samples):
+        chunk = audio_samples[start : start + chunk_samples]
+        start_time = time.perf_counter()
+        windows = streamer.push(chunk)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        push_times.append(time.perf_counter() - start_time)
+        if windows is None or len(windows) == 0:
+            continue
+        first_frame = streamer.num_windows - len(windows)
+        received_seconds = (start + len(chunk)) / SAMPLE_RATE
+        latencies.extend(received_seconds - (i + 1) / fps for i in range(first_frame, streamer.num_windows))
+        windows_list.append(windows)
+    windows = streamer.flush()
+    if windows is not None:
+        windows_list.append(windows)
+    return torch.cat(windows_list), latencies, push_times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming audio front-end benchmark")
+    parser.add_argument("--whisper_model_path", type=str, default="checkpoints/whisper/tiny.pt")
+    parser.add_argument("--audio_path", type=str, default="assets/demo1_audio.wav")
+    parser.add_argument("--fps", type=int, default=25)
+    parser.add_argument("--chunk_ms", type=int, default=40)
+    parser.add_argument("--context_seconds", type=float, nargs="*", default=[5.0, 10.0, 30.0])
+    parser.add_argument("--hop_seconds", type=float, default=0.2)
+    parser.add_argument("--lookahead_seconds", type=float, default=0.1)
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    audio_encoder = Audio2Feature(model_path=args.whisper_model_path, device=device)
+    audio_samples = audio_encoder.load_audio(args.audio_path)
+    reference = audio_encoder.feature2chunks(audio_encoder.audio2feat(args.audio_path, audio_samples), args.fps)[:]
+    reference = reference.float()
+    chunk_samples = SAMPLE_RATE * args.chunk_ms // 1000
+
+    print(
+        f"{'context (s)':<12}{'windows':>9}{'latency mean/max (ms)':>24}{'push mean/max (ms)':>22}"
+        f"{'max abs diff':>14}{'mean abs diff':>15}{'min cos':>9}"
+    )
+    for context_seconds in args.context_seconds:
+        streamer = StreamingAudio2Feature(
+            audio_encoder,
+            fps=args.fps,
+            context_seconds=context_seconds,
+            hop_seconds=args.hop_seconds,
+            lookahead_seconds=args.lookahead_seconds,
+        )
+        windows, latencies, push_times = stream(streamer, audio_samples, chunk_samples, args.fps)
+        windows = windows.float()
+        if windows.shape != reference.shape:
+            print(f"{context_seconds:<12}shape mismatch: {tuple(windows.shape)} vs {tuple(reference.shape)}")
+            continue
+
+        diff = (windows - reference).abs()
+        cosine = F.cosine_similarity(windows.flatten(1), reference.flatten(1), dim=1)
+        latency = f"{fmean(latencies) * 1000:.0f}/{max(latencies) * 1000:.0f}" if latencies else "-"
+        push_time = f"{fmean(push_times) * 1000:.1f}/{max(push_times) * 1000:.1f}"
+        print(
+            f"{context_seconds:<12}{len(windows):>9}{latency:>24}{push_time:>22}"
+            f"{diff.max().item():>14.4f}{diff.mean().item():>15.4f}{cosine.min().item():>9.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the whisper embeddings of audio clips encoded with and without padding to 30-second segments: the
+encoding time of both, and how much the unpadded embeddings differ from the padded ones, per layer, e.g.
+
+python -m eval.benchmark_variable_length_encoding --audio_path assets/demo1_audio.wav --seconds 2 4 8 16
+"""
+
+import argparse
+import time
+
+import torch
+import torch.nn.functional as F
+
+from latentsync.whisper.audio2feature import Audio2Feature
+
+
+def timed(function, *args):
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start_time = time.perf_counter()
+    result = function(*args)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return result, time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Variable length whisper encoding benchmark")
+    parser.add_argument("--whisper_model_path", type=str, default="checkpoints/whisper/tiny.pt")
+    parser.add_argument("--audio_path", type=str, default="assets/demo1_audio.wav")
+    parser.add_argument("--seconds", type=float, nargs="*", default=[2, 4, 8, 16, 29])
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    audio_encoder = Audio2Feature(model_path=args.whisper_model_path, device=device)
+    audio_samples = audio_encoder.load_audio(args.audio_path)
+
+    print(
+        f"{'clip (s)':<10}{'padded (ms)':>12}{'unpadded (ms)':>14}{'speedup':>9}"
+        f"{'max abs diff':>14}{'mean abs diff':>15}{'min cos':>9}  per layer mean abs diff"
+    )
+    for seconds in args.seconds:
+        clip = audio_samples[: int(seconds * 16000)]
+        if len(clip) < int(seconds * 16000):
+            clip = clip.repeat(int(seconds * 16000) // len(clip) + 1)[: int(seconds * 16000)]
+
+        results = {}
+        for variable_length_segments in (False, True):
+            audio_encoder.variable_length_segments = variable_length_segments
+            audio_encoder.extract_embeddings(clip)  # warm up
+            times = []
+            for _ in range(args.repeats):
+                embeddings, elapsed = timed(audio_encoder.extract_embeddings, clip)
+                times.append(elapsed)
+            results[variable_length_segments] = embeddings.float(), min(times)
+
+        (padded, padded_time), (unpadded, unpadded_time) = results[False], results[True]
+        diff = (unpadded - padded).abs()
+        cosine = F.cosine_similarity(unpadded, padded, dim=-1)
+        per_layer = " ".join(f"{value:.3f}" for value in diff.mean(dim=(0, 2)).tolist())
+        print(
+            f"{seconds:<10}{padded_time * 1000:>12.1f}{unpadded_time * 1000:>14.1f}{padded_time / unpadded_time:>8.1f}x"
+            f"{diff.max().item():>14.4f}{diff.mean().item():>15.4f}{cosine.min().item():>9.4f}  {per_layer}"
+        )
+
+
+if __name__ == "__main__":
+    main()
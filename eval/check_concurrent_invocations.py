@@ -0,0 +1,100 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Checks that concurrent invocations of one pipeline do not share state, e.g.
+
+python -m eval.check_concurrent_invocations --inference_ckpt_path checkpoints/latentsync_unet.pt --num_jobs 3
+
+The jobs (the demo assets with different seeds, each drawing its noise from its own generator) first run one after
+the other on a `LipsyncSession`, then all at once in threads on the same session. Every concurrent output must
+equal its sequential one frame by frame, and the invocations must not leave files behind in the working directory.
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from omegaconf import OmegaConf
+
+from latentsync.pipelines.lipsync_session import LipsyncSession
+from latentsync.utils.util import read_video
+
+DEMO_ASSETS = [(f"assets/demo{i}_video.mp4", f"assets/demo{i}_audio.wav") for i in range(1, 4)]
+
+
+def run_job(session, args, job_index, video_out_path):
+    video_path, audio_path = DEMO_ASSETS[job_index % len(DEMO_ASSETS)]
+    generator = torch.Generator(device=session.pipeline._execution_device).manual_seed(args.seed + job_index)
+    session.run(
+        video_path,
+        audio_path,
+        video_out_path,
+        seed=None,
+        generator=generator,
+        num_inference_steps=args.inference_steps,
+    )
+    return video_out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent invocations of one pipeline")
+    parser.add_argument("--unet_config_path", type=str, default="configs/unet/second_stage.yaml")
+    parser.add_argument("--inference_ckpt_path", type=str, required=True)
+    parser.add_argument("--output_dir", type=str, default="benchmark_results")
+    parser.add_argument("--num_jobs", type=int, default=3)
+    parser.add_argument("--inference_steps", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1247)
+    args = parser.parse_args()
+
+    torch.backends.cudnn.deterministic = True
+    torch.backends.cudnn.benchmark = False
+    os.makedirs(args.output_dir, exist_ok=True)
+    session = LipsyncSession(OmegaConf.load(args.unet_config_path), args.inference_ckpt_path)
+    files_before = set(os.listdir("."))
+
+    sequential_paths = [
+        run_job(session, args, index, os.path.join(args.output_dir, f"sequential_{index}.mp4"))
+        for index in range(args.num_jobs)
+    ]
+    with ThreadPoolExecutor(args.num_jobs) as executor:
+        futures = [
+            executor.submit(run_job, session, args, index, os.path.join(args.output_dir, f"concurrent_{index}.mp4"))
+            for index in range(args.num_jobs)
+        ]
+        concurrent_paths = [future.result() for future in futures]
+
+    passed = True
+    for index, (sequential_path, concurrent_path) in enumerate(zip(sequential_paths, concurrent_paths)):
+        sequential_frames = read_video(sequential_path, change_fps=False)
+        concurrent_frames = read_video(concurrent_path, change_fps=False)
+        equal = sequential_frames.shape == concurrent_frames.shape and np.array_equal(
+            sequential_frames, concurrent_frames
+        )
+        passed &= equal
+        print(f"job {index}: concurrent output {'equals' if equal else 'DIFFERS FROM'} the sequential one")
+
+    leftovers = sorted(set(os.listdir(".")) - files_before)
+    if leftovers:
+        passed = False
+        print(f"Files left in the working directory: {leftovers}")
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Checks that the streaming and pipelined execution modes write the same frames as the eager one, e.g.
+
+python -m eval.check_pipelined_equivalence --inference_ckpt_path checkpoints/latentsync_unet.pt
+
+Every mode runs on the same inputs with the same seed and with deterministic cuDNN kernels. libx264 encodes
+identical frames identically, so the decoded outputs are compared frame by frame and must be equal; the number of
+differing frames and the largest pixel difference are reported otherwise.
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import torch
+from omegaconf import OmegaConf
+
+from latentsync.pipelines.lipsync_session import LipsyncSession
+from latentsync.utils.util import read_video
+
+MODES = {
+    "eager": dict(),
+    "streaming": dict(streaming=True),
+    "pipelined": dict(pipelined=True),
+}
+
+
+def compare_frames(reference: np.ndarray, frames: np.ndarray):
+    """Returns the number of frames that differ (counting missing ones) and the largest pixel difference."""
+    num_compared = min(len(reference), len(frames))
+    diffs = np.abs(reference[:num_compared].astype(np.int16) - frames[:num_compared].astype(np.int16))
+    num_different = int((diffs.reshape(num_compared, -1).max(axis=1) > 0).sum()) if num_compared > 0 else 0
+    num_different += abs(len(reference) - len(frames))
+    return num_different, int(diffs.max()) if diffs.size > 0 else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame-exact comparison of the execution modes")
+    parser.add_argument("--unet_config_path", type=str, default="configs/unet/second_stage.yaml")
+    parser.add_argument("--inference_ckpt_path", type=str, required=True)
+    parser.add_argument("--video_path", type=str, default="assets/demo1_video.mp4")
+    parser.add_argument("--audio_path", type=str, default="assets/demo1_audio.wav")
+    parser.add_argument("--output_dir", type=str, default="benchmark_results")
+    parser.add_argument("--inference_steps", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1247)
+    args = parser.parse_args()
+
+    torch.backends.cudnn.deterministic = True
+    torch.backends.cudnn.benchmark = False
+    os.makedirs(args.output_dir, exist_ok=True)
+    session = LipsyncSession(OmegaConf.load(args.unet_config_path), args.inference_ckpt_path)
+
+    outputs = {}
+    for mode, mode_kwargs in MODES.items():
+        video_out_path = os.path.join(args.output_dir, f"equivalence_{mode}.mp4")
+        session.run(
+            args.video_path,
+            args.audio_path,
+            video_out_path,
+            seed=args.seed,
+            num_inference_steps=args.inference_steps,
+            **mode_kwargs,
+        )
+        outputs[mode] = read_video(video_out_path, change_fps=False)
+
+    passed = True
+    reference = outputs["eager"]
+    for mode in list(MODES)[1:]:
+        num_different, max_diff = compare_frames(reference, outputs[mode])
+        passed &= num_different == 0
+        print(
+            f"{mode} vs eager: {len(outputs[mode])}/{len(reference)} frames, {num_different} differ, "
+            f"max pixel difference {max_diff} - {'ok' if num_different == 0 else 'FAIL'}"
+        )
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Checks that `AlignRestore.restore_img`, which only warps and blends the region around the face, writes the same
+pixels as the full-frame `restore_img_full_frame`, e.g.
+
+python -m eval.check_restore_equivalence --video_path assets/demo1_video.mp4
+
+A frame of the video, resized to several resolutions, gets faces of several sizes and rotations pasted at the
+center, at the edges and in the corners of the frame, partly outside of it, where the region around the face is
+clamped to the frame. The mask cache is disabled (`mask_cache_tolerance=0`), and the check fails on any pixel
+difference.
+"""
+
+import argparse
+import sys
+
+import cv2
+import numpy as np
+
+from latentsync.utils.affine_transform import AlignRestore, transformation_from_points
+
+# Centers of the face, as fractions of the frame size
+FACE_CENTERS = [(0.5, 0.5), (0.0, 0.5), (1.0, 0.5), (0.5, 0.0), (0.5, 1.0), (0.02, 0.03), (0.97, 0.98), (1.05, -0.05)]
+
+
+def make_affine_matrix(restorer, width, height, center, face_height, angle):
+    """Matrix aligning a face of `face_height` px centered at `center` (fractions of the frame), rotated by `angle`."""
+    scale = face_height / restorer.face_size[1]
+    lmks3 = restorer.face_template * scale
+    lmks3 += (center[0] * width, center[1] * height) - lmks3.mean(axis=0)
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    lmks3 = (lmks3 - lmks3.mean(axis=0)) @ rotation.T + lmks3.mean(axis=0)
+    matrix, _ = transformation_from_points(lmks3, restorer.face_template, smooth=False)
+    return matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pixel equivalence of the region and full-frame face restoring")
+    parser.add_argument("--video_path", type=str, default="assets/demo1_video.mp4")
+    parser.add_argument("--heights", type=int, nargs="*", default=[360, 720, 1080])
+    parser.add_argument("--face_fractions", type=float, nargs="*", default=[0.2, 0.45, 0.9])
+    parser.add_argument("--angles", type=float, nargs="*", default=[0.0, 0.1, -0.37], help="Radians.")
+    parser.add_argument("--seed", type=int, default=1247)
+    args = parser.parse_args()
+
+    capture = cv2.VideoCapture(args.video_path)
+    ret, source_frame = capture.read()
+    capture.release()
+    if not ret:
+        raise RuntimeError(f"Could not read a frame from {args.video_path}")
+    rng = np.random.default_rng(args.seed)
+
+    num_cases = 0
+    failures = []
+    for height in args.heights:
+        width = round(source_frame.shape[1] * height / source_frame.shape[0])
+        frame = cv2.resize(source_frame, (width, height), interpolation=cv2.INTER_AREA)
+        for center in FACE_CENTERS:
+            for face_fraction in args.face_fractions:
+                for angle in args.angles:
+                    restorer = AlignRestore(mask_cache_tolerance=0)
+                    # A sub-pixel offset, so that the face is not aligned to the pixel grid
+                    face_center = (center[0] + rng.random() / width, center[1] + rng.random() / height)
+                    matrix = make_affine_matrix(restorer, width, height, face_center, face_fraction * height, angle)
+                    # Random content, so that a misplaced pixel cannot match its neighbours by chance
+                    face = rng.integers(0, 256, (*restorer.face_size[::-1], 3), dtype=np.uint8)
+
+                    expected = restorer.restore_img_full_frame(frame, face, matrix)
+                    restored = restorer.restore_img(frame, face, matrix)
+                    max_diff = int(np.abs(expected.astype(np.int32) - restored.astype(np.int32)).max())
+                    num_cases += 1
+                    if max_diff != 0:
+                        failures.append((width, height, face_center, face_fraction, angle, max_diff))
+
+    for width, height, center, face_fraction, angle, max_diff in failures:
+        print(
+            f"{width}x{height}, face of {face_fraction:.2f}x the frame height at ({center[0]:.3f}, {center[1]:.3f}), "
+            f"rotated by {angle:.2f}: max pixel difference {max_diff}"
+        )
+    print(f"{num_cases - len(failures)}/{num_cases} cases are pixel-equal - {'FAIL' if failures else 'ok'}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
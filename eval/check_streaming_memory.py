@@ -0,0 +1,108 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Checks that the peak RSS of `streaming=True` inference does not grow with the length of the input, e.g.
+
+python -m eval.check_streaming_memory --inference_ckpt_path checkpoints/latentsync_unet.pt --loops 1 4
+
+The demo video and audio are looped `--loops` times with ffmpeg, and every length runs in a fresh process, in
+streaming and in eager mode, so that each peak RSS is its own. The check fails if the streaming peak RSS of the
+longest input exceeds the one of the shortest by more than `--max_growth_mib`; the eager peaks are reported to
+show what the streaming mode saves.
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+
+from omegaconf import OmegaConf
+
+from latentsync.utils.workspace import Workspace
+
+
+def loop_media(input_path: str, output_path: str, loops: int):
+    command = ["ffmpeg", "-y", "-loglevel", "error", "-nostdin", "-stream_loop", str(loops - 1), "-i", input_path]
+    subprocess.run(command + ["-c", "copy", output_path], check=True)
+
+
+def measure(args):
+    from latentsync.pipelines.lipsync_session import LipsyncSession
+
+    session = LipsyncSession(OmegaConf.load(args.unet_config_path), args.inference_ckpt_path)
+    session.run(
+        args.video_path,
+        args.audio_path,
+        args.video_out_path,
+        seed=args.seed,
+        num_inference_steps=args.inference_steps,
+        streaming=args.mode == "streaming",
+    )
+    # ru_maxrss is in KiB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(json.dumps(dict(peak_rss=peak_rss)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak RSS of streaming inference against the input length")
+    parser.add_argument("--unet_config_path", type=str, default="configs/unet/second_stage.yaml")
+    parser.add_argument("--inference_ckpt_path", type=str, required=True)
+    parser.add_argument("--video_path", type=str, default="assets/demo1_video.mp4")
+    parser.add_argument("--audio_path", type=str, default="assets/demo1_audio.wav")
+    parser.add_argument("--loops", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--inference_steps", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1247)
+    parser.add_argument("--max_growth_mib", type=float, default=256)
+    parser.add_argument("--mode", type=str, default=None, choices=["streaming", "eager"], help=argparse.SUPPRESS)
+    parser.add_argument("--video_out_path", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        return measure(args)
+
+    peaks = {}
+    with Workspace(prefix="streaming_memory_") as workspace:
+        for loops in args.loops:
+            video_path = workspace.join(f"video_{loops}.mp4")
+            audio_path = workspace.join(f"audio_{loops}.wav")
+            loop_media(args.video_path, video_path, loops)
+            loop_media(args.audio_path, audio_path, loops)
+            for mode in ["streaming", "eager"]:
+                command = [sys.executable, "-m", "eval.check_streaming_memory"]
+                command += ["--unet_config_path", args.unet_config_path]
+                command += ["--inference_ckpt_path", args.inference_ckpt_path]
+                command += ["--video_path", video_path, "--audio_path", audio_path]
+                command += ["--inference_steps", str(args.inference_steps), "--seed", str(args.seed)]
+                command += ["--mode", mode, "--video_out_path", workspace.join(f"{mode}_{loops}.mp4")]
+                output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+                peaks[mode, loops] = json.loads(output.strip().splitlines()[-1])["peak_rss"]
+
+    print(f"{'loops':<8}{'streaming (GiB)':>16}{'eager (GiB)':>14}")
+    for loops in args.loops:
+        print(f"{loops:<8}{peaks['streaming', loops] / 2**30:>16.2f}{peaks['eager', loops] / 2**30:>14.2f}")
+
+    shortest, longest = min(args.loops), max(args.loops)
+    growth_mib = (peaks["streaming", longest] - peaks["streaming", shortest]) / 2**20
+    print(
+        f"Streaming peak RSS growth from {shortest}x to {longest}x: {growth_mib:.0f}MiB "
+        f"(max {args.max_growth_mib:.0f}MiB)"
+    )
+    if growth_mib > args.max_growth_mib:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
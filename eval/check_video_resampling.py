@@ -0,0 +1,112 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Checks the decode-time 25 FPS resampling of `read_video` and `iter_video_frames` frame by frame against ffmpeg's
+`-r 25`, which the former implementation transcoded with, e.g.
+
+python -m eval.check_video_resampling --video_paths assets/demo1_video.mp4 my_30fps_video.mp4
+
+ffmpeg's frames are piped out losslessly. Each of them is matched to the source frame it is closest to, among the
+ones around the index `get_resampled_frame_indices` predicts, and that source frame is compared with the predicted
+one. The script reports the frame counts, the index mismatches and the pixel differences of both readers, and exits
+with an error if the frame counts or indices differ. Variable frame rate inputs are expected to show mismatches,
+since the index mapping assumes a constant frame rate.
+"""
+
+import argparse
+import subprocess
+import sys
+
+import numpy as np
+from decord import VideoReader
+
+from latentsync.utils.util import get_resampled_frame_indices, iter_video_frames, read_video
+
+
+def iter_ffmpeg_frames(video_path: str, width: int, height: int, target_fps: float = 25):
+    command = ["ffmpeg", "-loglevel", "error", "-nostdin", "-i", video_path, "-r", str(target_fps)]
+    command += ["-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    frame_size = width * height * 3
+    try:
+        while True:
+            data = process.stdout.read(frame_size)
+            if len(data) < frame_size:
+                break
+            yield np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+    finally:
+        process.stdout.close()
+        process.wait()
+
+
+def mean_abs_diff(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.abs(a.astype(np.int16) - b.astype(np.int16)).mean())
+
+
+def check_video(video_path: str, search_radius: int, chunk_size: int) -> bool:
+    vr = VideoReader(video_path)
+    src_fps = vr.get_avg_fps()
+    height, width = vr[0].shape[:2]
+    predicted_indices = get_resampled_frame_indices(len(vr), src_fps)
+
+    index_mismatches = 0
+    ffmpeg_diffs = []
+    num_ffmpeg_frames = 0
+    for output_index, ffmpeg_frame in enumerate(iter_ffmpeg_frames(video_path, width, height)):
+        num_ffmpeg_frames += 1
+        if output_index >= len(predicted_indices):
+            continue
+        predicted = int(predicted_indices[output_index])
+        candidates = range(max(predicted - search_radius, 0), min(predicted + search_radius + 1, len(vr)))
+        diffs = {index: mean_abs_diff(vr[index].asnumpy(), ffmpeg_frame) for index in candidates}
+        matched = min(diffs, key=diffs.get)
+        # Identical neighbouring frames (e.g. a still shot) match equally well
+        if matched != predicted and diffs[matched] < diffs[predicted]:
+            index_mismatches += 1
+        ffmpeg_diffs.append(diffs[predicted])
+
+    decord_frames = read_video(video_path, change_fps=True, use_decord=True)
+    streamed_frames = np.concatenate(list(iter_video_frames(video_path, chunk_size, change_fps=True)))
+    num_compared = min(len(decord_frames), len(streamed_frames))
+    reader_diffs = [mean_abs_diff(decord_frames[i], streamed_frames[i]) for i in range(num_compared)]
+
+    counts_match = len(predicted_indices) == num_ffmpeg_frames == len(decord_frames) == len(streamed_frames)
+    passed = counts_match and index_mismatches == 0
+    print(
+        f"{video_path}: {src_fps:.3f} FPS, frames ffmpeg {num_ffmpeg_frames} / predicted {len(predicted_indices)} / "
+        f"read_video {len(decord_frames)} / iter_video_frames {len(streamed_frames)}, "
+        f"index mismatches {index_mismatches}, "
+        f"max mean abs diff vs ffmpeg {max(ffmpeg_diffs, default=0.0):.2f}, "
+        f"between the readers {max(reader_diffs, default=0.0):.2f} - {'ok' if passed else 'FAIL'}"
+    )
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame by frame check of the 25 FPS resampling against ffmpeg")
+    parser.add_argument("--video_paths", type=str, nargs="+", required=True)
+    parser.add_argument("--search_radius", type=int, default=2)
+    parser.add_argument("--chunk_size", type=int, default=16)
+    args = parser.parse_args()
+
+    passed = True
+    for video_path in args.video_paths:
+        passed &= check_video(video_path, args.search_radius, args.chunk_size)
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -19,22 +19,26 @@ from statistics import fmean
 from eval.syncnet import SyncNetEval
 from eval.syncnet_detect import SyncNetDetector
 from latentsync.utils.util import red_text
+from latentsync.utils.workspace import Workspace
 import torch
 
 
-def syncnet_eval(syncnet, syncnet_detector, video_path, temp_dir, detect_results_dir="detect_results"):
-    syncnet_detector(video_path=video_path, min_track=50)
-    crop_videos = os.listdir(os.path.join(detect_results_dir, "crop"))
-    if crop_videos == []:
-        raise Exception(red_text(f"Face not detected in {video_path}"))
-    av_offset_list = []
-    conf_list = []
-    for video in crop_videos:
-        av_offset, _, conf = syncnet.evaluate(
-            video_path=os.path.join(detect_results_dir, "crop", video), temp_dir=temp_dir
-        )
-        av_offset_list.append(av_offset)
-        conf_list.append(conf)
+def syncnet_eval(syncnet, syncnet_detector, video_path, temp_dir=None, detect_results_dir=None):
+    """
+    temp_dir and detect_results_dir are roots under which unique scratch directories are created for this call,
+    so several evaluations can run at the same time.
+    """
+    with Workspace(root=detect_results_dir, prefix="detect_results_") as workspace:
+        crop_dir = syncnet_detector(video_path=video_path, min_track=50, detect_results_dir=workspace.path)
+        crop_videos = os.listdir(crop_dir)
+        if crop_videos == []:
+            raise Exception(red_text(f"Face not detected in {video_path}"))
+        av_offset_list = []
+        conf_list = []
+        for video in crop_videos:
+            av_offset, _, conf = syncnet.evaluate(video_path=os.path.join(crop_dir, video), temp_dir=temp_dir)
+            av_offset_list.append(av_offset)
+            conf_list.append(conf)
     av_offset = int(fmean(av_offset_list))
     conf = fmean(conf_list)
     print(f"Input video: {video_path}\nSyncNet confidence: {conf:.2f}\nAV offset: {av_offset}")
@@ -46,7 +50,7 @@ def main():
     parser.add_argument("--initial_model", type=str, default="checkpoints/auxiliary/syncnet_v2.model", help="")
     parser.add_argument("--video_path", type=str, default=None, help="")
     parser.add_argument("--videos_dir", type=str, default="/root/processed")
-    parser.add_argument("--temp_dir", type=str, default="temp", help="")
+    parser.add_argument("--temp_dir", type=str, default=None, help="root of the scratch directories")
 
     args = parser.parse_args()
 
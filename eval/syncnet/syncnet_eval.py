@@ -9,7 +9,7 @@ import python_speech_features
 from scipy import signal
 from scipy.io import wavfile
 from .syncnet import S
-from shutil import rmtree
+from latentsync.utils.workspace import Workspace
 
 
 # ==================== Get OFFSET ====================
@@ -43,7 +43,15 @@ class SyncNetEval(torch.nn.Module):
         self.__S__ = S(num_layers_in_fc_layers=num_layers_in_fc_layers).to(device)
         self.device = device
 
-    def evaluate(self, video_path, temp_dir="temp", batch_size=20, vshift=15):
+    def evaluate(self, video_path, temp_dir=None, batch_size=20, vshift=15):
+        """
+        temp_dir: root under which a unique scratch directory is created for this call (the system temp
+            directory by default), so that concurrent evaluations do not overwrite each other's files.
+        """
+        with Workspace(root=temp_dir, prefix="syncnet_eval_") as workspace:
+            return self._evaluate(video_path, workspace.path, batch_size, vshift)
+
+    def _evaluate(self, video_path, temp_dir, batch_size, vshift):
 
         self.__S__.eval()
 
@@ -51,11 +59,6 @@ class SyncNetEval(torch.nn.Module):
         # Convert files
         # ========== ==========
 
-        if os.path.exists(temp_dir):
-            rmtree(temp_dir)
-
-        os.makedirs(temp_dir)
-
         # temp_video_path = os.path.join(temp_dir, "temp.mp4")
         # command = f"ffmpeg -loglevel error -nostdin -y -i {video_path} -vf scale='224:224' {temp_video_path}"
         # subprocess.call(command, shell=True)
@@ -155,7 +158,6 @@ class SyncNetEval(torch.nn.Module):
         framewise_conf = signal.medfilt(fconf, kernel_size=9)
 
         # numpy.set_printoptions(formatter={"float": "{: 0.3f}".format})
-        rmtree(temp_dir)
         return av_offset.item(), min_dist.item(), conf.item()
 
     def extract_feature(self, opt, videofile):
@@ -22,11 +22,18 @@ class SyncNetDetector:
         self.s3f_detector = S3FD(device=device)
         self.detect_results_dir = detect_results_dir
 
-    def __call__(self, video_path: str, min_track=50, scale=False):
-        crop_dir = os.path.join(self.detect_results_dir, "crop")
-        video_dir = os.path.join(self.detect_results_dir, "video")
-        frames_dir = os.path.join(self.detect_results_dir, "frames")
-        temp_dir = os.path.join(self.detect_results_dir, "temp")
+    def __call__(self, video_path: str, min_track=50, scale=False, detect_results_dir=None):
+        """
+        Writes the cropped face tracks to `<detect_results_dir>/crop` and returns that directory. Pass a
+        directory private to the call (e.g. a `Workspace`) as `detect_results_dir` to run detections concurrently,
+        otherwise the shared directory given to the constructor is wiped and reused.
+        """
+        if detect_results_dir is None:
+            detect_results_dir = self.detect_results_dir
+        crop_dir = os.path.join(detect_results_dir, "crop")
+        video_dir = os.path.join(detect_results_dir, "video")
+        frames_dir = os.path.join(detect_results_dir, "frames")
+        temp_dir = os.path.join(detect_results_dir, "temp")
 
         # ========== DELETE EXISTING DIRECTORIES ==========
         if os.path.exists(crop_dir):
@@ -81,6 +88,7 @@ class SyncNetDetector:
             self.crop_video(track, os.path.join(crop_dir, "%05d" % ii), frames_dir, 25, temp_dir, video_dir)
 
         rmtree(temp_dir)
+        return crop_dir
 
     def scene_detect(self, video_dir):
         video_manager = VideoManager([os.path.join(video_dir, "video.mp4")])
@@ -1,19 +1,36 @@
 import gradio as gr
 from pathlib import Path
 from scripts.inference import main
+from latentsync.pipelines.lipsync_session import LipsyncSession
 from omegaconf import OmegaConf
 import argparse
+import threading
+import uuid
 from datetime import datetime
 
 CONFIG_PATH = Path("configs/unet/second_stage.yaml")
 CHECKPOINT_PATH = Path("checkpoints/latentsync_unet.pt")
 
+# Loaded on the first request and kept for the following ones
+session = None
+# Gradio serves requests from several threads, the lock keeps concurrent first requests from loading two sessions
+session_lock = threading.Lock()
+
+
+def get_session() -> LipsyncSession:
+    global session
+    with session_lock:
+        if session is None:
+            session = LipsyncSession(OmegaConf.load(CONFIG_PATH), CHECKPOINT_PATH.absolute().as_posix())
+    return session
+
 
 def process_video(
     video_path,
     audio_path,
     guidance_scale,
     inference_steps,
+    guidance_every,
     seed,
 ):
     # Create the temp directory if it doesn't exist
@@ -27,24 +44,29 @@ def process_video(
 
     current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
     # Set the output path for the processed video
-    output_path = str(output_dir / f"{video_file_path.stem}_{current_time}.mp4")  # Change the filename as needed
+    # The random suffix keeps jobs submitted in the same second from writing to the same file
+    output_path = str(output_dir / f"{video_file_path.stem}_{current_time}_{uuid.uuid4().hex[:8]}.mp4")
 
+    # The run settings come from the arguments, the config only provides the defaults the UI does not expose
     config = OmegaConf.load(CONFIG_PATH)
 
-    config["run"].update(
-        {
-            "guidance_scale": guidance_scale,
-            "inference_steps": inference_steps,
-        }
-    )
-
     # Parse the arguments
-    args = create_args(video_path, audio_path, output_path, inference_steps, guidance_scale, seed)
+    args = create_args(
+        video_path,
+        audio_path,
+        output_path,
+        inference_steps,
+        guidance_scale,
+        seed,
+        guidance_interval=config.run.get("guidance_interval", (0.0, 1.0)),
+        guidance_every=guidance_every,
+    )
 
     try:
         result = main(
             config=config,
             args=args,
+            session=get_session(),
         )
         print("Processing completed successfully.")
         return output_path  # Ensure the output path is returned
@@ -54,7 +76,14 @@ def process_video(
 
 
 def create_args(
-    video_path: str, audio_path: str, output_path: str, inference_steps: int, guidance_scale: float, seed: int
+    video_path: str,
+    audio_path: str,
+    output_path: str,
+    inference_steps: int,
+    guidance_scale: float,
+    seed: int,
+    guidance_interval=(0.0, 1.0),
+    guidance_every: int = 1,
 ) -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument("--inference_ckpt_path", type=str, required=True)
@@ -64,6 +93,21 @@ def create_args(
     parser.add_argument("--inference_steps", type=int, default=20)
     parser.add_argument("--guidance_scale", type=float, default=1.0)
     parser.add_argument("--seed", type=int, default=1247)
+    parser.add_argument("--superres", type=str, default="none")
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--pipelined", action="store_true")
+    parser.add_argument("--windows_per_batch", type=int, default=1)
+    parser.add_argument("--guidance_interval", type=float, nargs=2, default=[0.0, 1.0])
+    parser.add_argument("--guidance_every", type=int, default=1)
+    parser.add_argument("--deep_cache_interval", type=int, default=1)
+    parser.add_argument("--warm_start_strength", type=float, default=1.0)
+    parser.add_argument("--skip_silent_windows", action="store_true")
+    parser.add_argument("--avatar_dir", type=str, default=None)
+    parser.add_argument("--memory_budget_gib", type=float, default=None)
+    parser.add_argument("--warp_quality", type=str, default=None)
+    parser.add_argument("--track_landmarks", action="store_true")
+    parser.add_argument("--landmark_smoothing", type=str, default="causal")
+    parser.add_argument("--variable_length_audio", action="store_true")
 
     return parser.parse_args(
         [
@@ -81,6 +125,11 @@ def create_args(
             str(guidance_scale),
             "--seed",
             str(seed),
+            "--guidance_interval",
+            str(guidance_interval[0]),
+            str(guidance_interval[1]),
+            "--guidance_every",
+            str(int(guidance_every)),
         ]
     )
 
@@ -126,6 +175,7 @@ with gr.Blocks(title="LatentSync Video Processing") as demo:
                     label="Guidance Scale",
                 )
                 inference_steps = gr.Slider(minimum=10, maximum=50, value=20, step=1, label="Inference Steps")
+                guidance_every = gr.Slider(minimum=1, maximum=5, value=1, step=1, label="Guidance Every k Steps")
 
             with gr.Row():
                 seed = gr.Number(value=1247, label="Random Seed", precision=0)
@@ -151,6 +201,7 @@ with gr.Blocks(title="LatentSync Video Processing") as demo:
             audio_input,
             guidance_scale,
             inference_steps,
+            guidance_every,
             seed,
         ],
         outputs=video_output,
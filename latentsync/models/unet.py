@@ -2,7 +2,6 @@
 
 from dataclasses import dataclass
 from typing import List, Optional, Tuple, Union
-import copy
 
 import torch
 import torch.nn as nn
@@ -37,6 +36,34 @@ class UNet3DConditionOutput(BaseOutput):
     sample: torch.FloatTensor
 
 
+class UNetFeatureCache:
+    """
+    Reuses the deep features of the UNet across denoising steps, which change little between adjacent steps. One
+    step in `full_step_interval` runs the whole UNet and caches the input of the last up block. The other steps
+    only run `conv_in`, the first down block and the last up block, on top of the cached features. Features are
+    cached per input shape, and a step with a shape that has not been seen yet always runs in full. Use one cache
+    per denoising loop.
+    """
+
+    def __init__(self, full_step_interval: int = 2):
+        self.full_step_interval = full_step_interval
+        self.features = {}
+        self.num_steps = 0
+        self.num_full_steps = 0
+
+    def get(self, shape: torch.Size) -> Optional[torch.Tensor]:
+        """Returns the cached features for this step, or None if it has to run in full"""
+        step = self.num_steps
+        self.num_steps += 1
+        if step % self.full_step_interval == 0 or shape not in self.features:
+            self.num_full_steps += 1
+            return None
+        return self.features[shape]
+
+    def update(self, shape: torch.Size, features: torch.Tensor):
+        self.features[shape] = features
+
+
 class UNet3DConditionModel(ModelMixin, ConfigMixin):
     _supports_gradient_checkpointing = True
 
@@ -337,6 +364,7 @@ class UNet3DConditionModel(ModelMixin, ConfigMixin):
         down_block_additional_residuals: Optional[Tuple[torch.Tensor]] = None,
         mid_block_additional_residual: Optional[torch.Tensor] = None,
         return_dict: bool = True,
+        feature_cache: Optional[UNetFeatureCache] = None,
     ) -> Union[UNet3DConditionOutput, Tuple]:
         r"""
         Args:
@@ -345,6 +373,9 @@ class UNet3DConditionModel(ModelMixin, ConfigMixin):
             encoder_hidden_states (`torch.FloatTensor`): (batch, sequence_length, feature_dim) encoder hidden states
             return_dict (`bool`, *optional*, defaults to `True`):
                 Whether or not to return a [`models.unet_2d_condition.UNet2DConditionOutput`] instead of a plain tuple.
+            feature_cache (`UNetFeatureCache`, *optional*):
+                Reuses the deep features of previous steps on the steps the cache selects. Not supported together
+                with the controlnet residuals.
 
         Returns:
             [`~models.unet_2d_condition.UNet2DConditionOutput`] or `tuple`:
@@ -409,8 +440,14 @@ class UNet3DConditionModel(ModelMixin, ConfigMixin):
             emb = emb + class_emb
 
         # pre-process
+        input_shape = sample.shape
         sample = self.conv_in(sample)
 
+        cached_features = feature_cache.get(input_shape) if feature_cache is not None else None
+        if cached_features is not None:
+            sample = self._forward_shallow(sample, emb, encoder_hidden_states, attention_mask, cached_features)
+            return self._post_process(sample, return_dict)
+
         # down
         down_block_res_samples = (sample,)
         for downsample_block in self.down_blocks:
@@ -459,6 +496,9 @@ class UNet3DConditionModel(ModelMixin, ConfigMixin):
             if not is_final_block and forward_upsample_size:
                 upsample_size = down_block_res_samples[-1].shape[2:]
 
+            if is_final_block and feature_cache is not None:
+                feature_cache.update(input_shape, sample)
+
             if hasattr(upsample_block, "has_cross_attention") and upsample_block.has_cross_attention:
                 sample = upsample_block(
                     hidden_states=sample,
@@ -477,7 +517,41 @@ class UNet3DConditionModel(ModelMixin, ConfigMixin):
                     encoder_hidden_states=encoder_hidden_states,
                 )
 
-        # post-process
+        return self._post_process(sample, return_dict)
+
+    def _forward_shallow(self, sample, emb, encoder_hidden_states, attention_mask, cached_features):
+        """Runs the first down block and the last up block on top of the cached input of the last up block"""
+        down_block = self.down_blocks[0]
+        if hasattr(down_block, "has_cross_attention") and down_block.has_cross_attention:
+            _, res_samples = down_block(
+                hidden_states=sample,
+                temb=emb,
+                encoder_hidden_states=encoder_hidden_states,
+                attention_mask=attention_mask,
+            )
+        else:
+            _, res_samples = down_block(hidden_states=sample, temb=emb, encoder_hidden_states=encoder_hidden_states)
+
+        up_block = self.up_blocks[-1]
+        res_samples = ((sample,) + tuple(res_samples))[: len(up_block.resnets)]
+        if hasattr(up_block, "has_cross_attention") and up_block.has_cross_attention:
+            sample = up_block(
+                hidden_states=cached_features,
+                temb=emb,
+                res_hidden_states_tuple=res_samples,
+                encoder_hidden_states=encoder_hidden_states,
+                attention_mask=attention_mask,
+            )
+        else:
+            sample = up_block(
+                hidden_states=cached_features,
+                temb=emb,
+                res_hidden_states_tuple=res_samples,
+                encoder_hidden_states=encoder_hidden_states,
+            )
+        return sample
+
+    def _post_process(self, sample, return_dict):
         sample = self.conv_norm_out(sample)
         sample = self.conv_act(sample)
         sample = self.conv_out(sample)
@@ -487,42 +561,88 @@ class UNet3DConditionModel(ModelMixin, ConfigMixin):
 
         return UNet3DConditionOutput(sample=sample)
 
-    def load_state_dict(self, state_dict, strict=True):
+    def filter_state_dict(self, state_dict: dict) -> dict:
+        """
+        Returns the entries of `state_dict` this model can load, leaving out the input, output and audio
+        cross-attention projections whose shapes do not match the config. The tensors are not copied.
+        """
+        keys_to_remove = set()
         # If the loaded checkpoint's in_channels or out_channels are different from config
-        temp_state_dict = copy.deepcopy(state_dict)
-        if temp_state_dict["conv_in.weight"].shape[1] != self.config.in_channels:
-            del temp_state_dict["conv_in.weight"]
-            del temp_state_dict["conv_in.bias"]
-        if temp_state_dict["conv_out.weight"].shape[0] != self.config.out_channels:
-            del temp_state_dict["conv_out.weight"]
-            del temp_state_dict["conv_out.bias"]
+        if state_dict["conv_in.weight"].shape[1] != self.config.in_channels:
+            keys_to_remove.update(["conv_in.weight", "conv_in.bias"])
+        if state_dict["conv_out.weight"].shape[0] != self.config.out_channels:
+            keys_to_remove.update(["conv_out.weight", "conv_out.bias"])
 
         # If the loaded checkpoint's cross_attention_dim is different from config
-        keys_to_remove = []
-        for key in temp_state_dict:
+        for key, value in state_dict.items():
             if "audio_cross_attn.attn.to_k." in key or "audio_cross_attn.attn.to_v." in key:
-                if temp_state_dict[key].shape[1] != self.config.cross_attention_dim:
-                    keys_to_remove.append(key)
+                if value.shape[1] != self.config.cross_attention_dim:
+                    keys_to_remove.add(key)
 
-        for key in keys_to_remove:
-            del temp_state_dict[key]
+        return {key: value for key, value in state_dict.items() if key not in keys_to_remove}
 
-        return super().load_state_dict(state_dict=temp_state_dict, strict=strict)
+    def load_state_dict(self, state_dict, strict=True, assign=False):
+        return super().load_state_dict(state_dict=self.filter_state_dict(state_dict), strict=strict, assign=assign)
 
     @classmethod
-    def from_pretrained(cls, model_config: dict, ckpt_path: str, device="cpu"):
-        unet = cls.from_config(model_config).to(device)
-        if ckpt_path != "":
-            zero_rank_log(logger, f"Load from checkpoint: {ckpt_path}")
-            ckpt = torch.load(ckpt_path, map_location=device)
-            if "global_step" in ckpt:
-                zero_rank_log(logger, f"resume from global_step: {ckpt['global_step']}")
-                resume_global_step = ckpt["global_step"]
-            else:
-                resume_global_step = 0
-            state_dict = ckpt["state_dict"] if "state_dict" in ckpt else ckpt
-            unet.load_state_dict(state_dict, strict=False)
+    def from_pretrained(cls, model_config: dict, ckpt_path: str, device="cpu", dtype: Optional[torch.dtype] = None):
+        """
+        Creates the model from `model_config` and loads the `.pt` or `.safetensors` checkpoint at `ckpt_path` (if
+        not empty), with the parameters in `dtype` (float32 by default). Returns the model and the global step of
+        the checkpoint.
+
+        The model is created on the meta device and its parameters are assigned the memory-mapped checkpoint
+        tensors, so that neither a random initialization nor a second copy of the weights is materialized. If the
+        checkpoint does not cover every parameter, e.g. because its input channels do not match the config, the
+        model is initialized on `device` and the checkpoint is copied into it instead.
+        """
+        from accelerate import init_empty_weights
+
+        dtype = dtype or torch.float32
+        if ckpt_path == "":
+            return cls.from_config(model_config).to(device=device, dtype=dtype), 0
+
+        zero_rank_log(logger, f"Load from checkpoint: {ckpt_path}")
+        state_dict, resume_global_step = load_checkpoint(ckpt_path, device)
+        if resume_global_step > 0:
+            zero_rank_log(logger, f"resume from global_step: {resume_global_step}")
+
+        with init_empty_weights():
+            unet = cls.from_config(model_config)
+        state_dict = unet.filter_state_dict(state_dict)
+        if set(unet.state_dict()) <= set(state_dict):
+            state_dict = {
+                key: value.to(device=device, dtype=dtype) if value.is_floating_point() else value.to(device)
+                for key, value in state_dict.items()
+            }
+            unet.load_state_dict(state_dict, strict=False, assign=True)
+            # The buffers are not created on the meta device
+            unet = unet.to(device)
         else:
-            resume_global_step = 0
+            unet = cls.from_config(model_config).to(device=device, dtype=dtype)
+            unet.load_state_dict(state_dict, strict=False)
 
         return unet, resume_global_step
+
+
+def load_checkpoint(ckpt_path: str, device="cpu") -> Tuple[dict, int]:
+    """
+    Returns the state dict and the global step of a UNet checkpoint, either a training `.pt` checkpoint or a
+    `.safetensors` file (see `tools/convert_checkpoint_to_safetensors.py`). Both are memory-mapped, except `.pt`
+    files in the legacy serialization format.
+    """
+    if ckpt_path.endswith(".safetensors"):
+        from safetensors import safe_open
+        from safetensors.torch import load_file
+
+        with safe_open(ckpt_path, framework="pt") as f:
+            metadata = f.metadata() or {}
+        return load_file(ckpt_path, device=str(device)), int(metadata.get("global_step", 0))
+
+    try:
+        ckpt = torch.load(ckpt_path, map_location=device, mmap=True)
+    except RuntimeError:
+        # Only checkpoints in the zipfile format can be memory-mapped
+        ckpt = torch.load(ckpt_path, map_location=device)
+    state_dict = ckpt["state_dict"] if "state_dict" in ckpt else ckpt
+    return state_dict, ckpt.get("global_step", 0)
@@ -1,10 +1,9 @@
 # Adapted from https://github.com/guoyww/AnimateDiff/blob/main/animatediff/pipelines/pipeline_animation.py
 
+import contextlib
 import inspect
 import os
-import shutil
-from typing import Callable, List, Optional, Union
-import subprocess
+from typing import Callable, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
@@ -23,18 +22,23 @@ from diffusers.schedulers import (
     EulerDiscreteScheduler,
     LMSDiscreteScheduler,
     PNDMScheduler,
+    SchedulerMixin,
 )
 from diffusers.utils import deprecate, logging
 
 from einops import rearrange
 import cv2
 
-from ..models.unet import UNet3DConditionModel
+from ..models.unet import UNet3DConditionModel, UNetFeatureCache
 from ..utils.image_processor import ImageProcessor
-from ..utils.util import read_video, read_audio, write_video, check_ffmpeg_installed
+from ..utils.util import read_video, read_audio, iter_video_frames, FFmpegVideoWriter, check_ffmpeg_installed
+from ..utils.pipelining import StagedExecutor
+from ..utils.avatar import AvatarBundle, file_digest
+from ..utils.latent_cache import LatentCache, tensor_digest
+from ..utils.memory_planner import MemoryPlanner, attention_slicing
+from ..utils.speech_activity import detect_speech_frames, get_speech_windows, get_crossfade_weights
 from ..whisper.audio2feature import Audio2Feature
 import tqdm
-import soundfile as sf
 
 logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
 
@@ -101,6 +105,19 @@ class LipsyncPipeline(DiffusionPipeline):
 
         self.vae_scale_factor = 2 ** (len(self.vae.config.block_out_channels) - 1)
         self.set_progress_bar_config(desc="Steps")
+        self.latent_cache = None
+
+    def enable_latent_cache(self, max_bytes: int = 1 << 30):
+        """
+        Keeps the VAE latents of the reference faces of the most recently processed windows, up to `max_bytes`,
+        so that running the same video again skips the VAE encoder. The latents are a single sample of the VAE
+        posterior, which is then reused by every run. The hit, miss and eviction counters are on
+        `self.latent_cache`.
+        """
+        self.latent_cache = LatentCache(max_bytes)
+
+    def disable_latent_cache(self):
+        self.latent_cache = None
 
     def enable_vae_slicing(self):
         self.vae.enable_slicing()
@@ -133,10 +150,13 @@ class LipsyncPipeline(DiffusionPipeline):
                 return torch.device(module._hf_hook.execution_device)
         return self.device
 
-    def decode_latents(self, latents):
+    def decode_latents(self, latents, vae_batch_size=None):
         latents = latents / self.vae.config.scaling_factor + self.vae.config.shift_factor
         latents = rearrange(latents, "b c f h w -> (b f) c h w")
-        decoded_latents = self.vae.decode(latents).sample
+        vae_batch_size = vae_batch_size or len(latents)
+        decoded_latents = torch.cat(
+            [self.vae.decode(batch).sample for batch in latents.split(vae_batch_size)], dim=0
+        )
         return decoded_latents
 
     def prepare_extra_step_kwargs(self, generator, eta):
@@ -172,30 +192,84 @@ class LipsyncPipeline(DiffusionPipeline):
         latents = latents * self.scheduler.init_noise_sigma
         return latents
 
-    def prepare_mask_latents(self, mask, masked_image, height, width, dtype, device, generator, do_classifier_free_guidance):
+    def encode_images(self, images, device, dtype, generator, vae_batch_size=None):
+        images = images.to(device=device, dtype=dtype)
+        vae_batch_size = vae_batch_size or len(images)
+        latents = torch.cat(
+            [self.vae.encode(batch).latent_dist.sample(generator=generator) for batch in images.split(vae_batch_size)],
+            dim=0,
+        )
+        latents = (latents - self.vae.config.shift_factor) * self.vae.config.scaling_factor
+        return latents
+
+    def encode_window_latents(
+        self, faces, pixel_values, masked_pixel_values, image_processor, device, dtype, generator, vae_batch_size=None
+    ):
+        """
+        Returns the latents of the masked faces and of the faces, looked up in `self.latent_cache` by the content of
+        the faces, the mask, the VAE and the dtype before running the VAE encoder.
+        """
+        key = (
+            tensor_digest(faces, getattr(image_processor, "mask_image", torch.empty(0))),
+            image_processor.mask,
+            id(self.vae),
+            str(dtype),
+        )
+        window_latents = self.latent_cache.get(key)
+        if window_latents is None:
+            window_latents = (
+                self.encode_images(masked_pixel_values, device, dtype, generator, vae_batch_size),
+                self.encode_images(pixel_values, device, dtype, generator, vae_batch_size),
+            )
+            self.latent_cache.put(key, window_latents)
+        return window_latents
+
+    def prepare_mask_latents(
+        self,
+        mask,
+        masked_image,
+        height,
+        width,
+        dtype,
+        device,
+        generator,
+        do_classifier_free_guidance,
+        num_windows=1,
+        masked_image_latents=None,
+        vae_batch_size=None,
+    ):
         mask = torch.nn.functional.interpolate(
             mask, size=(height // self.vae_scale_factor, width // self.vae_scale_factor)
         )
-        masked_image = masked_image.to(device=device, dtype=dtype)
-        masked_image_latents = self.vae.encode(masked_image).latent_dist.sample(generator=generator)
-        masked_image_latents = (masked_image_latents - self.vae.config.shift_factor) * self.vae.config.scaling_factor
+        if masked_image_latents is None:
+            masked_image_latents = self.encode_images(masked_image, device, dtype, generator, vae_batch_size)
 
         masked_image_latents = masked_image_latents.to(device=device, dtype=dtype)
         mask = mask.to(device=device, dtype=dtype)
 
-        mask = rearrange(mask, "f c h w -> 1 c f h w")
-        masked_image_latents = rearrange(masked_image_latents, "f c h w -> 1 c f h w")
+        mask = rearrange(mask, "(b f) c h w -> b c f h w", b=num_windows)
+        masked_image_latents = rearrange(masked_image_latents, "(b f) c h w -> b c f h w", b=num_windows)
 
         if do_classifier_free_guidance:
             mask = torch.cat([mask] * 2)
             masked_image_latents = torch.cat([masked_image_latents] * 2)
         return mask, masked_image_latents
 
-    def prepare_image_latents(self, images, device, dtype, generator, do_classifier_free_guidance):
-        images = images.to(device=device, dtype=dtype)
-        image_latents = self.vae.encode(images).latent_dist.sample(generator=generator)
-        image_latents = (image_latents - self.vae.config.shift_factor) * self.vae.config.scaling_factor
-        image_latents = rearrange(image_latents, "f c h w -> 1 c f h w")
+    def prepare_image_latents(
+        self,
+        images,
+        device,
+        dtype,
+        generator,
+        do_classifier_free_guidance,
+        num_windows=1,
+        image_latents=None,
+        vae_batch_size=None,
+    ):
+        if image_latents is None:
+            image_latents = self.encode_images(images, device, dtype, generator, vae_batch_size)
+        image_latents = image_latents.to(device=device, dtype=dtype)
+        image_latents = rearrange(image_latents, "(b f) c h w -> b c f h w", b=num_windows)
         if do_classifier_free_guidance:
             image_latents = torch.cat([image_latents] * 2)
         return image_latents
@@ -220,29 +294,67 @@ class LipsyncPipeline(DiffusionPipeline):
         images = images.cpu().numpy()
         return images
 
-    def affine_transform_video(self, video_path):
-        video_frames = read_video(video_path, use_decord=False)
+    def affine_transform_frames(self, video_frames, image_processor: ImageProcessor):
+        if image_processor.landmark_smoothing == "offline":
+            # The smoothing sees all the frames of the call, i.e. of the window batch when streaming. The filter is
+            # not carried across batches: its backward pass would need the frames of the next batch, so each batch
+            # is smoothed on its own and the alignment can jump slightly at the seams between batches
+            video_frames = list(video_frames)
+            smoothed_matrices = list(image_processor.get_affine_matrices_offline(video_frames))
+        else:
+            smoothed_matrices = None
+
+        if image_processor.warp_quality is not None:
+            # Batches of 16 frames keep the float copies of the frames small
+            video_frames = list(video_frames)
+            faces, boxes, affine_matrices = [], [], []
+            for start in range(0, len(video_frames), 16):
+                batch_faces, batch_boxes, batch_affine_matrices = image_processor.affine_transform_batch(
+                    np.stack(video_frames[start : start + 16]),
+                    smoothed_matrices[start : start + 16] if smoothed_matrices is not None else None,
+                )
+                faces.append(batch_faces)
+                boxes.extend(batch_boxes)
+                affine_matrices.extend(batch_affine_matrices)
+            return torch.cat(faces), boxes, affine_matrices
         faces = []
         boxes = []
         affine_matrices = []
-        print(f"Affine transforming {len(video_frames)} faces...")
-        for frame in tqdm.tqdm(video_frames):
-            face, box, affine_matrix = self.image_processor.affine_transform(frame)
+        for index, frame in enumerate(video_frames):
+            face, box, affine_matrix = image_processor.affine_transform(
+                frame, smoothed_matrices[index] if smoothed_matrices is not None else None
+            )
             faces.append(face)
             boxes.append(box)
             affine_matrices.append(affine_matrix)
         faces = torch.stack(faces)
+        return faces, boxes, affine_matrices
+
+    def affine_transform_video(self, video_path, image_processor: ImageProcessor):
+        video_frames = read_video(video_path, use_decord=False)
+        print(f"Affine transforming {len(video_frames)} faces...")
+        faces, boxes, affine_matrices = self.affine_transform_frames(tqdm.tqdm(video_frames), image_processor)
         return faces, video_frames, boxes, affine_matrices
 
-    def restore_video(self, faces, video_frames, boxes, affine_matrices):
+    def restore_video(
+        self,
+        faces,
+        video_frames,
+        boxes,
+        affine_matrices,
+        image_processor: ImageProcessor,
+        superres="none",
+        progress=True,
+    ):
         """
         Replaces the lipsynced faces into the original frames.
         Potential place to do super-resolution on the face patch if needed.
         """
         video_frames = video_frames[: faces.shape[0]]
         out_frames = []
-        print(f"Restoring {len(faces)} faces...")
-        for index, face in enumerate(tqdm.tqdm(faces)):
+        if progress:
+            print(f"Restoring {len(faces)} faces...")
+        for index, face in enumerate(tqdm.tqdm(faces, disable=not progress)):
             x1, y1, x2, y2 = boxes[index]
             height = int(y2 - y1)
             width = int(x2 - x1)
@@ -253,14 +365,14 @@ class LipsyncPipeline(DiffusionPipeline):
             # === SUPERRES ADD START ===
             # If user selected GFPGAN/CodeFormer AND the face is smaller than the region
             # we are about to fill, run superresolution. 
-            if self.superres != "none" and (face_h < height or face_w < width):
+            if superres != "none" and (face_h < height or face_w < width):
                 scale_h = height / face_h
                 scale_w = width / face_w
                 scale_factor = max(scale_h, scale_w)
                 # Convert face (torch tensor) to a NumPy or PIL image, apply SR, convert back:
-                if self.superres == "GFPGAN":
+                if superres == "GFPGAN":
                     face = self.apply_gfpgan_superres(face, scale_factor)
-                elif self.superres == "CodeFormer":
+                elif superres == "CodeFormer":
                     face = self.apply_codeformer_superres(face, scale_factor)
                 # else, default do nothing special
             # === SUPERRES ADD END ===
@@ -272,7 +384,7 @@ class LipsyncPipeline(DiffusionPipeline):
             face = (face * 255).to(torch.uint8).cpu().numpy()
 
             # If your pipeline already does face restoration or alignment:
-            out_frame = self.image_processor.restorer.restore_img(
+            out_frame = image_processor.restorer.restore_img(
                 video_frames[index], face, affine_matrices[index]
             )
             out_frames.append(out_frame)
@@ -338,6 +450,847 @@ class LipsyncPipeline(DiffusionPipeline):
         return restored_torch
     # === SUPERRES ADD END ===
 
+    @staticmethod
+    def get_guidance_schedule(num_steps, guidance_interval=(0.0, 1.0), guidance_every=1, enabled=True):
+        """
+        Returns for every denoising step whether it runs both the unconditional and the conditional UNet branches.
+        Step `j` does if its position `j / (num_steps - 1)` in the schedule is within `guidance_interval` and it is
+        one of every `guidance_every` steps of the interval. The other steps only run the conditional branch and
+        reuse the difference between the branches of the last guided step, if any.
+        """
+        if not enabled:
+            return [False] * num_steps
+        interval_start, interval_end = guidance_interval
+        schedule = []
+        num_interval_steps = 0
+        for j in range(num_steps):
+            position = j / max(num_steps - 1, 1)
+            in_interval = interval_start <= position <= interval_end
+            schedule.append(in_interval and num_interval_steps % guidance_every == 0)
+            num_interval_steps += in_interval
+        return schedule
+
+    def prepare_audio_embeds(self, whisper_chunks, device, dtype, do_classifier_free_guidance):
+        if not self.unet.add_audio_layer:
+            return None
+        audio_embeds = whisper_chunks if torch.is_tensor(whisper_chunks) else torch.stack(whisper_chunks)
+        audio_embeds = audio_embeds.to(device, dtype=dtype)
+        if do_classifier_free_guidance:
+            null_audio_embeds = torch.zeros_like(audio_embeds)
+            audio_embeds = torch.cat([null_audio_embeds, audio_embeds])
+        return audio_embeds
+
+    def denoise_window(
+        self,
+        inference_faces: torch.Tensor,
+        whisper_chunks: Optional[Union[torch.Tensor, List[torch.Tensor]]],
+        latents: torch.Tensor,
+        num_inference_steps: int,
+        guidance_scale: float,
+        height: int,
+        width: int,
+        weight_dtype: torch.dtype,
+        device: torch.device,
+        generator: Optional[torch.Generator],
+        extra_step_kwargs: dict,
+        image_processor: ImageProcessor,
+        scheduler: SchedulerMixin,
+        callback: Optional[Callable[[int, int, torch.FloatTensor], None]] = None,
+        callback_steps: int = 1,
+        guidance_interval: Tuple[float, float] = (0.0, 1.0),
+        guidance_every: int = 1,
+        deep_cache_interval: int = 1,
+        warm_start_strength: float = 1.0,
+        warm_start_from: str = "window",
+        init_latents: Optional[torch.Tensor] = None,
+        window_latents: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+        vae_batch_size: Optional[int] = None,
+        window_batcher=None,
+    ):
+        """
+        Runs the whole denoising loop for one or several consecutive windows of aligned faces. The windows are
+        stacked along the batch dimension and share the initial `latents` of a single window, unless `latents` (and
+        `init_latents`) hold those of every window. Returns the denoised
+        latents together with the pixel values and masks of the faces, which `decode_window` needs to paste the
+        surrounding pixels back. `scheduler` must already have its timesteps set and is owned by the caller, so that
+        concurrent calls do not share its state. `window_latents` optionally holds the precomputed (f, c, h, w)
+        latents of the masked faces and of the faces, e.g. from an avatar bundle, to skip the VAE encoding.
+        See `get_guidance_schedule` for `guidance_interval` and `guidance_every`, and `UNetFeatureCache` for
+        `deep_cache_interval`. The VAE encodes at most `vae_batch_size` frames at once if given.
+
+        If `init_latents`, the final (1, c, f, h, w) latents of a previous window, are given and
+        `warm_start_strength < 1`, the windows start from these latents noised to the timestep at
+        `warm_start_strength` of the schedule, and only that last part of the schedule runs. With
+        `warm_start_from="last_frame"` the latents of the last frame are used for every frame.
+
+        With a `window_batcher` (see `WindowBatcher`), the windows are handed over to it and denoised in the same
+        UNet calls as the windows of other concurrent calls with compatible settings, and this call waits for them.
+        """
+        if window_batcher is not None:
+            return window_batcher.denoise_window(
+                inference_faces,
+                whisper_chunks,
+                latents=latents,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                height=height,
+                width=width,
+                weight_dtype=weight_dtype,
+                device=device,
+                generator=generator,
+                extra_step_kwargs=extra_step_kwargs,
+                image_processor=image_processor,
+                scheduler=scheduler,
+                callback=callback,
+                callback_steps=callback_steps,
+                guidance_interval=guidance_interval,
+                guidance_every=guidance_every,
+                deep_cache_interval=deep_cache_interval,
+                warm_start_strength=warm_start_strength,
+                warm_start_from=warm_start_from,
+                init_latents=init_latents,
+                window_latents=window_latents,
+                vae_batch_size=vae_batch_size,
+            )
+
+        do_classifier_free_guidance = guidance_scale > 1.0
+        timesteps = scheduler.timesteps
+        guidance_schedule = self.get_guidance_schedule(
+            len(timesteps), guidance_interval, guidance_every, do_classifier_free_guidance
+        )
+        num_windows = inference_faces.shape[0] // latents.shape[2]
+        if latents.shape[0] == 1:
+            latents = latents.repeat(num_windows, 1, 1, 1, 1)
+
+        if init_latents is not None and warm_start_strength < 1.0:
+            num_steps = min(max(int(num_inference_steps * warm_start_strength), 1), num_inference_steps)
+            timesteps = timesteps[len(timesteps) - num_steps * scheduler.order :]
+            guidance_schedule = guidance_schedule[len(guidance_schedule) - len(timesteps) :]
+            if warm_start_from == "last_frame":
+                init_latents = init_latents[:, :, -1:].expand(-1, -1, latents.shape[2], -1, -1)
+            init_latents = init_latents.expand(num_windows, -1, -1, -1, -1)
+            # `latents` holds the initial noise, which is reused to noise the previous result
+            latents = scheduler.add_noise(init_latents, latents, timesteps[:1])
+        else:
+            num_steps = num_inference_steps
+        audio_embeds = self.prepare_audio_embeds(whisper_chunks, device, weight_dtype, do_classifier_free_guidance)
+
+        pixel_values, masked_pixel_values, masks = image_processor.prepare_masks_and_masked_images(
+            inference_faces, affine_transform=False
+        )
+        if window_latents is None and self.latent_cache is not None:
+            window_latents = self.encode_window_latents(
+                inference_faces,
+                pixel_values,
+                masked_pixel_values,
+                image_processor,
+                device,
+                weight_dtype,
+                generator,
+                vae_batch_size,
+            )
+
+        mask_latents, masked_image_latents = self.prepare_mask_latents(
+            masks,
+            masked_pixel_values,
+            height,
+            width,
+            weight_dtype,
+            device,
+            generator,
+            do_classifier_free_guidance,
+            num_windows,
+            masked_image_latents=window_latents[0] if window_latents is not None else None,
+            vae_batch_size=vae_batch_size,
+        )
+
+        image_latents = self.prepare_image_latents(
+            pixel_values,
+            device,
+            weight_dtype,
+            generator,
+            do_classifier_free_guidance,
+            num_windows,
+            image_latents=window_latents[1] if window_latents is not None else None,
+            vae_batch_size=vae_batch_size,
+        )
+
+        # The conditioning latents and audio embeds of the conditional branch alone, for the steps without guidance
+        condition_latents = torch.cat([mask_latents, masked_image_latents, image_latents], dim=1)
+        if do_classifier_free_guidance:
+            single_condition_latents = condition_latents.chunk(2)[1]
+            single_audio_embeds = audio_embeds.chunk(2)[1] if audio_embeds is not None else None
+        else:
+            single_condition_latents = condition_latents
+            single_audio_embeds = audio_embeds
+
+        feature_cache = UNetFeatureCache(deep_cache_interval) if deep_cache_interval > 1 else None
+        guidance_delta = None
+        num_warmup_steps = len(timesteps) - num_steps * scheduler.order
+        with self.progress_bar(total=num_steps) as progress_bar:
+            for j, t in enumerate(timesteps):
+                if guidance_schedule[j]:
+                    latent_model_input = torch.cat([latents] * 2)
+                    latent_model_input = scheduler.scale_model_input(latent_model_input, t)
+                    latent_model_input = torch.cat([latent_model_input, condition_latents], dim=1)
+                    noise_pred = self.unet(
+                        latent_model_input, t, encoder_hidden_states=audio_embeds, feature_cache=feature_cache
+                    ).sample
+
+                    noise_pred_uncond, noise_pred_audio = noise_pred.chunk(2)
+                    guidance_delta = noise_pred_audio - noise_pred_uncond
+                    noise_pred = noise_pred_uncond + guidance_scale * guidance_delta
+                else:
+                    latent_model_input = scheduler.scale_model_input(latents, t)
+                    latent_model_input = torch.cat([latent_model_input, single_condition_latents], dim=1)
+                    noise_pred = self.unet(
+                        latent_model_input, t, encoder_hidden_states=single_audio_embeds, feature_cache=feature_cache
+                    ).sample
+
+                    # Reuse the guidance of the last step that ran both branches
+                    if guidance_delta is not None:
+                        noise_pred = noise_pred + (guidance_scale - 1) * guidance_delta
+
+                latents = scheduler.step(noise_pred, t, latents, **extra_step_kwargs).prev_sample
+
+                if j == len(timesteps) - 1 or ((j + 1) > num_warmup_steps and (j + 1) % scheduler.order == 0):
+                    progress_bar.update()
+                    if callback is not None and j % callback_steps == 0:
+                        callback(j, t, latents)
+
+        return latents, pixel_values, masks
+
+    def decode_window(self, latents, pixel_values, masks, device, weight_dtype, vae_batch_size=None):
+        decoded_latents = self.decode_latents(latents, vae_batch_size)
+        decoded_latents = self.paste_surrounding_pixels_back(
+            decoded_latents, pixel_values, 1 - masks, device, weight_dtype
+        )
+        return decoded_latents
+
+    def _run_eager(
+        self,
+        video_path,
+        whisper_feature,
+        video_writer,
+        num_frames,
+        video_fps,
+        windows_per_batch,
+        denoise_kwargs,
+        superres,
+    ):
+        image_processor = denoise_kwargs["image_processor"]
+        faces, original_video_frames, boxes, affine_matrices = self.affine_transform_video(video_path, image_processor)
+
+        if self.unet.add_audio_layer:
+            whisper_chunks = self.audio_encoder.feature2chunks(feature_array=whisper_feature, fps=video_fps)
+            num_inferences = min(len(faces), len(whisper_chunks)) // num_frames
+        else:
+            num_inferences = len(faces) // num_frames
+
+        synced_video_frames = []
+        init_latents = None
+        for i in tqdm.tqdm(range(0, num_inferences, windows_per_batch), desc="Doing inference..."):
+            start = i * num_frames
+            end = min(i + windows_per_batch, num_inferences) * num_frames
+            window_chunks = whisper_chunks[start:end] if self.unet.add_audio_layer else None
+            latents, pixel_values, masks = self.denoise_window(
+                faces[start:end], window_chunks, init_latents=init_latents, **denoise_kwargs
+            )
+            init_latents = latents[-1:]
+            synced_video_frames.append(
+                self.decode_window(
+                    latents,
+                    pixel_values,
+                    masks,
+                    denoise_kwargs["device"],
+                    denoise_kwargs["weight_dtype"],
+                    denoise_kwargs["vae_batch_size"],
+                )
+            )
+
+        # Combine and restore the faces onto the original frames
+        video_writer.write(
+            self.restore_video(
+                torch.cat(synced_video_frames),
+                original_video_frames,
+                boxes,
+                affine_matrices,
+                image_processor,
+                superres=superres,
+            )
+        )
+
+    def _slice_whisper_chunks(self, whisper_feature, frame_indices, video_fps):
+        if not self.unet.add_audio_layer:
+            return None
+        return self.audio_encoder.get_sliced_features(whisper_feature, frame_indices, fps=video_fps)
+
+    @staticmethod
+    def _get_active_frames(speech_windows, start, num_windows, num_frames):
+        """Indices, within a batch of windows, of the frames of the windows that are not skipped as silent"""
+        active_windows = np.arange(num_windows)
+        if speech_windows is not None:
+            active_windows = active_windows[speech_windows[start : start + num_windows]]
+        return (active_windows[:, None] * num_frames + np.arange(num_frames)).reshape(-1)
+
+    def _run_staged(
+        self,
+        windows,
+        prepare_stage,
+        video_writer,
+        num_frames,
+        denoise_kwargs,
+        superres,
+        pipelined,
+        pipeline_queue_size,
+        crossfade_weights=None,
+    ):
+        """
+        Runs `windows` through `prepare_stage`, then through the denoising, restoring and encoding stages.
+        `prepare_stage` must return, for a batch of windows, the index of its first frame, its video frames, the
+        indices of the frames to lipsync (the others are silent and written as is) and, for these frames only, the
+        faces, boxes, affine matrices, whisper chunks and precomputed VAE latents (or None).
+        `crossfade_weights` optionally holds the per frame weights of the lipsynced frames against the original ones.
+        """
+        image_processor = denoise_kwargs["image_processor"]
+        # Final latents of the last denoised window and the index of that window, to warm start the next ones
+        denoise_state = dict(init_latents=None, window_index=None)
+        skip_stats = dict(processed=0, skipped=0)
+
+        def denoise_stage(window):
+            start_frame, video_frames, active_frames = window[:3]
+            faces, boxes, affine_matrices, whisper_chunks, window_latents = window[3:]
+            skip_stats["processed"] += len(active_frames) // num_frames
+            skip_stats["skipped"] += (len(video_frames) - len(active_frames)) // num_frames
+            if len(active_frames) == 0:
+                return start_frame, video_frames, active_frames, None, None, None, None, None
+
+            # The previous result is too far away to warm start from after a silence, so a window only warm starts
+            # if every window since the last denoised one was denoised too. Once a window of the batch follows a
+            # silence, so do all the next ones, hence the windows to warm start are a prefix of the batch.
+            window_indices = (start_frame + active_frames[::num_frames]) // num_frames
+            num_warm_windows = 0
+            if denoise_state["init_latents"] is not None:
+                expected_index = denoise_state["window_index"] + 1
+                for window_index in window_indices:
+                    if window_index != expected_index:
+                        break
+                    num_warm_windows += 1
+                    expected_index += 1
+
+            results = []
+            for group_start, group_end, init_latents in [
+                (0, num_warm_windows, denoise_state["init_latents"]),
+                (num_warm_windows, len(window_indices), None),
+            ]:
+                if group_start == group_end:
+                    continue
+                frames = slice(group_start * num_frames, group_end * num_frames)
+                results.append(
+                    self.denoise_window(
+                        faces[frames],
+                        whisper_chunks[frames] if whisper_chunks is not None else None,
+                        window_latents=(
+                            tuple(tensor[frames] for tensor in window_latents)
+                            if window_latents is not None
+                            else None
+                        ),
+                        init_latents=init_latents,
+                        **denoise_kwargs,
+                    )
+                )
+            latents, pixel_values, masks = (torch.cat(tensors) for tensors in zip(*results))
+            denoise_state["init_latents"] = latents[-1:]
+            denoise_state["window_index"] = int(window_indices[-1])
+            return start_frame, video_frames, active_frames, boxes, affine_matrices, latents, pixel_values, masks
+
+        def restore_stage(window):
+            start_frame, video_frames, active_frames, boxes, affine_matrices, latents, pixel_values, masks = window
+            if len(active_frames) == len(video_frames):
+                out_frames = np.empty_like(video_frames)
+            else:
+                out_frames = video_frames.copy()
+            if len(active_frames) > 0:
+                decoded_latents = self.decode_window(
+                    latents,
+                    pixel_values,
+                    masks,
+                    denoise_kwargs["device"],
+                    denoise_kwargs["weight_dtype"],
+                    denoise_kwargs["vae_batch_size"],
+                )
+                out_frames[active_frames] = self.restore_video(
+                    decoded_latents,
+                    video_frames[active_frames],
+                    boxes,
+                    affine_matrices,
+                    image_processor,
+                    superres=superres,
+                    progress=False,
+                )
+            if crossfade_weights is not None:
+                weights = crossfade_weights[start_frame : start_frame + len(video_frames)]
+                for index in np.flatnonzero((weights > 0) & (weights < 1)):
+                    out_frames[index] = np.round(
+                        weights[index] * out_frames[index] + (1 - weights[index]) * video_frames[index]
+                    ).astype(out_frames.dtype)
+            return out_frames
+
+        progress = tqdm.tqdm(desc="Doing inference...", unit="window")
+
+        def encode_stage(restored_frames):
+            video_writer.write(restored_frames)
+            progress.update(len(restored_frames) // num_frames)
+
+        # Grad mode is thread local, so every stage has to disable it by itself
+        executor = StagedExecutor(
+            [
+                ("align", torch.no_grad()(prepare_stage)),
+                ("denoise", torch.no_grad()(denoise_stage)),
+                ("restore", torch.no_grad()(restore_stage)),
+                ("encode", encode_stage),
+            ],
+            queue_size=pipeline_queue_size,
+        )
+        stage_stats = executor.run(windows, threaded=pipelined)
+        progress.close()
+        if pipelined:
+            print("Pipeline stage stats:")
+            for stats in stage_stats:
+                print(f"    {stats}")
+        if crossfade_weights is not None:
+            # Estimated from the time the alignment, denoising and restoring stages spent per lipsynced window
+            busy_time = sum(stats.busy_time for stats in stage_stats[:3])
+            time_per_window = busy_time / skip_stats["processed"] if skip_stats["processed"] > 0 else 0.0
+            num_windows = skip_stats["processed"] + skip_stats["skipped"]
+            print(
+                f"Skipped {skip_stats['skipped']}/{num_windows} silent windows, "
+                f"saving about {skip_stats['skipped'] * time_per_window:.1f}s"
+            )
+
+    def _run_streaming(
+        self,
+        video_path,
+        whisper_feature,
+        video_writer,
+        num_frames,
+        video_fps,
+        windows_per_batch,
+        denoise_kwargs,
+        superres,
+        pipelined,
+        pipeline_queue_size,
+        speech_frames=None,
+        crossfade_frames=0,
+    ):
+        image_processor = denoise_kwargs["image_processor"]
+        if self.unet.add_audio_layer:
+            num_whisper_chunks = self.audio_encoder.get_num_chunks(whisper_feature, fps=video_fps)
+            max_windows = num_whisper_chunks // num_frames
+        else:
+            max_windows = float("inf")
+
+        speech_windows = crossfade_weights = None
+        if speech_frames is not None:
+            # Windows past the end of the audio are never reached, so the audio length bounds the windows to check
+            num_speech_windows = int(min(max_windows, -(-len(speech_frames) // num_frames)))
+            speech_windows = get_speech_windows(speech_frames, num_speech_windows, num_frames)
+            crossfade_weights = get_crossfade_weights(speech_windows, num_frames, crossfade_frames)
+
+        def iter_windows():
+            frame_chunks = iter_video_frames(video_path, num_frames * windows_per_batch)
+            start = 0
+            try:
+                for video_frames in frame_chunks:
+                    num_windows = int(min(len(video_frames) // num_frames, max_windows - start))
+                    if speech_windows is not None:
+                        num_windows = min(num_windows, len(speech_windows) - start)
+                    if num_windows <= 0:
+                        break
+                    yield start, video_frames[: num_windows * num_frames]
+                    start += num_windows
+            finally:
+                frame_chunks.close()
+
+        def align_stage(window):
+            start, video_frames = window
+            active_frames = self._get_active_frames(speech_windows, start, len(video_frames) // num_frames, num_frames)
+            if len(active_frames) == 0:
+                return start * num_frames, video_frames, active_frames, None, None, None, None, None
+            whisper_chunks = self._slice_whisper_chunks(whisper_feature, start * num_frames + active_frames, video_fps)
+            faces, boxes, affine_matrices = self.affine_transform_frames(video_frames[active_frames], image_processor)
+            return start * num_frames, video_frames, active_frames, faces, boxes, affine_matrices, whisper_chunks, None
+
+        self._run_staged(
+            iter_windows(),
+            align_stage,
+            video_writer,
+            num_frames,
+            denoise_kwargs,
+            superres,
+            pipelined,
+            pipeline_queue_size,
+            crossfade_weights=crossfade_weights,
+        )
+
+    def _run_avatar(
+        self,
+        bundle,
+        whisper_feature,
+        video_writer,
+        num_frames,
+        windows_per_batch,
+        denoise_kwargs,
+        superres,
+        pipelined,
+        pipeline_queue_size,
+        speech_frames=None,
+        crossfade_frames=0,
+    ):
+        video_fps = bundle.meta["fps"]
+        num_windows = len(bundle) // num_frames
+        if self.unet.add_audio_layer:
+            num_whisper_chunks = self.audio_encoder.get_num_chunks(whisper_feature, fps=video_fps)
+            num_windows = min(num_windows, num_whisper_chunks // num_frames)
+
+        speech_windows = crossfade_weights = None
+        if speech_frames is not None:
+            speech_windows = get_speech_windows(speech_frames, num_windows, num_frames)
+            crossfade_weights = get_crossfade_weights(speech_windows, num_frames, crossfade_frames)
+
+        image_processor = denoise_kwargs["image_processor"]
+
+        def load_stage(window):
+            start, video_frames = window
+            end = min(start + windows_per_batch, num_windows)
+            start_frame = start * num_frames
+            # The last chunk of the video may hold frames past the last whole window
+            video_frames = video_frames[: (end - start) * num_frames]
+            active_frames = self._get_active_frames(speech_windows, start, end - start, num_frames)
+            if len(active_frames) == 0:
+                return start_frame, video_frames, active_frames, None, None, None, None, None
+            whisper_chunks = self._slice_whisper_chunks(whisper_feature, start_frame + active_frames, video_fps)
+            # Copy the arrays out of the memory-mapped ones
+            frame_indices = start_frame + active_frames
+            # Warping with the stored matrices gives the faces `prepare_avatar` encoded, without detecting them again
+            faces = torch.stack(
+                [
+                    image_processor.affine_transform(video_frames[index], bundle.affine_matrices[frame_index])[0]
+                    for index, frame_index in zip(active_frames, frame_indices)
+                ]
+            )
+            window_latents = (
+                torch.from_numpy(bundle.masked_image_latents[frame_indices]),
+                torch.from_numpy(bundle.image_latents[frame_indices]),
+            )
+            return (
+                start_frame,
+                video_frames,
+                active_frames,
+                faces,
+                bundle.boxes[frame_indices],
+                bundle.affine_matrices[frame_indices],
+                whisper_chunks,
+                window_latents,
+            )
+
+        # The frames are decoded again from the source video, one batch of windows at a time
+        video_chunks = iter_video_frames(bundle.source_video, windows_per_batch * num_frames)
+        self._run_staged(
+            zip(range(0, num_windows, windows_per_batch), video_chunks),
+            load_stage,
+            video_writer,
+            num_frames,
+            denoise_kwargs,
+            superres,
+            pipelined,
+            pipeline_queue_size,
+            crossfade_weights=crossfade_weights,
+        )
+
+    def _plan_memory(self, memory_budget, height, width, num_frames, guidance_scale, weight_dtype, windows_per_batch):
+        """
+        Returns the `MemoryPlan` that fits the run in `memory_budget` bytes, or None if there is no budget or the
+        pipeline does not run on CUDA (`load_pipeline` falls back to the CPU without it), in which case the budget
+        is ignored.
+        The plan's attention slice size is applied by `_attention_slicing` for the duration of the run only.
+        """
+        device = self._execution_device
+        if memory_budget is None:
+            return None
+        if device.type != "cuda":
+            print(f"Ignoring the memory budget, the pipeline runs on {device.type}")
+            return None
+        planner = MemoryPlanner(self, height, width, weight_dtype, device)
+        plan = planner.plan(
+            memory_budget,
+            num_frames=num_frames,
+            do_classifier_free_guidance=guidance_scale > 1.0,
+            max_windows_per_batch=windows_per_batch,
+        )
+        print(f"Memory budget {memory_budget / 2**30:.2f}GiB: {plan}")
+        torch.cuda.reset_peak_memory_stats(device)
+        return plan
+
+    def _attention_slicing(self, plan):
+        # The slicing is a setting of the shared UNet modules, so concurrent calls with different plans still interfere
+        if plan is None:
+            return contextlib.nullcontext()
+        return attention_slicing(self.unet, plan.attention_slice_size)
+
+    def _report_memory_plan(self, plan):
+        if plan is None:
+            return
+        observed_peak = torch.cuda.max_memory_allocated(self._execution_device)
+        print(
+            f"Peak memory: predicted {plan.predicted_peak_bytes / 2**30:.2f}GiB, "
+            f"observed {observed_peak / 2**30:.2f}GiB"
+        )
+
+    def _prepare_run(
+        self,
+        audio_path,
+        image_processor,
+        num_frames,
+        height,
+        width,
+        num_inference_steps,
+        weight_dtype,
+        eta,
+        generator,
+        **denoise_options,
+    ):
+        """
+        Reads the audio and prepares everything `denoise_window` needs that does not depend on the video.
+        Returns the audio samples, the whisper features (None without audio layers) and the `denoise_window` kwargs,
+        which include `denoise_options` as is.
+        """
+        device = self._execution_device
+
+        # The scheduler holds the timesteps, so every call works on its own copy
+        scheduler = self.scheduler.__class__.from_config(self.scheduler.config)
+        scheduler.set_timesteps(num_inference_steps, device=device)
+        extra_step_kwargs = self.prepare_extra_step_kwargs(generator, eta)
+
+        audio_samples = read_audio(audio_path)
+
+        if self.unet.add_audio_layer:
+            whisper_feature = self.audio_encoder.audio2feat(audio_path, audio_samples)
+        else:
+            whisper_feature = None
+
+        # Every window starts from the same noise, so it is sampled once for a single window
+        num_channels_latents = self.vae.config.latent_channels
+        latents = self.prepare_latents(
+            1,
+            num_frames,
+            num_channels_latents,
+            height,
+            width,
+            weight_dtype,
+            device,
+            generator,
+        )
+
+        denoise_kwargs = dict(
+            latents=latents,
+            num_inference_steps=num_inference_steps,
+            height=height,
+            width=width,
+            weight_dtype=weight_dtype,
+            device=device,
+            generator=generator,
+            extra_step_kwargs=extra_step_kwargs,
+            image_processor=image_processor,
+            scheduler=scheduler,
+            **denoise_options,
+        )
+        return audio_samples, whisper_feature, denoise_kwargs
+
+    @torch.no_grad()
+    def prepare_avatar(
+        self,
+        video_path: str,
+        bundle_dir: Optional[str] = None,
+        height: Optional[int] = None,
+        mask: str = "fix_mask",
+        weight_dtype: Optional[torch.dtype] = torch.float16,
+        generator: Optional[torch.Generator] = None,
+        vae_batch_size: int = 16,
+        fa=None,
+    ) -> AvatarBundle:
+        """
+        Runs everything that only depends on the video (face alignment, masking and VAE encoding) once and returns
+        it as an `AvatarBundle`, saved to `bundle_dir` if given. `lipsync_avatar` then dubs the bundle with any audio
+        without repeating that work. Only the per-frame matrices, boxes and latents are kept, the frames and faces
+        of a batch are dropped once it is encoded.
+        """
+        check_ffmpeg_installed()
+        if mask != "fix_mask":
+            raise ValueError("Avatar bundles require the fix_mask mask")
+
+        height = height or self.unet.config.sample_size * self.vae_scale_factor
+        self.check_inputs(height, height, 1)
+        device = self._execution_device
+        image_processor = ImageProcessor(height, mask=mask, device="cuda", fa=fa)
+
+        boxes, affine_matrices, image_latents, masked_image_latents = [], [], [], []
+        print(f"Preparing avatar from {video_path}...")
+        for video_frames in tqdm.tqdm(iter_video_frames(video_path, vae_batch_size), unit="batch"):
+            batch_faces, batch_boxes, batch_affine_matrices = self.affine_transform_frames(
+                video_frames, image_processor
+            )
+            pixel_values, masked_pixel_values, _ = image_processor.prepare_masks_and_masked_images(
+                batch_faces, affine_transform=False
+            )
+            batch_image_latents = self.encode_images(pixel_values, device, weight_dtype, generator)
+            batch_masked_image_latents = self.encode_images(masked_pixel_values, device, weight_dtype, generator)
+
+            boxes.extend(batch_boxes)
+            affine_matrices.extend(batch_affine_matrices)
+            image_latents.append(batch_image_latents.half().cpu().numpy())
+            masked_image_latents.append(batch_masked_image_latents.half().cpu().numpy())
+
+        if len(affine_matrices) == 0:
+            raise RuntimeError(f"No frames could be read from {video_path}")
+
+        bundle = AvatarBundle(
+            boxes=np.array(boxes, dtype=np.int64),
+            affine_matrices=np.stack(affine_matrices),
+            image_latents=np.concatenate(image_latents),
+            masked_image_latents=np.concatenate(masked_image_latents),
+            meta=dict(
+                source_video=os.path.abspath(video_path),
+                source_size=os.path.getsize(video_path),
+                source_sha256=file_digest(video_path),
+                fps=25,
+                resolution=height,
+                mask=mask,
+                vae_scaling_factor=self.vae.config.scaling_factor,
+                vae_shift_factor=self.vae.config.shift_factor,
+            ),
+        )
+        if bundle_dir is not None:
+            bundle.save(bundle_dir)
+            print(f"Avatar bundle of {len(bundle)} frames saved to {bundle_dir}")
+        return bundle
+
+    @torch.no_grad()
+    def lipsync_avatar(
+        self,
+        bundle: Union[AvatarBundle, str],
+        audio_path: str,
+        video_out_path: str,
+        num_frames: int = 16,
+        audio_sample_rate: int = 16000,
+        num_inference_steps: int = 20,
+        guidance_scale: float = 1.5,
+        weight_dtype: Optional[torch.dtype] = torch.float16,
+        eta: float = 0.0,
+        generator: Optional[Union[torch.Generator, List[torch.Generator]]] = None,
+        callback: Optional[Callable[[int, int, torch.FloatTensor], None]] = None,
+        callback_steps: Optional[int] = 1,
+        superres: str = "none",
+        pipelined: bool = False,
+        pipeline_queue_size: int = 2,
+        windows_per_batch: int = 1,
+        guidance_interval: Tuple[float, float] = (0.0, 1.0),
+        guidance_every: int = 1,
+        deep_cache_interval: int = 1,
+        warm_start_strength: float = 1.0,
+        warm_start_from: str = "window",
+        skip_silent_windows: bool = False,
+        silence_threshold_db: float = -45.0,
+        crossfade_frames: int = 4,
+        memory_budget: Optional[int] = None,
+        window_batcher=None,
+    ):
+        """
+        Same as `__call__`, but starts from an `AvatarBundle` (or the directory it was saved to) made by
+        `prepare_avatar`, so that only the audio encoding, the denoising and the restoring run. The output is
+        written window by window like with `streaming=True`, and silent windows can be skipped the same way.
+        """
+        if isinstance(bundle, str):
+            bundle = AvatarBundle.load(bundle)
+        bundle.check_source()
+        if (
+            bundle.meta["vae_scaling_factor"] != self.vae.config.scaling_factor
+            or bundle.meta["vae_shift_factor"] != self.vae.config.shift_factor
+        ):
+            raise ValueError("The avatar bundle was prepared with a differently configured VAE")
+
+        is_train = self.unet.training
+        self.unet.eval()
+
+        check_ffmpeg_installed()
+
+        height = width = bundle.meta["resolution"]
+        self.check_inputs(height, width, callback_steps)
+        self.set_progress_bar_config(desc=f"Sample frames: {num_frames}")
+
+        memory_plan = self._plan_memory(
+            memory_budget, height, width, num_frames, guidance_scale, weight_dtype, windows_per_batch
+        )
+        if memory_plan is not None:
+            windows_per_batch = memory_plan.windows_per_batch
+
+        # The faces are already aligned, so the image processor does not need the landmark detector
+        image_processor = ImageProcessor(height, mask=bundle.meta["mask"], device="cpu")
+        audio_samples, whisper_feature, denoise_kwargs = self._prepare_run(
+            audio_path,
+            image_processor,
+            num_frames,
+            height,
+            width,
+            num_inference_steps,
+            weight_dtype,
+            eta,
+            generator,
+            guidance_scale=guidance_scale,
+            callback=callback,
+            callback_steps=callback_steps,
+            guidance_interval=guidance_interval,
+            guidance_every=guidance_every,
+            deep_cache_interval=deep_cache_interval,
+            warm_start_strength=warm_start_strength,
+            warm_start_from=warm_start_from,
+            vae_batch_size=memory_plan.vae_batch_size if memory_plan is not None else None,
+            window_batcher=window_batcher,
+        )
+        speech_frames = (
+            detect_speech_frames(
+                audio_samples, audio_sample_rate, bundle.meta["fps"], threshold_db=silence_threshold_db
+            )
+            if skip_silent_windows
+            else None
+        )
+
+        with self._attention_slicing(memory_plan), FFmpegVideoWriter(
+            video_out_path,
+            fps=bundle.meta["fps"],
+            audio_samples=audio_samples,
+            audio_sample_rate=audio_sample_rate,
+            shortest=True,
+        ) as video_writer:
+            self._run_avatar(
+                bundle,
+                whisper_feature,
+                video_writer,
+                num_frames,
+                windows_per_batch,
+                denoise_kwargs,
+                superres,
+                pipelined,
+                pipeline_queue_size,
+                speech_frames=speech_frames,
+                crossfade_frames=crossfade_frames,
+            )
+
+        self._report_memory_plan(memory_plan)
+
+        if is_train:
+            self.unet.train()
+
     @torch.no_grad()
     def __call__(
         self,
@@ -359,27 +1312,79 @@ class LipsyncPipeline(DiffusionPipeline):
         callback: Optional[Callable[[int, int, torch.FloatTensor], None]] = None,
         callback_steps: Optional[int] = 1,
         superres: str = "none",  # <--- ADDED
+        streaming: bool = False,
+        pipelined: bool = False,
+        pipeline_queue_size: int = 2,
+        windows_per_batch: int = 1,
+        guidance_interval: Tuple[float, float] = (0.0, 1.0),
+        guidance_every: int = 1,
+        deep_cache_interval: int = 1,
+        warm_start_strength: float = 1.0,
+        warm_start_from: str = "window",
+        skip_silent_windows: bool = False,
+        silence_threshold_db: float = -45.0,
+        crossfade_frames: int = 4,
+        memory_budget: Optional[int] = None,
+        vae_batch_size: Optional[int] = None,
+        warp_quality: Optional[str] = None,
+        track_landmarks: bool = False,
+        landmark_smoothing: str = "causal",
+        fa=None,
+        window_batcher=None,
         **kwargs,
     ):
         """
         superres: "none", "GFPGAN", or "CodeFormer"
+        streaming: if True, frames are read, aligned, denoised, restored and written one window at a time,
+            so that the peak memory does not grow with the length of the video.
+        pipelined: like `streaming`, but the alignment, denoising, decoding/restoring and encoding stages run
+            concurrently in their own threads, connected by queues of at most `pipeline_queue_size` windows.
+            The output is the same as with `streaming`.
+        windows_per_batch: number of `num_frames` windows stacked along the batch dimension of every UNet and VAE
+            call. The last batch may hold fewer windows. Results match `windows_per_batch=1` up to numerical
+            tolerance (the VAE posterior noise is drawn in a different order).
+        guidance_interval, guidance_every: with `guidance_scale > 1`, only the steps whose position in the schedule
+            (from 0 to 1) is within `guidance_interval`, and among them one step in `guidance_every`, run the
+            unconditional UNet branch. The other steps reuse the guidance of the last step that did. The defaults
+            apply classifier-free guidance at every step.
+        deep_cache_interval: if greater than 1, only one denoising step in `deep_cache_interval` runs the whole UNet,
+            the others reuse its deep features and only run the outermost blocks (see `UNetFeatureCache`).
+        warm_start_strength: if lower than 1, every window but the first starts from the final latents of the
+            previous one (the last window of the previous batch with `windows_per_batch > 1`), noised to this
+            fraction of the schedule, and only runs that fraction of the denoising steps.
+        warm_start_from: "window" to start each frame from the same frame of the previous window, or
+            "last_frame" to start all the frames from the last frame of the previous window.
+        skip_silent_windows: windows without speech in the audio (see `detect_speech_frames`, with
+            `silence_threshold_db`) are not aligned, denoised nor restored and the original frames are written
+            instead, blended with the lipsynced frames over `crossfade_frames` frames at the boundaries. Implies
+            `streaming`.
+        memory_budget: if given, in bytes, the attention slice size, the VAE micro-batch size and the number of
+            windows per batch (at most `windows_per_batch`) are chosen by `MemoryPlanner` so that the peak CUDA
+            memory stays within the budget. The plan and its predicted and observed peaks are printed. Overrides
+            `vae_batch_size`, the number of frames the VAE encodes or decodes at once (all of them by default).
+        warp_quality: if given, the faces of every window are aligned by a single batched `grid_sample` with
+            this quality of `WARP_QUALITIES` (see `ImageProcessor.affine_transform_batch`) instead of OpenCV.
+        track_landmarks: run the face detector only on keyframes and track the face in between (see
+            `LandmarkTracker`), instead of detecting it in every frame.
+        landmark_smoothing: "causal" to smooth the landmarks and the alignment frame by frame as they are detected,
+            or "offline" to detect all the landmarks of the video (of every window batch with `streaming`) first
+            and smooth the alignment transforms with a zero-phase filter (see `smooth_affine_matrices`). With
+            `streaming` the batches are smoothed independently, so the alignment is not smoothed across their seams.
+        fa: an already loaded `face_alignment.FaceAlignment` landmark detector (see `load_face_alignment`) to use
+            instead of loading a new one, which is what `LipsyncSession` keeps warm between calls.
+        window_batcher: a `WindowBatcher` shared by concurrent calls, which denoises their windows together (see
+            `LipsyncServer`).
+
+        The pipeline keeps no per-call state on itself: the image processor and the scheduler are created for every
+        call and intermediate files are not used, so several calls may run concurrently on the same instance.
         """
-        # Store the superres option for usage in restore_video()
-        self.superres = superres
-
         is_train = self.unet.training
         self.unet.eval()
 
         check_ffmpeg_installed()
 
-        batch_size = 1
-        device = self._execution_device
-        self.image_processor = ImageProcessor(height, mask=mask, device="cuda")
         self.set_progress_bar_config(desc=f"Sample frames: {num_frames}")
 
-        faces, original_video_frames, boxes, affine_matrices = self.affine_transform_video(video_path)
-        audio_samples = read_audio(audio_path)
-
         # 1. Default height and width
         height = height or self.unet.config.sample_size * self.vae_scale_factor
         width = width or self.unet.config.sample_size * self.vae_scale_factor
@@ -387,113 +1392,87 @@ class LipsyncPipeline(DiffusionPipeline):
         # 2. Check inputs
         self.check_inputs(height, width, callback_steps)
 
-        do_classifier_free_guidance = guidance_scale > 1.0
-        self.scheduler.set_timesteps(num_inference_steps, device=device)
-        timesteps = self.scheduler.timesteps
-        extra_step_kwargs = self.prepare_extra_step_kwargs(generator, eta)
-        self.video_fps = video_fps
-
-        if self.unet.add_audio_layer:
-            whisper_feature = self.audio_encoder.audio2feat(audio_path)
-            whisper_chunks = self.audio_encoder.feature2chunks(feature_array=whisper_feature, fps=video_fps)
-            num_inferences = min(len(faces), len(whisper_chunks)) // num_frames
-        else:
-            num_inferences = len(faces) // num_frames
+        memory_plan = self._plan_memory(
+            memory_budget, height, width, num_frames, guidance_scale, weight_dtype, windows_per_batch
+        )
+        if memory_plan is not None:
+            windows_per_batch = memory_plan.windows_per_batch
+            vae_batch_size = memory_plan.vae_batch_size
 
-        synced_video_frames = []
-        num_channels_latents = self.vae.config.latent_channels
-        all_latents = self.prepare_latents(
-            batch_size,
-            num_frames * num_inferences,
-            num_channels_latents,
+        image_processor = ImageProcessor(
+            height,
+            mask=mask,
+            device="cuda",
+            warp_quality=warp_quality,
+            track_landmarks=track_landmarks,
+            landmark_smoothing=landmark_smoothing,
+            fa=fa,
+        )
+        audio_samples, whisper_feature, denoise_kwargs = self._prepare_run(
+            audio_path,
+            image_processor,
+            num_frames,
             height,
             width,
+            num_inference_steps,
             weight_dtype,
-            device,
+            eta,
             generator,
+            guidance_scale=guidance_scale,
+            callback=callback,
+            callback_steps=callback_steps,
+            guidance_interval=guidance_interval,
+            guidance_every=guidance_every,
+            deep_cache_interval=deep_cache_interval,
+            warm_start_strength=warm_start_strength,
+            warm_start_from=warm_start_from,
+            vae_batch_size=vae_batch_size,
+            window_batcher=window_batcher,
         )
-
-        for i in tqdm.tqdm(range(num_inferences), desc="Doing inference..."):
-            if self.unet.add_audio_layer:
-                audio_embeds = torch.stack(whisper_chunks[i * num_frames : (i + 1) * num_frames])
-                audio_embeds = audio_embeds.to(device, dtype=weight_dtype)
-                if do_classifier_free_guidance:
-                    null_audio_embeds = torch.zeros_like(audio_embeds)
-                    audio_embeds = torch.cat([null_audio_embeds, audio_embeds])
-            else:
-                audio_embeds = None
-
-            inference_faces = faces[i * num_frames : (i + 1) * num_frames]
-            latents = all_latents[:, :, i * num_frames : (i + 1) * num_frames]
-
-            pixel_values, masked_pixel_values, masks = self.image_processor.prepare_masks_and_masked_images(
-                inference_faces, affine_transform=False
-            )
-
-            mask_latents, masked_image_latents = self.prepare_mask_latents(
-                masks,
-                masked_pixel_values,
-                height,
-                width,
-                weight_dtype,
-                device,
-                generator,
-                do_classifier_free_guidance,
-            )
-
-            image_latents = self.prepare_image_latents(
-                pixel_values,
-                device,
-                weight_dtype,
-                generator,
-                do_classifier_free_guidance,
-            )
-
-            num_warmup_steps = len(timesteps) - num_inference_steps * self.scheduler.order
-            with self.progress_bar(total=num_inference_steps) as progress_bar:
-                for j, t in enumerate(timesteps):
-                    latent_model_input = torch.cat([latents] * 2) if do_classifier_free_guidance else latents
-                    latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
-                    latent_model_input = torch.cat(
-                        [latent_model_input, mask_latents, masked_image_latents, image_latents], dim=1
-                    )
-                    noise_pred = self.unet(latent_model_input, t, encoder_hidden_states=audio_embeds).sample
-
-                    if do_classifier_free_guidance:
-                        noise_pred_uncond, noise_pred_audio = noise_pred.chunk(2)
-                        noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_audio - noise_pred_uncond)
-
-                    latents = self.scheduler.step(noise_pred, t, latents, **extra_step_kwargs).prev_sample
-
-                    if j == len(timesteps) - 1 or ((j + 1) > num_warmup_steps and (j + 1) % self.scheduler.order == 0):
-                        progress_bar.update()
-                        if callback is not None and j % callback_steps == 0:
-                            callback(j, t, latents)
-
-            decoded_latents = self.decode_latents(latents)
-            decoded_latents = self.paste_surrounding_pixels_back(
-                decoded_latents, pixel_values, 1 - masks, device, weight_dtype
-            )
-            synced_video_frames.append(decoded_latents)
-
-        # Combine and restore the faces onto the original frames
-        synced_video_frames = self.restore_video(
-            torch.cat(synced_video_frames), original_video_frames, boxes, affine_matrices
+        speech_frames = (
+            detect_speech_frames(audio_samples, audio_sample_rate, video_fps, threshold_db=silence_threshold_db)
+            if skip_silent_windows
+            else None
         )
 
-        audio_samples_remain_length = int(synced_video_frames.shape[0] / video_fps * audio_sample_rate)
-        audio_samples = audio_samples[:audio_samples_remain_length].cpu().numpy()
+        with self._attention_slicing(memory_plan), FFmpegVideoWriter(
+            video_out_path,
+            fps=video_fps,
+            audio_samples=audio_samples,
+            audio_sample_rate=audio_sample_rate,
+            shortest=True,
+        ) as video_writer:
+            if streaming or pipelined or skip_silent_windows:
+                self._run_streaming(
+                    video_path,
+                    whisper_feature,
+                    video_writer,
+                    num_frames,
+                    video_fps,
+                    windows_per_batch,
+                    denoise_kwargs,
+                    superres,
+                    pipelined,
+                    pipeline_queue_size,
+                    speech_frames=speech_frames,
+                    crossfade_frames=crossfade_frames,
+                )
+            else:
+                self._run_eager(
+                    video_path,
+                    whisper_feature,
+                    video_writer,
+                    num_frames,
+                    video_fps,
+                    windows_per_batch,
+                    denoise_kwargs,
+                    superres,
+                )
+
+        tracker = getattr(image_processor, "tracker", None)
+        if tracker is not None:
+            print(f"Face detector ran on {tracker.detector_calls} of {tracker.num_frames} frames")
+        self._report_memory_plan(memory_plan)
 
         if is_train:
             self.unet.train()
-
-        temp_dir = "temp"
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        os.makedirs(temp_dir, exist_ok=True)
-
-        write_video(os.path.join(temp_dir, "video.mp4"), synced_video_frames, fps=25)
-        sf.write(os.path.join(temp_dir, "audio.wav"), audio_samples, audio_sample_rate)
-
-        command = f"ffmpeg -y -loglevel error -nostdin -i {os.path.join(temp_dir, 'video.mp4')} -i {os.path.join(temp_dir, 'audio.wav')} -c:v libx264 -c:a aac -q:v 0 -q:a 0 {video_out_path}"
-        subprocess.run(command, shell=True)
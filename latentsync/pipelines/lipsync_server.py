@@ -0,0 +1,410 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from statistics import fmean
+from typing import Dict, List, Optional
+
+import torch
+
+from .lipsync_session import LipsyncSession
+
+
+class _WindowRequest:
+    def __init__(self, key: tuple, kwargs: dict, num_windows: int):
+        self.key = key
+        self.kwargs = kwargs
+        self.num_windows = num_windows
+        self.arrival_time = time.perf_counter()
+        self.future = Future()
+
+
+class WindowBatcher:
+    """
+    Denoises the windows of concurrent `LipsyncPipeline` calls together. The calls hand their windows over through
+    the `window_batcher` argument of `LipsyncPipeline.denoise_window`, and a single worker thread stacks the windows
+    of the requests with the same denoising settings (step count, guidance, resolution, ...) along the batch
+    dimension of one `denoise_window` call, like `windows_per_batch` does within a call, then routes the results
+    back to the waiting calls.
+
+    A batch runs as soon as its requests hold `max_batch_size` windows, or when its oldest request has waited for
+    `max_wait_ms`. Requests are never split, so a request of more than `max_batch_size` windows runs alone. Every
+    window keeps its own initial noise, and the VAE posterior noise of every request is drawn from its own generator
+    before its windows are stacked, so the results do not depend on what a request is batched with, up to the
+    numerical tolerance of the batched kernels. Requests whose scheduler steps draw noise (eta > 0) are not batched
+    with others, since the step noise of a batch comes from a single generator. The step `callback` of every request
+    is called, on the worker thread, with the latents of its own windows every `callback_steps` steps of its own.
+    """
+
+    def __init__(self, pipeline, max_batch_size: int = 8, max_wait_ms: float = 20.0):
+        self.pipeline = pipeline
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.pending: Dict[tuple, List[_WindowRequest]] = {}
+        self.condition = threading.Condition()
+        self.closed = False
+        self.num_batches = 0
+        self.num_windows = 0
+        self.busy_time = 0.0
+        self.thread = threading.Thread(target=self._run, name="window-batcher", daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _is_warm_start(kwargs: dict) -> bool:
+        return kwargs["init_latents"] is not None and kwargs["warm_start_strength"] < 1.0
+
+    @classmethod
+    def _batch_key(cls, whisper_chunks, kwargs: dict) -> tuple:
+        warm_start = cls._is_warm_start(kwargs)
+        extra_step_kwargs = sorted((k, v) for k, v in kwargs["extra_step_kwargs"].items() if k != "generator")
+        # With eta > 0 the scheduler steps draw noise from the generator, which only batches with itself
+        step_generator = id(kwargs["generator"]) if kwargs["extra_step_kwargs"].get("eta", 0.0) > 0 else None
+        return (
+            kwargs["num_inference_steps"],
+            kwargs["guidance_scale"],
+            tuple(kwargs["guidance_interval"]),
+            kwargs["guidance_every"],
+            kwargs["deep_cache_interval"],
+            (kwargs["warm_start_strength"], kwargs["warm_start_from"]) if warm_start else None,
+            kwargs["height"],
+            kwargs["width"],
+            str(kwargs["weight_dtype"]),
+            str(kwargs["device"]),
+            kwargs["image_processor"].mask,
+            kwargs["latents"].shape[2],
+            whisper_chunks is None,
+            tuple(extra_step_kwargs),
+            step_generator,
+            type(kwargs["scheduler"]).__name__,
+        )
+
+    def denoise_window(self, inference_faces: torch.Tensor, whisper_chunks, **kwargs):
+        """Takes the arguments of `LipsyncPipeline.denoise_window` and blocks until the windows are denoised"""
+        num_windows = inference_faces.shape[0] // kwargs["latents"].shape[2]
+        if whisper_chunks is not None and not torch.is_tensor(whisper_chunks):
+            whisper_chunks = torch.stack(whisper_chunks)
+        request = _WindowRequest(
+            self._batch_key(whisper_chunks, kwargs),
+            dict(inference_faces=inference_faces, whisper_chunks=whisper_chunks, **kwargs),
+            num_windows,
+        )
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("The window batcher is closed")
+            self.pending.setdefault(request.key, []).append(request)
+            self.condition.notify()
+        return request.future.result()
+
+    def _next_batch(self) -> Optional[List[_WindowRequest]]:
+        """Pops the requests of the oldest group that is full or has waited long enough, if any"""
+        now = time.perf_counter()
+        ready_keys = [
+            key
+            for key, requests in self.pending.items()
+            if self.closed
+            or sum(request.num_windows for request in requests) >= self.max_batch_size
+            or now - requests[0].arrival_time >= self.max_wait
+        ]
+        if not ready_keys:
+            return None
+        key = min(ready_keys, key=lambda key: self.pending[key][0].arrival_time)
+        requests = self.pending[key]
+        batch = [requests.pop(0)]
+        num_windows = batch[0].num_windows
+        while requests and num_windows + requests[0].num_windows <= self.max_batch_size:
+            num_windows += requests[0].num_windows
+            batch.append(requests.pop(0))
+        if not requests:
+            del self.pending[key]
+        return batch
+
+    def _time_to_deadline(self) -> Optional[float]:
+        if not self.pending:
+            return None
+        oldest = min(requests[0].arrival_time for requests in self.pending.values())
+        return max(oldest + self.max_wait - time.perf_counter(), 0.0)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                batch = self._next_batch()
+                while batch is None:
+                    if self.closed and not self.pending:
+                        return
+                    self.condition.wait(timeout=self._time_to_deadline())
+                    batch = self._next_batch()
+
+            start_time = time.perf_counter()
+            try:
+                results = self._denoise_batch(batch)
+            except BaseException as e:
+                for request in batch:
+                    request.future.set_exception(e)
+            else:
+                for request, result in zip(batch, results):
+                    request.future.set_result(result)
+            self.busy_time += time.perf_counter() - start_time
+            self.num_batches += 1
+            self.num_windows += sum(request.num_windows for request in batch)
+
+    # Grad mode is thread local, so the worker thread has to disable it by itself
+    @torch.no_grad()
+    def _denoise_batch(self, batch: List[_WindowRequest]) -> list:
+        # The batch key guarantees that the scheduler and the image processor of the first request (same scheduler
+        # type and steps, same mask) serve every request, the callbacks are fanned out below
+        kwargs = dict(batch[0].kwargs)
+        if len(batch) == 1:
+            return [self.pipeline.denoise_window(**kwargs)]
+
+        for request in batch:
+            request.kwargs["window_latents"] = self._encode_window_latents(request.kwargs)
+
+        def per_window(tensor, request):
+            # (1 or n, c, f, h, w) latents -> the (n, c, f, h, w) latents of every window of the request
+            return tensor.expand(request.num_windows, -1, -1, -1, -1)
+
+        kwargs["inference_faces"] = torch.cat([request.kwargs["inference_faces"] for request in batch])
+        if kwargs["whisper_chunks"] is not None:
+            kwargs["whisper_chunks"] = torch.cat([request.kwargs["whisper_chunks"] for request in batch])
+        kwargs["latents"] = torch.cat([per_window(request.kwargs["latents"], request) for request in batch])
+        if self._is_warm_start(kwargs):
+            kwargs["init_latents"] = torch.cat(
+                [per_window(request.kwargs["init_latents"], request) for request in batch]
+            )
+        else:
+            kwargs["init_latents"] = None
+        kwargs["window_latents"] = tuple(
+            torch.cat([request.kwargs["window_latents"][i] for request in batch]) for i in range(2)
+        )
+        split_sizes = [request.num_windows for request in batch]
+
+        def callback(step, timestep, latents):
+            for request, request_latents in zip(batch, latents.split(split_sizes)):
+                request_callback = request.kwargs["callback"]
+                if request_callback is not None and step % request.kwargs["callback_steps"] == 0:
+                    request_callback(step, timestep, request_latents)
+
+        kwargs["callback"] = callback
+        kwargs["callback_steps"] = 1
+
+        latents, pixel_values, masks = self.pipeline.denoise_window(**kwargs)
+        num_frames = latents.shape[2]
+        frame_split_sizes = [num_windows * num_frames for num_windows in split_sizes]
+        return list(
+            zip(
+                latents.split(split_sizes),
+                pixel_values.split(frame_split_sizes),
+                masks.split(frame_split_sizes),
+            )
+        )
+
+    def _encode_window_latents(self, kwargs: dict):
+        """The latents of the masked faces and of the faces of a request, sampled with its own generator"""
+        if kwargs["window_latents"] is not None:
+            return kwargs["window_latents"]
+        faces = kwargs["inference_faces"]
+        image_processor = kwargs["image_processor"]
+        pixel_values, masked_pixel_values, _ = image_processor.prepare_masks_and_masked_images(
+            faces, affine_transform=False
+        )
+        encode_args = (kwargs["device"], kwargs["weight_dtype"], kwargs["generator"], kwargs["vae_batch_size"])
+        if self.pipeline.latent_cache is not None:
+            return self.pipeline.encode_window_latents(
+                faces, pixel_values, masked_pixel_values, image_processor, *encode_args
+            )
+        return (
+            self.pipeline.encode_images(masked_pixel_values, *encode_args),
+            self.pipeline.encode_images(pixel_values, *encode_args),
+        )
+
+    @property
+    def mean_batch_windows(self) -> float:
+        return self.num_windows / self.num_batches if self.num_batches > 0 else 0.0
+
+    def close(self):
+        """Runs the pending requests, then stops the worker thread"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+
+@dataclass
+class Job:
+    job_id: str
+    video_path: str
+    audio_path: str
+    video_out_path: str
+    params: dict
+    status: str = "queued"
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.perf_counter)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    future: Optional[Future] = field(default=None, repr=False)
+
+    @property
+    def queue_time(self) -> Optional[float]:
+        return self.started_at - self.submitted_at if self.started_at is not None else None
+
+    @property
+    def latency(self) -> Optional[float]:
+        return self.finished_at - self.submitted_at if self.finished_at is not None else None
+
+    def to_dict(self) -> dict:
+        return dict(
+            job_id=self.job_id,
+            status=self.status,
+            error=self.error,
+            video_out_path=self.video_out_path,
+            queue_time=self.queue_time,
+            latency=self.latency,
+        )
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)] if values else 0.0
+
+
+class LipsyncServer:
+    """
+    In-process inference service on a `LipsyncSession`. `submit` queues a job and returns at once; up to
+    `max_concurrent_jobs` jobs run at the same time, each in its own thread, and all of them denoise their windows
+    through one shared `WindowBatcher`, so that the windows of different jobs share UNet calls. The jobs run
+    `pipelined` by default, so that a job aligns and restores its next and previous windows while waiting for the
+    batcher. `metrics` reports the per-job latencies, the throughput and the batching efficiency.
+
+    Finished jobs stay available to `get_job` for `finished_job_ttl` seconds, and at most `max_finished_jobs` of them
+    are kept, the oldest being evicted first, so that a long-running server does not grow without bound. The metrics
+    count every job, and their latencies cover the last `max_finished_jobs` finished ones.
+
+    The windows of different jobs share UNet calls, and the attention slicing picked by the memory planner is a
+    setting of the shared UNet, so a per-job `memory_budget` cannot be honored and the jobs cannot set one.
+    """
+
+    def __init__(
+        self,
+        session: LipsyncSession,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20.0,
+        max_concurrent_jobs: int = 4,
+        finished_job_ttl: float = 3600.0,
+        max_finished_jobs: int = 1000,
+    ):
+        self.session = session
+        self.batcher = WindowBatcher(session.pipeline, max_batch_size, max_wait_ms)
+        self.executor = ThreadPoolExecutor(max_concurrent_jobs, thread_name_prefix="lipsync-job")
+        self.finished_job_ttl = finished_job_ttl
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs: Dict[str, Job] = {}
+        # Finished jobs in the order they finished, to evict the oldest ones
+        self.finished_jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.job_counts = dict(submitted=0, done=0, failed=0)
+        self.latencies = deque(maxlen=max_finished_jobs)
+        self.queue_times = deque(maxlen=max_finished_jobs)
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+
+    def submit(self, video_path: str, audio_path: str, video_out_path: str, seed: int = 1247, **params) -> Job:
+        if params.get("memory_budget") is not None:
+            raise ValueError("Jobs of a LipsyncServer cannot set a memory budget")
+        params.setdefault("pipelined", True)
+        job = Job(uuid.uuid4().hex, video_path, audio_path, video_out_path, params)
+        with self.lock:
+            self._evict_finished_jobs()
+            self.jobs[job.job_id] = job
+            self.job_counts["submitted"] += 1
+        job.future = self.executor.submit(self._run_job, job, seed)
+        return job
+
+    def _run_job(self, job: Job, seed: int) -> str:
+        job.started_at = time.perf_counter()
+        job.status = "running"
+        try:
+            # Concurrent jobs must not share the global random state, every job draws its noise from its own seed
+            generator = torch.Generator(device=self.session.pipeline._execution_device).manual_seed(seed)
+            self.session.run(
+                job.video_path,
+                job.audio_path,
+                job.video_out_path,
+                seed=None,
+                generator=generator,
+                window_batcher=self.batcher,
+                **job.params,
+            )
+        except Exception as e:
+            job.status = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+            raise
+        else:
+            job.status = "done"
+        finally:
+            job.finished_at = time.perf_counter()
+            with self.lock:
+                self.job_counts[job.status] += 1
+                if job.status == "done":
+                    self.latencies.append(job.latency)
+                    self.queue_times.append(job.queue_time)
+                self.finished_jobs[job.job_id] = job
+                self._evict_finished_jobs()
+        return job.video_out_path
+
+    def _evict_finished_jobs(self):
+        """Drops the finished jobs past their TTL and the oldest ones past `max_finished_jobs`, under the lock"""
+        now = time.perf_counter()
+        while self.finished_jobs:
+            job_id, job = next(iter(self.finished_jobs.items()))
+            if len(self.finished_jobs) <= self.max_finished_jobs and now - job.finished_at < self.finished_job_ttl:
+                break
+            del self.finished_jobs[job_id]
+            del self.jobs[job_id]
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            self._evict_finished_jobs()
+            return self.jobs.get(job_id)
+
+    def metrics(self) -> dict:
+        with self.lock:
+            job_counts = dict(self.job_counts)
+            jobs_running = sum(job.status == "running" for job in self.jobs.values())
+            latencies = list(self.latencies)
+            queue_times = list(self.queue_times)
+        elapsed = time.perf_counter() - self.start_time
+        return dict(
+            jobs_submitted=job_counts["submitted"],
+            jobs_running=jobs_running,
+            jobs_done=job_counts["done"],
+            jobs_failed=job_counts["failed"],
+            latency_mean=fmean(latencies) if latencies else 0.0,
+            latency_p50=percentile(latencies, 0.5),
+            latency_p95=percentile(latencies, 0.95),
+            queue_time_mean=fmean(queue_times) if queue_times else 0.0,
+            jobs_per_second=job_counts["done"] / elapsed,
+            windows_per_second=self.batcher.num_windows / elapsed,
+            unet_batches=self.batcher.num_batches,
+            mean_batch_windows=self.batcher.mean_batch_windows,
+            batcher_utilization=self.batcher.busy_time / elapsed,
+        )
+
+    def close(self):
+        """Waits for the submitted jobs to finish and stops the workers"""
+        self.executor.shutdown(wait=True)
+        self.batcher.close()
@@ -0,0 +1,139 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from typing import Optional
+
+import torch
+from diffusers import AutoencoderKL, DDIMScheduler
+from omegaconf import OmegaConf
+
+from ..models.unet import UNet3DConditionModel
+from ..utils.image_processor import load_face_alignment
+from ..whisper.audio2feature import Audio2Feature
+from .lipsync_pipeline import LipsyncPipeline
+
+
+def get_weight_dtype():
+    # Check if the GPU supports float16
+    is_fp16_supported = torch.cuda.is_available() and torch.cuda.get_device_capability()[0] > 7
+    return torch.float16 if is_fp16_supported else torch.float32
+
+
+def load_pipeline(config, inference_ckpt_path, dtype, variable_length_audio=False):
+    # On CUDA when available, where the memory planner can apply a memory budget
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    scheduler = DDIMScheduler.from_pretrained("configs")
+
+    if config.model.cross_attention_dim == 768:
+        whisper_model_path = "checkpoints/whisper/small.pt"
+    elif config.model.cross_attention_dim == 384:
+        whisper_model_path = "checkpoints/whisper/tiny.pt"
+    else:
+        raise NotImplementedError("cross_attention_dim must be 768 or 384")
+
+    audio_encoder = Audio2Feature(
+        model_path=whisper_model_path,
+        device=device,
+        num_frames=config.data.num_frames,
+        variable_length_segments=variable_length_audio,
+    )
+
+    vae = AutoencoderKL.from_pretrained("stabilityai/sd-vae-ft-mse", torch_dtype=dtype)
+    vae.config.scaling_factor = 0.18215
+    vae.config.shift_factor = 0
+
+    unet, _ = UNet3DConditionModel.from_pretrained(
+        OmegaConf.to_container(config.model),
+        inference_ckpt_path,  # load checkpoint, .pt or .safetensors
+        device=device,
+        dtype=dtype,
+    )
+
+    # set xformers
+    # if is_xformers_available():
+    #     unet.enable_xformers_memory_efficient_attention()
+
+    pipeline = LipsyncPipeline(
+        vae=vae,
+        audio_encoder=audio_encoder,
+        unet=unet,
+        scheduler=scheduler,
+    ).to(device)
+    return pipeline
+
+
+class LipsyncSession:
+    """
+    Loads the models once (Whisper, the VAE, the UNet and the face landmark detector) and keeps them resident, so
+    that every `run` only pays for the inference itself. `scripts/inference.py`, `gradio_app.py` and `predict.py`
+    all go through a session; the long-lived ones create it once and call `run` for every request.
+    """
+
+    def __init__(
+        self,
+        config,
+        inference_ckpt_path: str,
+        dtype: Optional[torch.dtype] = None,
+        variable_length_audio: bool = False,
+    ):
+        self.config = config
+        self.dtype = dtype if dtype is not None else get_weight_dtype()
+        self.pipeline = load_pipeline(config, inference_ckpt_path, self.dtype, variable_length_audio)
+        # The image processors of every call share the detector, which holds no per-video state
+        self.fa = load_face_alignment("cuda") if torch.cuda.is_available() else None
+
+    def run(
+        self,
+        video_path: str,
+        audio_path: str,
+        video_out_path: str,
+        seed: Optional[int] = 1247,
+        avatar_dir: Optional[str] = None,
+        **params,
+    ) -> str:
+        """
+        Dubs `video_path` with `audio_path` into `video_out_path` and returns it. `params` are passed to the
+        pipeline call, with the number of frames, the resolution and the weight dtype of the session as defaults.
+        A seed of -1 draws a random one, and None leaves the global random state alone, e.g. when the noise comes
+        from a `generator` in `params`. With `avatar_dir`, the video is dubbed through its avatar bundle (see
+        `LipsyncPipeline.lipsync_avatar`), which is prepared there first if it does not exist yet.
+        """
+        if seed is not None:
+            if seed != -1:
+                from accelerate.utils import set_seed
+
+                set_seed(seed)
+            else:
+                torch.seed()
+            print(f"Initial seed: {torch.initial_seed()}")
+
+        params.setdefault("num_frames", self.config.data.num_frames)
+        params.setdefault("weight_dtype", self.dtype)
+
+        if avatar_dir is not None:
+            # The video only has to be preprocessed the first time it is dubbed
+            if not os.path.exists(os.path.join(avatar_dir, "meta.json")):
+                self.pipeline.prepare_avatar(
+                    video_path, avatar_dir, height=self.config.data.resolution, weight_dtype=self.dtype, fa=self.fa
+                )
+            self.pipeline.lipsync_avatar(avatar_dir, audio_path=audio_path, video_out_path=video_out_path, **params)
+            return video_out_path
+
+        params.setdefault("width", self.config.data.resolution)
+        params.setdefault("height", self.config.data.resolution)
+        self.pipeline(
+            video_path=video_path, audio_path=audio_path, video_out_path=video_out_path, fa=self.fa, **params
+        )
+        return video_out_path
@@ -32,8 +32,119 @@ def transformation_from_points(points1, points0, smooth=True, p_bias=None):
     return M, p_bias
 
 
+def transformations_from_points_batch(points1, points0):
+    """
+    Vectorized `transformation_from_points` without smoothing for (T, n, 2) points, solved by one batched SVD.
+    Returns the (T, 2, 3) matrices and the (T, 2) bias terms the causal smoothing of `transformation_from_points`
+    filters.
+    """
+    points1 = np.asarray(points1, dtype=np.float64)
+    points2 = np.asarray(points0, dtype=np.float64)
+    c1 = points1.mean(axis=1)
+    c2 = points2.mean(axis=0)
+    points1 = points1 - c1[:, None]
+    points2 = points2 - c2
+    s1 = points1.std(axis=(1, 2))
+    s2 = points2.std()
+    points1 = points1 / s1[:, None, None]
+    points2 = points2 / s2
+    U, S, Vt = np.linalg.svd(np.matmul(points1.transpose(0, 2, 1), points2))
+    R = np.matmul(U, Vt).transpose(0, 2, 1)
+    scale = (s2 / s1)[:, None, None]
+    sR = scale * R
+    T = c2 - scale[:, :, 0] * np.matmul(R, c1[:, :, None])[:, :, 0]
+    M = np.concatenate((sR, T[:, :, None]), axis=2)
+    bias = points2[2] - points1[:, 2]
+    return M, bias
+
+
+def zero_phase_ema(x, alpha):
+    """
+    Exponential moving average `y[t] = alpha * y[t - 1] + (1 - alpha) * x[t]` run forward then backward along the
+    first axis, so that the filtered trajectory does not lag behind `x`. Each pass starts from the first sample it
+    sees, the way the causal smoothing does.
+    """
+    from scipy.signal import lfilter
+
+    y = np.array(x, dtype=np.float64)
+    if len(y) < 2:
+        return y
+    b, a = [1 - alpha], [1, -alpha]
+    y = lfilter(b, a, y, axis=0, zi=alpha * y[:1])[0]
+    y = lfilter(b, a, y[::-1], axis=0, zi=alpha * y[-1:])[0]
+    return y[::-1].copy()
+
+
+def smooth_affine_matrices(lmks3, face_template, alpha=0.5):
+    """
+    Offline counterpart of aligning every frame with `AlignRestore.align_warp_face(smooth=True)`: computes the
+    similarity transforms of all the (T, 3, 2) alignment points at once, decomposes them into log scale, rotation
+    angle and translation, and smooths these with a zero-phase EMA of factor `alpha` (0 disables the smoothing).
+    Returns the (T, 2, 3) affine matrices.
+    """
+    M, bias = transformations_from_points_batch(lmks3, face_template)
+    M[:, :, 2] += bias
+    scale = np.hypot(M[:, 0, 0], M[:, 1, 0])
+    angle = np.unwrap(np.arctan2(M[:, 1, 0], M[:, 0, 0]))
+    params = np.stack([np.log(scale), angle, M[:, 0, 2], M[:, 1, 2]], axis=1)
+    log_scale, angle, tx, ty = zero_phase_ema(params, alpha).T
+
+    scale = np.exp(log_scale)
+    cos, sin = scale * np.cos(angle), scale * np.sin(angle)
+    return np.stack([np.stack([cos, -sin, tx], axis=1), np.stack([sin, cos, ty], axis=1)], axis=1)
+
+
+# Fixed-point precision of the sampling coordinates of cv2.warpAffine (see WarpAffineInvoker in imgwarp.cpp)
+WARP_AB_BITS = 10
+WARP_INTER_BITS = 5
+
+
+def warp_affine_region(src, affine_matrix, region, flags=cv2.INTER_LINEAR):
+    """
+    Returns the (x1, y1, x2, y2) `region` of `cv2.warpAffine(src, affine_matrix, dsize, flags=flags)`, pixel for
+    pixel, without warping the rest of the output. Warping with the translation shifted by (x1, y1) is not enough:
+    OpenCV rounds the sampling coordinates in fixed point relative to the output origin, so the interpolation
+    weights would differ. Instead the coordinates of the full warp are rounded the way `cv2.warpAffine` rounds them
+    (OpenCV 4.9, with a non-nearest interpolation) and sampled with `cv2.remap`.
+    """
+    x1, y1, x2, y2 = region
+    m = [float(value) for value in np.asarray(affine_matrix, dtype=np.float64).ravel()]
+    # warpAffine samples through the inverse of the matrix, which it computes in this order
+    d = m[0] * m[4] - m[1] * m[3]
+    d = 1.0 / d if d != 0 else 0.0
+    a11, a22 = m[4] * d, m[0] * d
+    m[0] = a11
+    m[1] *= -d
+    m[3] *= -d
+    m[4] = a22
+    b1 = -m[0] * m[2] - m[1] * m[5]
+    b2 = -m[3] * m[2] - m[4] * m[5]
+    m[2], m[5] = b1, b2
+
+    ab_scale = 1 << WARP_AB_BITS
+    round_delta = ab_scale // (1 << WARP_INTER_BITS) // 2
+    xs = np.arange(x1, x2, dtype=np.float64)
+    ys = np.arange(y1, y2, dtype=np.float64)
+    x_deltas = np.rint(m[0] * xs * ab_scale).astype(np.int64)
+    y_deltas = np.rint(m[3] * xs * ab_scale).astype(np.int64)
+    x_rows = np.rint((m[1] * ys + m[2]) * ab_scale).astype(np.int64) + round_delta
+    y_rows = np.rint((m[4] * ys + m[5]) * ab_scale).astype(np.int64) + round_delta
+    x = (x_rows[:, None] + x_deltas[None, :]) >> (WARP_AB_BITS - WARP_INTER_BITS)
+    y = (y_rows[:, None] + y_deltas[None, :]) >> (WARP_AB_BITS - WARP_INTER_BITS)
+
+    int16 = np.iinfo(np.int16)
+    map_xy = np.stack([x >> WARP_INTER_BITS, y >> WARP_INTER_BITS], axis=2).clip(int16.min, int16.max)
+    tab_mask = (1 << WARP_INTER_BITS) - 1
+    map_alpha = ((y & tab_mask) << WARP_INTER_BITS) + (x & tab_mask)
+    return cv2.remap(src, map_xy.astype(np.int16), map_alpha.astype(np.uint16), flags)
+
+
 class AlignRestore(object):
-    def __init__(self, align_points=3):
+    def __init__(self, align_points=3, mask_cache_tolerance=0.0):
+        # The soft mask of the previous frame is reused while the corners of the restored face move by at most
+        # this many pixels. With 0 it is only reused for identical affine matrices.
+        self.mask_cache_tolerance = mask_cache_tolerance
+        self._mask_cache = None
         if align_points == 3:
             self.upscale_factor = 1
             ratio = 2.8
@@ -50,8 +161,15 @@ class AlignRestore(object):
         cv2.imwrite("aligned.jpg", aligned_face)
         return aligned_face, restored_img
 
-    def align_warp_face(self, img, lmks3, smooth=True, border_mode="constant"):
+    def get_affine_matrix(self, lmks3, smooth=True):
         affine_matrix, self.p_bias = transformation_from_points(lmks3, self.face_template, smooth, self.p_bias)
+        return affine_matrix
+
+    def align_warp_face(self, img, lmks3, smooth=True, border_mode="constant"):
+        affine_matrix = self.get_affine_matrix(lmks3, smooth)
+        return self.warp_face(img, affine_matrix, border_mode), affine_matrix
+
+    def warp_face(self, img, affine_matrix, border_mode="constant"):
         if border_mode == "constant":
             border_mode = cv2.BORDER_CONSTANT
         elif border_mode == "reflect101":
@@ -67,7 +185,7 @@ class AlignRestore(object):
             borderMode=border_mode,
             borderValue=[127, 127, 127],
         )
-        return cropped_face, affine_matrix
+        return cropped_face
 
     def align_warp_face2(self, img, landmark, border_mode="constant"):
         affine_matrix = cv2.estimateAffinePartial2D(landmark, self.face_template)[0]
@@ -82,7 +200,87 @@ class AlignRestore(object):
         )
         return cropped_face, affine_matrix
 
+    def _inverse_affine(self, affine_matrix):
+        inverse_affine = cv2.invertAffineTransform(affine_matrix)
+        inverse_affine *= self.upscale_factor
+        if self.upscale_factor > 1:
+            extra_offset = 0.5 * self.upscale_factor
+        else:
+            extra_offset = 0
+        inverse_affine[:, 2] += extra_offset
+        return inverse_affine
+
+    def _get_soft_mask(self, inverse_affine, w_up, h_up):
+        """
+        Returns the eroded mask of the restored face, its soft (eroded and blurred) mask and the (x1, y1, x2, y2)
+        region of the frame they cover, which holds every pixel the soft mask does not zero. The region is wide
+        enough for the erosions and the blur to see the same zeros around the face as on the full frame.
+        """
+        face_w, face_h = self.face_size
+        corners = np.array([[0, 0, 1], [face_w, 0, 1], [0, face_h, 1], [face_w, face_h, 1]], dtype=np.float64)
+        corners = corners @ inverse_affine.T
+
+        if self._mask_cache is not None:
+            cached_corners, cached_size, cached_masks = self._mask_cache
+            if cached_size == (w_up, h_up) and np.abs(corners - cached_corners).max() <= self.mask_cache_tolerance:
+                return cached_masks
+
+        # Upper bound of the blur radius, which depends on the area of the face in the frame
+        face_area = abs(np.linalg.det(inverse_affine[:, :2])) * face_w * face_h
+        margin = (int(face_area**0.5) // 20 + 1) * 2 + 4
+        x1 = max(int(np.floor(corners[:, 0].min())) - margin, 0)
+        y1 = max(int(np.floor(corners[:, 1].min())) - margin, 0)
+        x2 = min(int(np.ceil(corners[:, 0].max())) + margin, w_up)
+        y2 = min(int(np.ceil(corners[:, 1].max())) + margin, h_up)
+        if x1 >= x2 or y1 >= y2:
+            return None
+
+        mask = np.ones((face_h, face_w), dtype=np.float32)
+        inv_mask = warp_affine_region(mask, inverse_affine, (x1, y1, x2, y2))
+        inv_mask_erosion = cv2.erode(
+            inv_mask, np.ones((int(2 * self.upscale_factor), int(2 * self.upscale_factor)), np.uint8)
+        )
+        total_face_area = np.sum(inv_mask_erosion)
+        w_edge = int(total_face_area**0.5) // 20
+        erosion_radius = w_edge * 2
+        inv_mask_center = cv2.erode(inv_mask_erosion, np.ones((erosion_radius, erosion_radius), np.uint8))
+        blur_size = w_edge * 2
+        inv_soft_mask = cv2.GaussianBlur(inv_mask_center, (blur_size + 1, blur_size + 1), 0)
+
+        masks = (inv_mask_erosion[:, :, None], inv_soft_mask[:, :, None], (x1, y1, x2, y2))
+        self._mask_cache = (corners, (w_up, h_up), masks)
+        return masks
+
     def restore_img(self, input_img, face, affine_matrix):
+        """
+        Pastes `face` back into `input_img`, only warping and blending the region around the face. Matches
+        `restore_img_full_frame` pixel for pixel, except for the reuse of the soft mask with
+        `mask_cache_tolerance > 0`.
+        """
+        h, w, _ = input_img.shape
+        h_up, w_up = int(h * self.upscale_factor), int(w * self.upscale_factor)
+        if self.upscale_factor == 1:
+            upsample_img = input_img.copy()
+        else:
+            upsample_img = cv2.resize(input_img, (w_up, h_up), interpolation=cv2.INTER_LANCZOS4)
+        inverse_affine = self._inverse_affine(affine_matrix)
+        masks = self._get_soft_mask(inverse_affine, w_up, h_up)
+        if masks is None:
+            return upsample_img
+        inv_mask_erosion, inv_soft_mask, (x1, y1, x2, y2) = masks
+
+        inv_restored = warp_affine_region(face, inverse_affine, (x1, y1, x2, y2), flags=cv2.INTER_LANCZOS4)
+        pasted_face = inv_mask_erosion * inv_restored
+        roi = inv_soft_mask * pasted_face + (1 - inv_soft_mask) * upsample_img[y1:y2, x1:x2]
+        if np.max(roi) > 256:
+            upsample_img = upsample_img.astype(np.uint16)
+            upsample_img[y1:y2, x1:x2] = roi.astype(np.uint16)
+        else:
+            upsample_img[y1:y2, x1:x2] = roi.astype(np.uint8)
+        return upsample_img
+
+    def restore_img_full_frame(self, input_img, face, affine_matrix):
+        """Reference implementation of `restore_img`, which warps and blends the whole frame."""
         h, w, _ = input_img.shape
         h_up, w_up = int(h * self.upscale_factor), int(w * self.upscale_factor)
         upsample_img = cv2.resize(input_img, (w_up, h_up), interpolation=cv2.INTER_LANCZOS4)
@@ -124,21 +322,10 @@ class laplacianSmooth:
         if self.pts_last is None:
             self.pts_last = pts_cur.copy()
             return pts_cur.copy()
-        x1 = min(pts_cur[:, 0])
-        x2 = max(pts_cur[:, 0])
-        y1 = min(pts_cur[:, 1])
-        y2 = max(pts_cur[:, 1])
-        width = x2 - x1
-        pts_update = []
-        for i in range(len(pts_cur)):
-            x_new, y_new = pts_cur[i]
-            x_old, y_old = self.pts_last[i]
-            tmp = (x_new - x_old) ** 2 + (y_new - y_old) ** 2
-            w = np.exp(-tmp / (width * self.smoothAlpha))
-            x = x_old * w + x_new * (1 - w)
-            y = y_old * w + y_new * (1 - w)
-            pts_update.append([x, y])
-        pts_update = np.array(pts_update)
+        width = pts_cur[:, 0].max() - pts_cur[:, 0].min()
+        tmp = ((pts_cur[:, :2] - self.pts_last[:, :2]) ** 2).sum(axis=1)
+        w = np.exp(-tmp / (width * self.smoothAlpha))[:, None]
+        pts_update = self.pts_last[:, :2] * w + pts_cur[:, :2] * (1 - w)
         self.pts_last = pts_update.copy()
 
         return pts_update
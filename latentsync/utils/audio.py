@@ -1,45 +1,66 @@
 # Adapted from https://github.com/Rudrabha/Wav2Lip/blob/master/audio.py
 
-import librosa
-import librosa.filters
+from functools import lru_cache
+
 import numpy as np
-from scipy import signal
-from scipy.io import wavfile
 from omegaconf import OmegaConf
 import torch
 
+# librosa and scipy are imported on first use, and the config is read on first use too, so that importing this
+# module (e.g. in every worker process of the data loaders) stays cheap and does not depend on the working directory
 audio_config_path = "configs/audio.yaml"
 
-config = OmegaConf.load(audio_config_path)
+
+@lru_cache(maxsize=None)
+def get_audio_config():
+    return OmegaConf.load(audio_config_path)
+
+
+def __getattr__(name):
+    # The config used to be loaded at import time as the module attribute `config`
+    if name == "config":
+        return get_audio_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def load_wav(path, sr):
+    import librosa
+
     return librosa.core.load(path, sr=sr)[0]
 
 
 def save_wav(wav, path, sr):
+    from scipy.io import wavfile
+
     wav *= 32767 / max(0.01, np.max(np.abs(wav)))
     # proposed by @dsmiller
     wavfile.write(path, sr, wav.astype(np.int16))
 
 
 def save_wavenet_wav(wav, path, sr):
+    import librosa
+
     librosa.output.write_wav(path, wav, sr=sr)
 
 
 def preemphasis(wav, k, preemphasize=True):
     if preemphasize:
+        from scipy import signal
+
         return signal.lfilter([1, -k], [1], wav)
     return wav
 
 
 def inv_preemphasis(wav, k, inv_preemphasize=True):
     if inv_preemphasize:
+        from scipy import signal
+
         return signal.lfilter([1], [1, -k], wav)
     return wav
 
 
 def get_hop_size():
+    config = get_audio_config()
     hop_size = config.audio.hop_size
     if hop_size is None:
         assert config.audio.frame_shift_ms is not None
@@ -48,6 +69,7 @@ def get_hop_size():
 
 
 def linearspectrogram(wav):
+    config = get_audio_config()
     D = _stft(preemphasis(wav, config.audio.preemphasis, config.audio.preemphasize))
     S = _amp_to_db(np.abs(D)) - config.audio.ref_level_db
 
@@ -57,6 +79,7 @@ def linearspectrogram(wav):
 
 
 def melspectrogram(wav):
+    config = get_audio_config()
     D = _stft(preemphasis(wav, config.audio.preemphasis, config.audio.preemphasize))
     S = _amp_to_db(_linear_to_mel(np.abs(D))) - config.audio.ref_level_db
 
@@ -68,13 +91,17 @@ def melspectrogram(wav):
 def _lws_processor():
     import lws
 
+    config = get_audio_config()
     return lws.lws(config.audio.n_fft, get_hop_size(), fftsize=config.audio.win_size, mode="speech")
 
 
 def _stft(y):
+    config = get_audio_config()
     if config.audio.use_lws:
         return _lws_processor(config.audio).stft(y).T
     else:
+        import librosa
+
         return librosa.stft(y=y, n_fft=config.audio.n_fft, hop_length=get_hop_size(), win_length=config.audio.win_size)
 
 
@@ -117,6 +144,9 @@ def _linear_to_mel(spectogram):
 
 
 def _build_mel_basis():
+    import librosa.filters
+
+    config = get_audio_config()
     assert config.audio.fmax <= config.audio.sample_rate // 2
     return librosa.filters.mel(
         sr=config.audio.sample_rate,
@@ -128,6 +158,7 @@ def _build_mel_basis():
 
 
 def _amp_to_db(x):
+    config = get_audio_config()
     min_level = np.exp(config.audio.min_level_db / 20 * np.log(10))
     return 20 * np.log10(np.maximum(min_level, x))
 
@@ -137,6 +168,7 @@ def _db_to_amp(x):
 
 
 def _normalize(S):
+    config = get_audio_config()
     if config.audio.allow_clipping_in_normalization:
         if config.audio.symmetric_mels:
             return np.clip(
@@ -162,6 +194,7 @@ def _normalize(S):
 
 
 def _denormalize(D):
+    config = get_audio_config()
     if config.audio.allow_clipping_in_normalization:
         if config.audio.symmetric_mels:
             return (
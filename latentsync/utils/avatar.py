@@ -0,0 +1,95 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+AVATAR_BUNDLE_VERSION = 2
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class AvatarBundle:
+    """
+    Everything the lipsync pipeline derives from a reference video independently of the audio, except for what is
+    cheap to recompute: the boxes and affine matrices of the aligned faces, and the VAE latents of the faces and of
+    the masked faces. The frames are not stored, they are decoded again from the source video, whose path and
+    SHA-256 are kept in the metadata so that a modified or missing video is detected, and the faces are warped again
+    from the frames with the stored matrices, which skips the landmark detection. A bundle is saved as a directory
+    of `.npy` files plus a `meta.json`, so that `load` can memory-map the arrays instead of reading them into memory.
+
+    Args:
+        boxes: (n, 4) boxes of the faces as x1, y1, x2, y2.
+        affine_matrices: (n, 2, 3) matrices that aligned the faces.
+        image_latents: (n, c, resolution // 8, resolution // 8) scaled VAE latents of the faces.
+        masked_image_latents: same as `image_latents`, for the faces with the mouth region masked.
+        meta: json serializable settings the bundle was prepared with (source video and its digest, resolution,
+            mask, fps...).
+    """
+
+    array_names = ("boxes", "affine_matrices", "image_latents", "masked_image_latents")
+
+    def __init__(self, boxes, affine_matrices, image_latents, masked_image_latents, meta):
+        self.boxes = boxes
+        self.affine_matrices = affine_matrices
+        self.image_latents = image_latents
+        self.masked_image_latents = masked_image_latents
+        self.meta = meta
+
+    def __len__(self):
+        return len(self.affine_matrices)
+
+    @property
+    def source_video(self) -> str:
+        return self.meta["source_video"]
+
+    def check_source(self):
+        """Raises a ValueError if the source video is missing or differs from the one the bundle was prepared from."""
+        if not os.path.isfile(self.source_video):
+            raise ValueError(f"The source video {self.source_video} of the avatar bundle does not exist anymore")
+        if os.path.getsize(self.source_video) != self.meta["source_size"] or (
+            file_digest(self.source_video) != self.meta["source_sha256"]
+        ):
+            raise ValueError(f"The source video {self.source_video} changed since the avatar bundle was prepared")
+
+    def save(self, bundle_dir: str):
+        os.makedirs(bundle_dir, exist_ok=True)
+        for name in self.array_names:
+            np.save(os.path.join(bundle_dir, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(bundle_dir, "meta.json"), "w") as f:
+            json.dump(dict(self.meta, version=AVATAR_BUNDLE_VERSION), f, indent=2)
+
+    @classmethod
+    def load(cls, bundle_dir: str, mmap: bool = True) -> "AvatarBundle":
+        with open(os.path.join(bundle_dir, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != AVATAR_BUNDLE_VERSION:
+            raise ValueError(
+                f"Avatar bundle {bundle_dir} has version {meta.get('version')}, expected {AVATAR_BUNDLE_VERSION}, "
+                "prepare it again"
+            )
+        arrays = {
+            name: np.load(os.path.join(bundle_dir, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in cls.array_names
+        }
+        return cls(meta=meta, **arrays)
@@ -0,0 +1,100 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Optional
+
+import numpy as np
+
+
+def box_iou(box1: np.ndarray, box2: np.ndarray) -> float:
+    x1 = max(box1[0], box2[0])
+    y1 = max(box1[1], box2[1])
+    x2 = min(box1[2], box2[2])
+    y2 = min(box1[3], box2[3])
+    intersection = max(x2 - x1, 0) * max(y2 - y1, 0)
+    union = (box1[2] - box1[0]) * (box1[3] - box1[1]) + (box2[2] - box2[0]) * (box2[3] - box2[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def landmarks_box(landmarks: np.ndarray) -> np.ndarray:
+    return np.array([*landmarks.min(axis=0), *landmarks.max(axis=0)], dtype=np.float64)
+
+
+class LandmarkTracker:
+    """
+    Runs the face detector of a `face_alignment.FaceAlignment` only on keyframes and tracks the face in between,
+    feeding the landmark network a box derived from the landmarks of the previous frame.
+
+    The detector boxes do not match the bounding boxes of the landmarks, so every detection calibrates the offsets
+    of the detector box relative to the landmark box, in units of the landmark box size, and the tracked boxes apply
+    the same offsets. The detector runs again every `keyframe_interval` frames, when the mean landmark score falls
+    below `min_landmark_score`, or when the box of the new landmarks has an IoU below `min_box_iou` with the box
+    they were predicted from, i.e. the face moved too much for the crop.
+    """
+
+    def __init__(self, fa, keyframe_interval: int = 25, min_landmark_score: float = 0.5, min_box_iou: float = 0.6):
+        self.fa = fa
+        self.keyframe_interval = keyframe_interval
+        self.min_landmark_score = min_landmark_score
+        self.min_box_iou = min_box_iou
+        self.detector_calls = 0
+        self.num_frames = 0
+        self.reset()
+
+    def reset(self):
+        self.calibration = None
+        self.box = None
+        self.frames_since_detection = 0
+
+    def _box_from_landmarks(self, landmarks: np.ndarray) -> np.ndarray:
+        box = landmarks_box(landmarks)
+        size = np.tile(box[2:] - box[:2], 2)
+        return box + self.calibration * size
+
+    def _detect(self, image: np.ndarray) -> Optional[np.ndarray]:
+        self.detector_calls += 1
+        landmarks, scores, boxes = self.fa.get_landmarks(image, return_bboxes=True, return_landmark_score=True)
+        if landmarks is None:
+            self.reset()
+            return None
+        box = np.asarray(boxes[0][:4], dtype=np.float64)
+        landmark_box = landmarks_box(landmarks[0])
+        size = np.tile(landmark_box[2:] - landmark_box[:2], 2)
+        self.calibration = (box - landmark_box) / size
+        self.box = self._box_from_landmarks(landmarks[0])
+        self.frames_since_detection = 0
+        return landmarks[0]
+
+    def get_landmarks(self, image: np.ndarray) -> Optional[np.ndarray]:
+        """Returns the (68, 2) landmarks of the first face in `image`, or None if there is no face."""
+        self.num_frames += 1
+        if self.box is None or self.frames_since_detection + 1 >= self.keyframe_interval:
+            return self._detect(image)
+
+        landmarks, scores, _ = self.fa.get_landmarks(
+            image, detected_faces=[self.box], return_bboxes=True, return_landmark_score=True
+        )
+        if landmarks is None or np.mean(scores[0]) < self.min_landmark_score:
+            return self._detect(image)
+        box = self._box_from_landmarks(landmarks[0])
+        if box_iou(box, self.box) < self.min_box_iou:
+            return self._detect(image)
+
+        self.box = box
+        self.frames_since_detection += 1
+        return landmarks[0]
+
+    @property
+    def detector_calls_saved(self) -> int:
+        return self.num_frames - self.detector_calls
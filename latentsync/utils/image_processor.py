@@ -15,12 +15,19 @@
 from torchvision import transforms
 import cv2
 from einops import rearrange
-import mediapipe as mp
 import torch
 import numpy as np
-from typing import Union
-from .affine_transform import AlignRestore, laplacianSmooth
-import face_alignment
+from typing import TYPE_CHECKING, List, Optional, Union
+from .affine_transform import AlignRestore, laplacianSmooth, smooth_affine_matrices
+from .face_tracking import LandmarkTracker
+
+# mediapipe and face_alignment are only imported when a detector is created, they are the slowest imports of the
+# inference path and many processes (e.g. the preprocessing workers) never detect a face
+if TYPE_CHECKING:
+    import face_alignment
+
+# grid_sample mode and supersampling factor of every quality of `ImageProcessor.affine_transform_batch`
+WARP_QUALITIES = {"fast": ("bilinear", 1), "balanced": ("bicubic", 1), "high": ("bicubic", 2)}
 
 """
 If you are enlarging the image, you should prefer to use INTER_LINEAR or INTER_CUBIC interpolation. If you are shrinking the image, you should prefer to use INTER_AREA interpolation.
@@ -36,9 +43,35 @@ def load_fixed_mask(resolution: int) -> torch.Tensor:
     return mask_image
 
 
+def load_face_alignment(device: str = "cuda") -> "face_alignment.FaceAlignment":
+    import face_alignment
+
+    return face_alignment.FaceAlignment(face_alignment.LandmarksType.TWO_D, flip_input=False, device=device)
+
+
 class ImageProcessor:
-    def __init__(self, resolution: int = 512, mask: str = "fix_mask", device: str = "cpu", mask_image=None):
+    def __init__(
+        self,
+        resolution: int = 512,
+        mask: str = "fix_mask",
+        device: str = "cpu",
+        mask_image=None,
+        restore_mask_tolerance: float = 0.0,
+        warp_quality: Optional[str] = None,
+        track_landmarks: bool = False,
+        landmark_smoothing: str = "causal",
+        offline_smoothing_alpha: float = 0.5,
+        fa=None,
+    ):
+        if landmark_smoothing not in ("causal", "offline"):
+            raise ValueError(f"Invalid landmark smoothing {landmark_smoothing}, expected causal or offline")
+        if warp_quality is not None and warp_quality not in WARP_QUALITIES:
+            raise ValueError(f"Invalid warp quality {warp_quality}, expected one of {list(WARP_QUALITIES)}")
         self.resolution = resolution
+        self.device = device
+        self.warp_quality = warp_quality
+        self.landmark_smoothing = landmark_smoothing
+        self.offline_smoothing_alpha = offline_smoothing_alpha
         self.resize = transforms.Resize(
             (resolution, resolution), interpolation=transforms.InterpolationMode.BILINEAR, antialias=True
         )
@@ -46,11 +79,13 @@ class ImageProcessor:
         self.mask = mask
 
         if mask in ["mouth", "face", "eye"]:
+            import mediapipe as mp
+
             self.face_mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=True)  # Process single image
         if mask == "fix_mask":
             self.face_mesh = None
             self.smoother = laplacianSmooth()
-            self.restorer = AlignRestore()
+            self.restorer = AlignRestore(mask_cache_tolerance=restore_mask_tolerance)
 
             if mask_image is None:
                 self.mask_image = load_fixed_mask(resolution)
@@ -58,14 +93,15 @@ class ImageProcessor:
                 self.mask_image = mask_image
 
             if device != "cpu":
-                self.fa = face_alignment.FaceAlignment(
-                    face_alignment.LandmarksType.TWO_D, flip_input=False, device=device
-                )
+                # A detector loaded once (see `load_face_alignment`) can be shared by many image processors
+                self.fa = fa if fa is not None else load_face_alignment(device)
                 self.face_mesh = None
+                self.tracker = LandmarkTracker(self.fa) if track_landmarks else None
             else:
                 # self.face_mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=True)  # Process single image
                 self.face_mesh = None
                 self.fa = None
+                self.tracker = None
 
     def detect_facial_landmarks(self, image: np.ndarray):
         height, width, _ = image.shape
@@ -115,31 +151,105 @@ class ImageProcessor:
 
         return pixel_values, masked_pixel_values, mask
 
-    def affine_transform(self, image: torch.Tensor) -> np.ndarray:
-        # image = rearrange(image, "c h w-> h w c").numpy()
+    def detect_landmarks(self, image: np.ndarray) -> np.ndarray:
+        """Returns the (68, 2) landmarks of the face in `image`, in the face_alignment layout."""
         if self.fa is None:
             landmark_coordinates = np.array(self.detect_facial_landmarks(image))
             lm68 = mediapipe_lm478_to_face_alignment_lm68(landmark_coordinates)
+        elif self.tracker is not None:
+            lm68 = self.tracker.get_landmarks(image)
+            if lm68 is None:
+                raise RuntimeError("Face not detected")
         else:
             detected_faces = self.fa.get_landmarks(image)
             if detected_faces is None:
                 raise RuntimeError("Face not detected")
             lm68 = detected_faces[0]
-
-        points = self.smoother.smooth(lm68)
-        lmk3_ = np.zeros((3, 2))
-        lmk3_[0] = points[17:22].mean(0)
-        lmk3_[1] = points[22:27].mean(0)
-        lmk3_[2] = points[27:36].mean(0)
-        # print(lmk3_)
-        face, affine_matrix = self.restorer.align_warp_face(
-            image.copy(), lmks3=lmk3_, smooth=True, border_mode="constant"
+        return lm68
+
+    def get_alignment_points(self, image: np.ndarray) -> np.ndarray:
+        """Detects and smooths the landmarks of the face in `image` and returns the 3 points it is aligned by."""
+        points = self.smoother.smooth(self.detect_landmarks(image))
+        return landmarks_to_alignment_points(points)
+
+    def get_affine_matrices_offline(self, images: np.ndarray) -> np.ndarray:
+        """
+        Detects the landmarks of all the `images` first, then computes their (n, 2, 3) alignment matrices at once
+        with a zero-phase smoothing of the transforms (see `smooth_affine_matrices`), instead of the causal
+        smoothing of the landmarks and of the transforms frame by frame.
+        """
+        landmarks = np.stack([self.detect_landmarks(image) for image in images])
+        return smooth_affine_matrices(
+            landmarks_to_alignment_points(landmarks), self.restorer.face_template, self.offline_smoothing_alpha
         )
+
+    def affine_transform(self, image: torch.Tensor, affine_matrix: Optional[np.ndarray] = None) -> np.ndarray:
+        # image = rearrange(image, "c h w-> h w c").numpy()
+        if affine_matrix is None:
+            lmk3_ = self.get_alignment_points(image)
+            face, affine_matrix = self.restorer.align_warp_face(
+                image.copy(), lmks3=lmk3_, smooth=True, border_mode="constant"
+            )
+        else:
+            face = self.restorer.warp_face(image.copy(), affine_matrix, border_mode="constant")
         box = [0, 0, face.shape[1], face.shape[0]]  # x1, y1, x2, y2
         face = cv2.resize(face, (self.resolution, self.resolution), interpolation=cv2.INTER_LANCZOS4)
         face = rearrange(torch.from_numpy(face), "h w c -> c h w")
         return face, box, affine_matrix
 
+    def affine_transform_batch(
+        self,
+        images: np.ndarray,
+        affine_matrices: Optional[List[np.ndarray]] = None,
+        quality: Optional[str] = None,
+    ):
+        """
+        Batched `affine_transform` of (n, h, w, 3) frames. The landmarks are still detected and smoothed frame by
+        frame, unless `affine_matrices` are given, but all the faces are then warped to the face template and
+        resized to `resolution` by a single `grid_sample` call on `self.device`, with the `quality` interpolation
+        of `WARP_QUALITIES` (`self.warp_quality` or "balanced" by default) instead of OpenCV's LANCZOS. Returns
+        the faces as a (n, 3, resolution, resolution) uint8 tensor, their boxes and their affine matrices.
+        """
+        mode, supersample = WARP_QUALITIES[quality or self.warp_quality or "balanced"]
+        images = np.asarray(images)
+        if affine_matrices is None:
+            affine_matrices = [
+                self.restorer.get_affine_matrix(self.get_alignment_points(image), smooth=True) for image in images
+            ]
+        num_images, height, width, _ = images.shape
+        face_w, face_h = self.restorer.face_size
+
+        # Maps the normalized coordinates of the output to the pixels of the face template, the pixels of the face
+        # template to the pixels of the frame, and those to the normalized coordinates of the frame. The resize to
+        # `resolution` is folded in the first map, which does not depend on the output size.
+        template_from_output = np.array(
+            [[face_w / 2, 0, face_w / 2 - 0.5], [0, face_h / 2, face_h / 2 - 0.5], [0, 0, 1]], dtype=np.float64
+        )
+        frame_from_template = np.zeros((num_images, 3, 3), dtype=np.float64)
+        frame_from_template[:, :2] = np.stack(affine_matrices)
+        frame_from_template[:, 2, 2] = 1
+        frame_from_template = np.linalg.inv(frame_from_template)
+        normalized_from_frame = np.array(
+            [[2 / width, 0, 1 / width - 1], [0, 2 / height, 1 / height - 1], [0, 0, 1]], dtype=np.float64
+        )
+        theta = normalized_from_frame @ frame_from_template @ template_from_output
+        theta = torch.from_numpy(theta[:, :2]).to(device=self.device, dtype=torch.float32)
+
+        # Sampling the frames shifted by -127 makes the zero padding the gray border of `align_warp_face`
+        frames = torch.from_numpy(images).to(device=self.device)
+        frames = rearrange(frames, "b h w c -> b c h w").float() - 127
+        output_size = self.resolution * supersample
+        grid = torch.nn.functional.affine_grid(
+            theta, (num_images, 3, output_size, output_size), align_corners=False
+        )
+        faces = torch.nn.functional.grid_sample(frames, grid, mode=mode, padding_mode="zeros", align_corners=False)
+        if supersample > 1:
+            faces = torch.nn.functional.avg_pool2d(faces, supersample)
+        faces = (faces + 127).round().clamp(0, 255).to(torch.uint8).cpu()
+
+        boxes = [[0, 0, face_w, face_h]] * num_images
+        return faces, boxes, list(affine_matrices)
+
     def preprocess_fixed_mask_image(self, image: torch.Tensor, affine_transform=False):
         if affine_transform:
             image, _, _ = self.affine_transform(image)
@@ -176,18 +286,18 @@ class ImageProcessor:
             self.face_mesh.close()
 
 
+def landmarks_to_alignment_points(lm68: np.ndarray) -> np.ndarray:
+    """[..., 68, 2] landmarks -> [..., 3, 2] centers of the eyebrows and of the nose"""
+    return np.stack([lm68[..., 17:22, :].mean(-2), lm68[..., 22:27, :].mean(-2), lm68[..., 27:36, :].mean(-2)], -2)
+
+
 def mediapipe_lm478_to_face_alignment_lm68(lm478, return_2d=True):
     """
     lm478: [B, 478, 3] or [478,3]
     """
     # lm478[..., 0] *= W
     # lm478[..., 1] *= H
-    landmarks_extracted = []
-    for index in landmark_points_68:
-        x = lm478[index][0]
-        y = lm478[index][1]
-        landmarks_extracted.append((x, y))
-    return np.array(landmarks_extracted)
+    return np.asarray(lm478)[..., landmark_points_68, :2]
 
 
 landmark_points_68 = [
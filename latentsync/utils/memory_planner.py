@@ -0,0 +1,178 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional
+
+import torch
+
+
+@dataclass
+class MemoryPlan:
+    attention_slice_size: Optional[int]
+    vae_batch_size: int
+    windows_per_batch: int
+    predicted_peak_bytes: int
+
+    def __repr__(self):
+        return (
+            f"MemoryPlan(attention_slice_size={self.attention_slice_size}, vae_batch_size={self.vae_batch_size}, "
+            f"windows_per_batch={self.windows_per_batch}, predicted_peak={self.predicted_peak_bytes / 2**30:.2f}GiB)"
+        )
+
+
+@contextmanager
+def attention_slicing(unet, slice_size):
+    """
+    Sets the attention slice size of `unet` (see `UNet3DConditionModel.set_attention_slice`) for the duration of the
+    context and restores the previous one of every attention layer on exit, so that a call with a memory budget does
+    not leave the shared UNet sliced for the next calls.
+    """
+    saved_states = [
+        (module, {name: getattr(module, name) for name in ("_slice_size", "processor") if hasattr(module, name)})
+        for module in unet.modules()
+        if module is not unet and hasattr(module, "set_attention_slice")
+    ]
+    unet.set_attention_slice(slice_size)
+    try:
+        yield
+    finally:
+        for module, state in saved_states:
+            for name, value in state.items():
+                setattr(module, name, value)
+
+
+class MemoryPlanner:
+    """
+    Picks the attention slice size, the VAE micro-batch size and the number of windows per batch that fit the
+    inference of `pipeline` in a memory budget, preferring the most windows per batch, then the least attention
+    slicing, then the largest VAE micro-batches.
+
+    The cost model has three terms on top of the memory allocated when planning (mostly the weights): the UNet
+    activations and the VAE activations, both linear in the number of frames and measured by running the models
+    on a single frame, and the attention scores of the highest resolution self-attention layers, which are
+    computed analytically since they grow with the square of the number of latent pixels.
+    """
+
+    # Transient tensors the measured probes do not see, such as the concatenated inputs and the CFG outputs
+    safety_factor = 1.1
+
+    def __init__(self, pipeline, height: int, width: int, dtype: torch.dtype, device: torch.device):
+        self.pipeline = pipeline
+        self.height = height
+        self.width = width
+        self.dtype = dtype
+        self.device = device
+        self.element_size = torch.tensor([], dtype=dtype).element_size()
+        sliceable_head_dims = [
+            module.sliceable_head_dim for module in pipeline.unet.modules() if hasattr(module, "sliceable_head_dim")
+        ]
+        # The largest layer bounds the attention cost, the smallest one the slice sizes every layer accepts
+        self.num_heads = max(sliceable_head_dims, default=1)
+        self.max_slice_size = min(sliceable_head_dims, default=1)
+        self.uses_xformers = any(
+            getattr(module, "_use_memory_efficient_attention_xformers", False) for module in pipeline.unet.modules()
+        )
+        self.unet_bytes_per_frame = None
+        self.vae_bytes_per_frame = None
+
+    def _measure_peak(self, function) -> int:
+        torch.cuda.synchronize(self.device)
+        baseline = torch.cuda.memory_allocated(self.device)
+        torch.cuda.reset_peak_memory_stats(self.device)
+        function()
+        torch.cuda.synchronize(self.device)
+        return torch.cuda.max_memory_allocated(self.device) - baseline
+
+    @torch.no_grad()
+    def calibrate(self):
+        unet = self.pipeline.unet
+        vae = self.pipeline.vae
+        latent_height = self.height // self.pipeline.vae_scale_factor
+        latent_width = self.width // self.pipeline.vae_scale_factor
+
+        sample = torch.randn(
+            1, unet.config.in_channels, 1, latent_height, latent_width, device=self.device, dtype=self.dtype
+        )
+        timestep = torch.tensor(999, device=self.device)
+        if unet.add_audio_layer:
+            audio_embeds = torch.zeros(1, 50, unet.config.cross_attention_dim, device=self.device, dtype=self.dtype)
+        else:
+            audio_embeds = None
+
+        # The attention scores are modeled separately, so the probe slices them as much as possible
+        with attention_slicing(unet, "max"):
+            self.unet_bytes_per_frame = self._measure_peak(
+                lambda: unet(sample, timestep, encoder_hidden_states=audio_embeds)
+            ) - self._attention_bytes(1, 1)
+
+        latents = torch.randn(1, vae.config.latent_channels, latent_height, latent_width, device=self.device)
+        images = torch.randn(1, 3, self.height, self.width, device=self.device)
+        encode_bytes = self._measure_peak(lambda: vae.encode(images.to(dtype=self.dtype)))
+        decode_bytes = self._measure_peak(lambda: vae.decode(latents.to(dtype=self.dtype)))
+        self.vae_bytes_per_frame = max(encode_bytes, decode_bytes)
+
+    def _attention_bytes(self, num_frames: int, slice_size: Optional[int]) -> int:
+        if self.uses_xformers:
+            return 0
+        vae_scale_factor = self.pipeline.vae_scale_factor
+        sequence_length = (self.height // vae_scale_factor) * (self.width // vae_scale_factor)
+        rows = num_frames * self.num_heads if slice_size is None else slice_size
+        # The scores and their softmax are alive at the same time
+        return 2 * rows * sequence_length**2 * self.element_size
+
+    def predict_peak(self, static_bytes, num_frames, windows_per_batch, cfg_multiplier, slice_size, vae_batch_size):
+        unet_frames = num_frames * windows_per_batch * cfg_multiplier
+        unet_peak = unet_frames * self.unet_bytes_per_frame + self._attention_bytes(unet_frames, slice_size)
+        vae_peak = vae_batch_size * self.vae_bytes_per_frame
+        return int(static_bytes + self.safety_factor * max(unet_peak, vae_peak))
+
+    def plan(
+        self,
+        memory_budget: int,
+        num_frames: int = 16,
+        do_classifier_free_guidance: bool = False,
+        max_windows_per_batch: int = 8,
+    ) -> MemoryPlan:
+        if self.unet_bytes_per_frame is None:
+            self.calibrate()
+        static_bytes = torch.cuda.memory_allocated(self.device)
+        cfg_multiplier = 2 if do_classifier_free_guidance else 1
+
+        slice_sizes = [None]
+        slice_size = self.max_slice_size // 2
+        while slice_size >= 1 and not self.uses_xformers:
+            slice_sizes.append(slice_size)
+            slice_size //= 2
+
+        for windows_per_batch in range(max_windows_per_batch, 0, -1):
+            vae_batch_sizes = [num_frames * windows_per_batch] + [
+                size for size in (16, 8, 4, 2, 1) if size < num_frames * windows_per_batch
+            ]
+            for slice_size in slice_sizes:
+                for vae_batch_size in vae_batch_sizes:
+                    predicted_peak = self.predict_peak(
+                        static_bytes, num_frames, windows_per_batch, cfg_multiplier, slice_size, vae_batch_size
+                    )
+                    if predicted_peak <= memory_budget:
+                        return MemoryPlan(slice_size, vae_batch_size, windows_per_batch, predicted_peak)
+
+        # Nothing fits, use the plan that needs the least memory
+        predicted_peak = self.predict_peak(static_bytes, num_frames, 1, cfg_multiplier, slice_sizes[-1], 1)
+        print(
+            f"No plan fits in the memory budget of {memory_budget / 2**30:.2f}GiB, "
+            f"using the smallest one ({predicted_peak / 2**30:.2f}GiB)"
+        )
+        return MemoryPlan(slice_sizes[-1], 1, 1, predicted_peak)
@@ -0,0 +1,163 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import queue
+import threading
+import time
+from typing import Callable, Iterable, List, Tuple
+
+_END = object()
+
+
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.num_items = 0
+        self.busy_time = 0.0
+        self.wall_time = 0.0
+        self.queue_depth_sum = 0
+        self.queue_depth_max = 0
+        self.queue_depth_samples = 0
+
+    def record_queue_depth(self, depth: int):
+        self.queue_depth_sum += depth
+        self.queue_depth_max = max(self.queue_depth_max, depth)
+        self.queue_depth_samples += 1
+
+    @property
+    def utilization(self):
+        return self.busy_time / self.wall_time if self.wall_time > 0 else 0.0
+
+    @property
+    def mean_queue_depth(self):
+        return self.queue_depth_sum / self.queue_depth_samples if self.queue_depth_samples > 0 else 0.0
+
+    def __repr__(self):
+        return (
+            f"{self.name}: items={self.num_items}, busy={self.busy_time:.2f}s, utilization={self.utilization:.0%}, "
+            f"input queue depth mean={self.mean_queue_depth:.2f} max={self.queue_depth_max}"
+        )
+
+
+class StagedExecutor:
+    """
+    Runs every item of an iterable through a chain of stages. In threaded mode each stage runs in its own thread
+    and consecutive stages are connected by bounded queues, so that item N+1 can be processed by a stage while item
+    N is still in the next one. Otherwise the items go through all the stages one by one in the calling thread.
+    The order of the items is preserved in both modes.
+
+    Args:
+        stages: list of (name, function) pairs. Each function takes the output of the previous stage (the first one
+            takes the items of the iterable) and the return value of the last one is discarded.
+        queue_size: maximum number of items waiting in front of each stage.
+
+    The busy time of the first stage includes the time spent producing its items from the iterable, in both modes.
+    """
+
+    def __init__(self, stages: List[Tuple[str, Callable]], queue_size: int = 2):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.stats = [StageStats(name) for name, _ in stages]
+
+    def run(self, items: Iterable, threaded: bool = True):
+        if threaded:
+            self._run_threaded(items)
+        else:
+            self._run_sequential(items)
+        return self.stats
+
+    def _run_sequential(self, items: Iterable):
+        start_time = time.perf_counter()
+        source = iter(items)
+        while True:
+            # Producing the items (e.g. decoding the frames) counts as work of the first stage, as in threaded mode
+            stage_start_time = time.perf_counter()
+            item = next(source, _END)
+            self.stats[0].busy_time += time.perf_counter() - stage_start_time
+            if item is _END:
+                break
+            for (_, function), stats in zip(self.stages, self.stats):
+                stage_start_time = time.perf_counter()
+                item = function(item)
+                stats.busy_time += time.perf_counter() - stage_start_time
+                stats.num_items += 1
+        for stats in self.stats:
+            stats.wall_time = time.perf_counter() - start_time
+
+    def _run_threaded(self, items: Iterable):
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) - 1)]
+        stop_event = threading.Event()
+        errors = []
+
+        def put(q: queue.Queue, item):
+            while not stop_event.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def get(q: queue.Queue, stats: StageStats):
+            stats.record_queue_depth(q.qsize())
+            while not stop_event.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return _END
+
+        def worker(index: int):
+            _, function = self.stages[index]
+            stats = self.stats[index]
+            in_queue = queues[index - 1] if index > 0 else None
+            out_queue = queues[index] if index < len(queues) else None
+            source = iter(items) if in_queue is None else None
+            start_time = time.perf_counter()
+            try:
+                while not stop_event.is_set():
+                    if source is not None:
+                        stage_start_time = time.perf_counter()
+                        item = next(source, _END)
+                        stats.busy_time += time.perf_counter() - stage_start_time
+                    else:
+                        item = get(in_queue, stats)
+                    if item is _END:
+                        break
+
+                    stage_start_time = time.perf_counter()
+                    item = function(item)
+                    stats.busy_time += time.perf_counter() - stage_start_time
+                    stats.num_items += 1
+
+                    if out_queue is not None:
+                        put(out_queue, item)
+            except BaseException as e:
+                errors.append(e)
+                stop_event.set()
+            finally:
+                if out_queue is not None:
+                    put(out_queue, _END)
+                stats.wall_time = time.perf_counter() - start_time
+
+        threads = [
+            threading.Thread(target=worker, args=(index,), name=f"stage-{name}", daemon=True)
+            for index, (name, _) in enumerate(self.stages)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
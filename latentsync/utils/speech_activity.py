@@ -0,0 +1,78 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import torch
+
+
+def detect_speech_frames(
+    audio_samples: torch.Tensor,
+    sample_rate: int = 16000,
+    fps: int = 25,
+    threshold_db: float = -45.0,
+    dynamic_range_db: float = 35.0,
+    padding_frames: int = 3,
+) -> np.ndarray:
+    """
+    Energy based speech activity detection, one decision per video frame. A frame is speech if the RMS level of its
+    audio is above `threshold_db` dBFS and within `dynamic_range_db` of the loudest frame. The speech regions are
+    then widened by `padding_frames` on both sides, so that the mouth is already moving when the speech starts.
+    """
+    audio_samples = audio_samples.float().cpu().numpy()
+    samples_per_frame = sample_rate / fps
+    num_frames = int(np.ceil(len(audio_samples) / samples_per_frame))
+    if num_frames == 0:
+        return np.zeros(0, dtype=bool)
+
+    padded = np.zeros(int(np.ceil(num_frames * samples_per_frame)), dtype=np.float32)
+    padded[: len(audio_samples)] = audio_samples
+    frame_starts = (np.arange(num_frames) * samples_per_frame).astype(np.int64)
+    frame_ends = (np.arange(1, num_frames + 1) * samples_per_frame).astype(np.int64)
+    energy = np.concatenate([[0.0], np.cumsum(padded.astype(np.float64) ** 2)])
+    mean_square = (energy[frame_ends] - energy[frame_starts]) / np.maximum(frame_ends - frame_starts, 1)
+    level_db = 10 * np.log10(mean_square + 1e-10)
+
+    speech = (level_db > threshold_db) & (level_db > level_db.max() - dynamic_range_db)
+    if padding_frames > 0:
+        kernel = np.ones(2 * padding_frames + 1)
+        speech = np.convolve(speech.astype(np.float64), kernel, mode="same") > 0
+    return speech
+
+
+def get_speech_windows(speech_frames: np.ndarray, num_windows: int, num_frames: int) -> np.ndarray:
+    """A window is speech if any of its `num_frames` frames is. Frames without audio count as silent."""
+    padded = np.zeros(num_windows * num_frames, dtype=bool)
+    length = min(len(speech_frames), len(padded))
+    padded[:length] = speech_frames[:length]
+    return padded.reshape(num_windows, num_frames).any(axis=1)
+
+
+def get_crossfade_weights(speech_windows: np.ndarray, num_frames: int, crossfade_frames: int) -> np.ndarray:
+    """
+    Per frame weight of the lipsynced frame against the original one: 1 in speech windows and 0 in silent ones,
+    with linear ramps over the `crossfade_frames` frames of the speech windows next to silent ones.
+    """
+    weights = np.repeat(speech_windows.astype(np.float32), num_frames)
+    crossfade_frames = min(crossfade_frames, num_frames)
+    if crossfade_frames == 0:
+        return weights
+    ramp = np.arange(1, crossfade_frames + 1, dtype=np.float32) / (crossfade_frames + 1)
+    for index in np.flatnonzero(speech_windows):
+        start = index * num_frames
+        end = start + num_frames
+        if index > 0 and not speech_windows[index - 1]:
+            weights[start : start + crossfade_frames] = np.minimum(weights[start : start + crossfade_frames], ramp)
+        if index < len(speech_windows) - 1 and not speech_windows[index + 1]:
+            weights[end - crossfade_frames : end] = np.minimum(weights[end - crossfade_frames : end], ramp[::-1])
+    return weights
@@ -13,11 +13,10 @@
 # limitations under the License.
 
 import os
-import imageio
 import numpy as np
 import json
-from typing import Union
-import matplotlib.pyplot as plt
+import threading
+from typing import Optional, Union
 
 import torch
 import torch.nn as nn
@@ -28,11 +27,10 @@ from torchvision import transforms
 
 from tqdm import tqdm
 from einops import rearrange
-import cv2
-from decord import AudioReader, VideoReader
-import shutil
 import subprocess
 
+# cv2, decord, imageio and matplotlib are imported by the functions that use them, so that importing this module
+# (e.g. in every worker process spawned by the preprocessing) only costs what the caller actually uses
 
 # Machine epsilon for a float32 (single precision)
 eps = np.finfo(np.float32).eps
@@ -45,65 +43,106 @@ def read_json(filepath: str):
 
 
 def read_video(video_path: str, change_fps=True, use_decord=True):
-    if change_fps:
-        temp_dir = "temp"
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        os.makedirs(temp_dir, exist_ok=True)
-        command = (
-            f"ffmpeg -loglevel error -y -nostdin -i {video_path} -r 25 -crf 18 {os.path.join(temp_dir, 'video.mp4')}"
-        )
-        subprocess.run(command, shell=True)
-        target_video_path = os.path.join(temp_dir, "video.mp4")
-    else:
-        target_video_path = video_path
-
     if use_decord:
-        return read_video_decord(target_video_path)
+        return read_video_decord(video_path, change_fps)
     else:
-        return read_video_cv2(target_video_path)
-
+        return read_video_cv2(video_path, change_fps)
+
+
+def get_resampled_frame_indices(num_frames: int, src_fps: float, target_fps: float = 25):
+    """
+    Source frame index of every output frame when converting a video from `src_fps` to `target_fps`, following
+    ffmpeg's fps filter: every source frame lands on the output slot nearest to its timestamp, a slot that receives
+    several frames keeps the last one and empty slots repeat the previous frame. Timestamps are assumed to be
+    evenly spaced (constant frame rate): for a variable frame rate input, whose timestamps ffmpeg's `-r 25` follows,
+    the frames drift where the rate changes. `eval/check_video_resampling.py` compares both frame by frame.
+    """
+    check_frame_rate(src_fps)
+    if abs(src_fps - target_fps) < 0.01:
+        return np.arange(num_frames)
+    slots = np.floor(np.arange(num_frames + 1) * (target_fps / src_fps) + 0.5).astype(np.int64)
+    return np.repeat(np.arange(num_frames), np.diff(slots))
+
+
+def check_frame_rate(src_fps: float):
+    # Some containers report no frame rate (0 or NaN), which leaves nothing to resample from
+    if not src_fps > 0:
+        raise ValueError(
+            f"Cannot resample a video whose frame rate is unknown ({src_fps}), convert it to 25 FPS with ffmpeg first"
+        )
 
-def read_video_decord(video_path: str):
-    vr = VideoReader(video_path)
-    video_frames = vr[:].asnumpy()
-    vr.seek(0)
-    return video_frames
 
+def _iter_frames_cv2(video_path: str, change_fps=True, target_fps: float = 25):
+    import cv2
 
-def read_video_cv2(video_path: str):
-    # Open the video file
     cap = cv2.VideoCapture(video_path)
-
-    # Check if the video was opened successfully
     if not cap.isOpened():
         print("Error: Could not open video.")
-        return np.array([])
-
+        return
+    try:
+        src_fps = cap.get(cv2.CAP_PROP_FPS)
+        if change_fps:
+            check_frame_rate(src_fps)
+        resample = change_fps and abs(src_fps - target_fps) >= 0.01
+        ratio = target_fps / src_fps if resample else 1.0
+        index = 0
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            if resample:
+                # Same mapping as get_resampled_frame_indices, computed one frame at a time
+                num_repeats = int(np.floor((index + 1) * ratio + 0.5) - np.floor(index * ratio + 0.5))
+            else:
+                num_repeats = 1
+            for _ in range(num_repeats):
+                yield frame_rgb
+            index += 1
+    finally:
+        cap.release()
+
+
+def iter_video_frames(video_path: str, chunk_size: int, change_fps=True):
+    """
+    Yield the frames of a video in chunks of `chunk_size` (the last chunk may be shorter), so that
+    only one chunk is held in memory at a time. With `change_fps`, frames are resampled to 25 FPS
+    while decoding, exactly like `read_video`.
+    """
     frames = []
+    for frame in _iter_frames_cv2(video_path, change_fps):
+        frames.append(frame)
+        if len(frames) == chunk_size:
+            yield np.stack(frames)
+            frames = []
+    if len(frames) > 0:
+        yield np.stack(frames)
 
-    while True:
-        # Read a frame
-        ret, frame = cap.read()
-
-        # If frame is read correctly ret is True
-        if not ret:
-            break
 
-        # Convert BGR to RGB
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+def read_video_decord(video_path: str, change_fps=False):
+    from decord import VideoReader
 
-        frames.append(frame_rgb)
+    vr = VideoReader(video_path)
+    if change_fps:
+        frame_indices = get_resampled_frame_indices(len(vr), vr.get_avg_fps())
+        # Only the selected frames are decoded, and a 25 FPS input is decoded exactly once
+        video_frames = vr.get_batch(frame_indices).asnumpy()
+    else:
+        video_frames = vr[:].asnumpy()
+    vr.seek(0)
+    return video_frames
 
-    # Release the video capture object
-    cap.release()
 
+def read_video_cv2(video_path: str, change_fps=False):
+    frames = list(_iter_frames_cv2(video_path, change_fps))
     return np.array(frames)
 
 
 def read_audio(audio_path: str, audio_sample_rate: int = 16000):
     if audio_path is None:
         raise ValueError("Audio path is required.")
+    from decord import AudioReader
+
     ar = AudioReader(audio_path, sample_rate=audio_sample_rate, mono=True)
 
     # To access the audio samples
@@ -113,14 +152,136 @@ def read_audio(audio_path: str, audio_sample_rate: int = 16000):
     return audio_samples
 
 
+class FFmpegVideoWriter:
+    """
+    Streams raw RGB frames into a single ffmpeg process through its stdin, which encodes them with libx264 and
+    muxes them with the audio in one pass, without any intermediate file. The audio is either a mono waveform
+    held in memory (`audio_samples`, float in [-1, 1]), fed to ffmpeg through a separate pipe, or the audio stream
+    of `audio_path`, which may have no audio stream, in which case the output has none either. With `shortest`, the
+    output ends with the shortest of the two streams, otherwise the audio is kept whole.
+    """
+
+    def __init__(
+        self,
+        video_output_path: str,
+        fps: int,
+        audio_samples: Optional[Union[np.ndarray, torch.Tensor]] = None,
+        audio_sample_rate: int = 16000,
+        audio_path: Optional[str] = None,
+        shortest: bool = False,
+    ):
+        if audio_samples is not None and audio_path is not None:
+            raise ValueError("Only one of `audio_samples` and `audio_path` can be given.")
+        if isinstance(audio_samples, torch.Tensor):
+            audio_samples = audio_samples.cpu().numpy()
+        self.video_output_path = video_output_path
+        self.fps = fps
+        self.audio_samples = audio_samples
+        self.audio_sample_rate = audio_sample_rate
+        self.audio_path = audio_path
+        self.shortest = shortest
+        self.num_frames = 0
+        self.process = None
+        self.audio_thread = None
+
+    def _open(self, width: int, height: int):
+        command = [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "rgb24",
+            "-s",
+            f"{width}x{height}",
+            "-r",
+            str(self.fps),
+            "-i",
+            "pipe:0",
+        ]
+        pass_fds = ()
+        if self.audio_samples is not None:
+            audio_read_fd, audio_write_fd = os.pipe()
+            pass_fds = (audio_read_fd,)
+            command += ["-f", "f32le", "-ar", str(self.audio_sample_rate), "-ac", "1", "-i", f"pipe:{audio_read_fd}"]
+        elif self.audio_path is not None:
+            command += ["-i", self.audio_path]
+        command += ["-map", "0:v"]
+        if self.audio_samples is not None or self.audio_path is not None:
+            command += ["-map", "1:a?", "-c:a", "aac", "-q:a", "0"]
+            if self.shortest:
+                command += ["-shortest"]
+        # yuv420p needs even dimensions
+        command += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-c:v", "libx264", "-pix_fmt", "yuv420p"]
+        command += [self.video_output_path]
+
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, pass_fds=pass_fds)
+
+        if self.audio_samples is not None:
+            # Only ffmpeg may hold the read end, otherwise the feeder would block instead of failing once ffmpeg exits
+            os.close(audio_read_fd)
+            audio_bytes = np.ascontiguousarray(self.audio_samples, dtype="<f4").tobytes()
+            self.audio_thread = threading.Thread(target=self._feed_audio, args=(audio_write_fd, audio_bytes))
+            self.audio_thread.start()
+
+    @staticmethod
+    def _feed_audio(fd: int, audio_bytes: bytes):
+        try:
+            with os.fdopen(fd, "wb") as pipe:
+                pipe.write(audio_bytes)
+        except BrokenPipeError:
+            # ffmpeg stops reading the audio once the video has ended (-shortest) or once it failed
+            pass
+
+    def write(self, video_frames: np.ndarray):
+        for frame in video_frames:
+            if self.process is None:
+                height, width = frame.shape[:2]
+                self._open(width, height)
+            self.process.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+            self.num_frames += 1
+
+    def close(self):
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        return_code = self.process.wait()
+        if self.audio_thread is not None:
+            self.audio_thread.join()
+        self.process = None
+        if return_code != 0:
+            raise RuntimeError(f"ffmpeg failed to write {self.video_output_path} (exit code {return_code})")
+
+    def abort(self):
+        if self.process is None:
+            return
+        self.process.kill()
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            # Flushing the buffered frames into the killed process must not hide the error being handled
+            pass
+        self.process.wait()
+        if self.audio_thread is not None:
+            self.audio_thread.join()
+        self.process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
 def write_video(video_output_path: str, video_frames: np.ndarray, fps: int):
-    height, width = video_frames[0].shape[:2]
-    out = cv2.VideoWriter(video_output_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
-    # out = cv2.VideoWriter(video_output_path, cv2.VideoWriter_fourcc(*"vp09"), fps, (width, height))
-    for frame in video_frames:
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        out.write(frame)
-    out.release()
+    """Encodes the RGB `video_frames` with libx264 through `FFmpegVideoWriter`, without audio"""
+    with FFmpegVideoWriter(video_output_path, fps) as writer:
+        writer.write(video_frames)
 
 
 def init_dist(backend="nccl", **kwargs):
@@ -147,16 +308,15 @@ def zero_rank_log(logger, message: str):
 
 
 def make_audio_window(audio_embeddings: torch.Tensor, window_size: int):
-    audio_window = []
-    end_idx = audio_embeddings.shape[1] - window_size + 1
-    for i in range(end_idx):
-        audio_window.append(audio_embeddings[:, i : i + window_size, :])
-    audio_window = torch.stack(audio_window)
-    audio_window = rearrange(audio_window, "f b w d -> b f w d")
+    """(b, n, d) -> (b, n - window_size + 1, window_size, d) sliding windows, as a view of `audio_embeddings`"""
+    audio_window = audio_embeddings.unfold(1, window_size, 1)
+    audio_window = rearrange(audio_window, "b f d w -> b f w d")
     return audio_window
 
 
 def check_video_fps(video_path: str):
+    import cv2
+
     cam = cv2.VideoCapture(video_path)
     fps = cam.get(cv2.CAP_PROP_FPS)
     if fps != 25:
@@ -184,6 +344,8 @@ def save_videos_grid(videos: torch.Tensor, path: str, rescale=False, n_rows=6, f
         outputs.append(x)
 
     os.makedirs(os.path.dirname(path), exist_ok=True)
+    import imageio
+
     imageio.mimsave(path, outputs, fps=fps)
 
 
@@ -284,6 +446,8 @@ def ddim_inversion(pipeline, ddim_scheduler, video_latent, num_inv_steps, prompt
 
 
 def plot_loss_chart(save_path: str, *args):
+    import matplotlib.pyplot as plt
+
     # Creating the plot
     plt.figure()
     for loss_line in args:
@@ -358,6 +522,8 @@ def gather_video_paths(input_dir, paths):
 
 
 def count_video_time(video_path):
+    import cv2
+
     video = cv2.VideoCapture(video_path)
 
     frame_count = video.get(cv2.CAP_PROP_FRAME_COUNT)
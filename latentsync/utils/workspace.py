@@ -0,0 +1,48 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+
+class Workspace:
+    """
+    Scratch directory private to one invocation, so that concurrent invocations never share intermediate files.
+    A uniquely named directory is created under `root` (the system temp directory by default) and is removed with
+    everything in it by `cleanup`, or when leaving the `with` block.
+    """
+
+    def __init__(self, root: Optional[str] = None, prefix: str = "latentsync_"):
+        if root is not None:
+            os.makedirs(root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=root)
+
+    def join(self, *paths: str) -> str:
+        return os.path.join(self.path, *paths)
+
+    def makedirs(self, *paths: str) -> str:
+        path = self.join(*paths)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
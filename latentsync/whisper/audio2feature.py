@@ -1,9 +1,50 @@
 # Adapted from https://github.com/TMElyralab/MuseTalk/blob/main/musetalk/whisper/audio2feature.py
 
 from .whisper import load_model
+from .whisper.audio import N_FRAMES, SAMPLE_RATE, log_mel_spectrogram, pad_or_trim
+from ..utils.util import read_audio
 import numpy as np
 import torch
 import os
+from typing import Optional, Sequence, Union
+
+
+def get_audio_window_indices(vid_indices, length: int, audio_feat_length=(2, 2), fps=25) -> torch.Tensor:
+    """
+    (n, window) indices of the features `Audio2Feature.get_sliced_feature` selects for every video frame index in
+    `vid_indices`, clamped to [0, length - 1] the same way
+    """
+    vid_indices = torch.as_tensor(vid_indices, dtype=torch.float64).reshape(-1)
+    # Same float64 arithmetic and truncation as int(vid_idx * 50 / fps)
+    center_idx = (vid_indices * 50 / fps).long()
+    offsets = torch.arange(-audio_feat_length[0] * 2, (audio_feat_length[1] + 1) * 2)
+    return (center_idx[:, None] + offsets).clamp(0, length - 1)
+
+
+class AudioWindowIndexer:
+    """
+    Lazy sequence of the audio windows of every video frame, as `feature2chunks` returns them. Indexing it with an
+    int, a slice or a sequence of frame indices gathers the windows of these frames with a single indexing of
+    `feature_array`, as a (n, window * n_layers, D) tensor, so that only the windows in use are ever materialized.
+    """
+
+    def __init__(self, feature_array: torch.Tensor, num_chunks: int, fps=25, audio_feat_length=(2, 2)):
+        self.feature_array = feature_array
+        self.num_chunks = num_chunks
+        self.fps = fps
+        self.audio_feat_length = audio_feat_length
+
+    def __len__(self):
+        return self.num_chunks
+
+    def __getitem__(self, index: Union[int, slice, Sequence[int], torch.Tensor]) -> torch.Tensor:
+        if isinstance(index, (int, np.integer)):
+            return self[[index + len(self) if index < 0 else index]][0]
+        if isinstance(index, slice):
+            index = range(*index.indices(len(self)))
+        indices = get_audio_window_indices(index, len(self.feature_array), self.audio_feat_length, self.fps)
+        windows = self.feature_array[indices.to(self.feature_array.device)]
+        return windows.reshape(len(indices), -1, self.feature_array.shape[-1])
 
 
 class Audio2Feature:
@@ -13,10 +54,14 @@ class Audio2Feature:
         device=None,
         audio_embeds_cache_dir=None,
         num_frames=16,
+        segment_batch_size=8,
+        variable_length_segments=False,
     ):
         self.model = load_model(model_path, device)
         self.audio_embeds_cache_dir = audio_embeds_cache_dir
         self.num_frames = num_frames
+        self.segment_batch_size = segment_batch_size
+        self.variable_length_segments = variable_length_segments
         self.embedding_dim = self.model.dims.n_audio_state
 
     def get_sliced_feature(self, feature_array, vid_idx, audio_feat_length=[2, 2], fps=25):
@@ -80,18 +125,32 @@ class Audio2Feature:
         selected_feature = torch.from_numpy(selected_feature)
         return selected_feature, selected_idx
 
+    def get_sliced_features(self, feature_array, vid_indices, audio_feat_length=[2, 2], fps=25):
+        """
+        `get_sliced_feature` of every index of `vid_indices`, stacked as a (n, 50, D) tensor by a single gather
+        """
+        indexer = AudioWindowIndexer(feature_array, len(vid_indices), fps, audio_feat_length)
+        return indexer[vid_indices]
+
     def feature2chunks(self, feature_array, fps, audio_feat_length=[2, 2]):
+        """
+        Audio windows of every video frame, as a lazy `AudioWindowIndexer`: slicing it returns a (n, 50, D) tensor
+        """
+        print(f"video in {fps} FPS, audio idx in 50FPS")
+        num_chunks = self.get_num_chunks(feature_array, fps)
+        return AudioWindowIndexer(feature_array, num_chunks, fps, audio_feat_length)
+
+    def feature2chunks_loop(self, feature_array, fps, audio_feat_length=[2, 2]):
+        """Reference implementation of `feature2chunks`, as a list of the windows built one by one"""
         whisper_chunks = []
         whisper_idx_multiplier = 50.0 / fps
         i = 0
-        print(f"video in {fps} FPS, audio idx in 50FPS")
 
         while True:
             start_idx = int(i * whisper_idx_multiplier)
             selected_feature, selected_idx = self.get_sliced_feature(
                 feature_array=feature_array, vid_idx=i, audio_feat_length=audio_feat_length, fps=fps
             )
-            # print(f"i:{i},selected_idx {selected_idx}")
             whisper_chunks.append(selected_feature)
             i += 1
             if start_idx > len(feature_array):
@@ -99,6 +158,16 @@ class Audio2Feature:
 
         return whisper_chunks
 
+    def get_num_chunks(self, feature_array, fps):
+        """
+        Number of chunks `feature2chunks` would return for `feature_array`, without building them
+        """
+        whisper_idx_multiplier = 50.0 / fps
+        i = 0
+        while int(i * whisper_idx_multiplier) <= len(feature_array):
+            i += 1
+        return i + 1
+
     def _audio2feat(self, audio_path: str):
         # get the sample rate of the audio
         result = self.model.transcribe(audio_path)
@@ -114,35 +183,111 @@ class Audio2Feature:
         concatenated_array = torch.from_numpy(np.concatenate(embed_list, axis=0))
         return concatenated_array
 
-    def audio2feat(self, audio_path):
+    @torch.no_grad()
+    def extract_embeddings(self, audio_samples: torch.Tensor) -> torch.Tensor:
+        """
+        Batched equivalent of `_audio2feat` for 16 kHz mono samples: the mel spectrogram is cut into the same
+        30-second segments, which are encoded `segment_batch_size` at a time, and the embeddings of every layer are
+        stacked on the device of the model. Returns a (n, n_layer + 1, n_state) tensor on that device, with the
+        dtype `transcribe` encodes with. The segments are encoded exactly like `_audio2feat` does, so the outputs
+        match it for the same samples, up to the kernels the device picks for batched matmuls (bit for bit with
+        `segment_batch_size=1`).
+
+        With `variable_length_segments`, the last segment is encoded without its padding instead, see `pad_segment`.
+        """
+        mel = log_mel_spectrogram(audio_samples.float().cpu())
+        num_mel_frames = mel.shape[-1]
+        segment_starts = list(range(0, num_mel_frames, N_FRAMES))
+        tail_start = None
+        if self.variable_length_segments and num_mel_frames % N_FRAMES != 0:
+            tail_start = segment_starts.pop()
+
+        embeddings_list = []
+        for i in range(0, len(segment_starts), self.segment_batch_size):
+            batch_starts = segment_starts[i : i + self.segment_batch_size]
+            embeddings = self.encode_segments(
+                torch.stack([pad_or_trim(mel[:, start : start + N_FRAMES], N_FRAMES) for start in batch_starts])
+            )
+            for segment_embeddings, start in zip(embeddings, batch_starts):
+                end = min(start + N_FRAMES, num_mel_frames)
+                embeddings_list.append(segment_embeddings[: (end - start) // 2])
+
+        if tail_start is not None:
+            embeddings = self.encode_segments(self.pad_segment(mel[:, tail_start:])[None])
+            embeddings_list.append(embeddings[0, : (num_mel_frames - tail_start) // 2])
+        return torch.cat(embeddings_list, dim=0)
+
+    def pad_segment(self, mel: torch.Tensor) -> torch.Tensor:
+        """
+        Pads the (n_mels, n) mel spectrogram of a segment for the encoder: to the N_FRAMES of a 30-second segment as
+        whisper was trained, or only to the stride of the encoder convolutions with `variable_length_segments`.
+        Without the padding, the cost of the encoder shrinks with the length of the segment (more than linearly for
+        the attention), but the self-attention no longer sees the padded frames, so the embeddings differ from the
+        padded ones. `eval/benchmark_variable_length_encoding.py` measures by how much.
+        """
+        if not self.variable_length_segments:
+            return pad_or_trim(mel, N_FRAMES)
+        num_mel_frames = min(mel.shape[-1], N_FRAMES)
+        return pad_or_trim(mel, num_mel_frames + num_mel_frames % 2)
+
+    @torch.no_grad()
+    def encode_segments(self, segments: torch.Tensor) -> torch.Tensor:
+        """
+        (b, n_mels, n_frames) mel segments -> (b, n_frames // 2, n_layer + 1, n_state) embeddings on the device of
+        the model, in the dtype `transcribe` encodes with
+        """
+        device = self.model.device
+        dtype = torch.float32 if device.type == "cpu" else torch.float16
+        _, embeddings = self.model.encoder.forward_with_embeddings(segments.to(device).to(dtype))
+        return embeddings.transpose(1, 2)
+
+    def load_audio(self, audio_path: str) -> torch.Tensor:
+        """
+        Decodes the audio in process, quantized to 16 bits like the ffmpeg subprocess of `whisper.load_audio`. Audio
+        that is not already 16 kHz is resampled by decord, not by ffmpeg's `-ar 16000`, so its samples (and thus its
+        embeddings) differ slightly from the ones of `_audio2feat`.
+        """
+        return quantize_audio(read_audio(audio_path, SAMPLE_RATE))
+
+    def audio2feat(self, audio_path, audio_samples: Optional[torch.Tensor] = None):
+        """
+        Embeddings of the audio at `audio_path`, cached in `audio_embeds_cache_dir` if set. `audio_samples`, its
+        16 kHz mono samples, avoids decoding it again. The embeddings are on the device of the model whether they
+        come from the cache or not, so that callers can stack them.
+        """
         if self.audio_embeds_cache_dir == "" or self.audio_embeds_cache_dir is None:
-            return self._audio2feat(audio_path)
+            return self._extract_audio_embeddings(audio_path, audio_samples)
 
         audio_embeds_cache_path = os.path.join(self.audio_embeds_cache_dir, os.path.basename(audio_path) + ".pt")
 
         if os.path.isfile(audio_embeds_cache_path):
             try:
-                audio_feat = torch.load(audio_embeds_cache_path)
+                audio_feat = torch.load(audio_embeds_cache_path, map_location=self.model.device)
             except Exception as e:
                 print(f"{type(e).__name__} - {e} - {audio_embeds_cache_path}")
                 os.remove(audio_embeds_cache_path)
-                audio_feat = self._audio2feat(audio_path)
-                torch.save(audio_feat, audio_embeds_cache_path)
+                audio_feat = self._extract_audio_embeddings(audio_path, audio_samples)
+                torch.save(audio_feat.cpu(), audio_embeds_cache_path)
         else:
-            audio_feat = self._audio2feat(audio_path)
-            torch.save(audio_feat, audio_embeds_cache_path)
+            audio_feat = self._extract_audio_embeddings(audio_path, audio_samples)
+            torch.save(audio_feat.cpu(), audio_embeds_cache_path)
 
         return audio_feat
 
+    def _extract_audio_embeddings(self, audio_path, audio_samples=None):
+        if audio_samples is None:
+            audio_samples = self.load_audio(audio_path)
+        else:
+            audio_samples = quantize_audio(audio_samples)
+        return self.extract_embeddings(audio_samples)
+
     def crop_overlap_audio_window(self, audio_feat, start_index):
-        selected_feature_list = []
-        for i in range(start_index, start_index + self.num_frames):
-            selected_feature, selected_idx = self.get_sliced_feature(
-                feature_array=audio_feat, vid_idx=i, audio_feat_length=[2, 2], fps=25
-            )
-            selected_feature_list.append(selected_feature)
-        mel_overlap = torch.stack(selected_feature_list)
-        return mel_overlap
+        return self.get_sliced_features(audio_feat, range(start_index, start_index + self.num_frames))
+
+
+def quantize_audio(audio_samples: torch.Tensor) -> torch.Tensor:
+    """Rounds float samples to 16 bit PCM values, as ffmpeg's s16le output does"""
+    return torch.round(audio_samples.float() * 32768).clamp(-32768, 32767) / 32768
 
 
 if __name__ == "__main__":
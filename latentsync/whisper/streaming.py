@@ -0,0 +1,143 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import torch
+
+from .audio2feature import Audio2Feature, get_audio_window_indices, quantize_audio
+from .whisper.audio import CHUNK_LENGTH, HOP_LENGTH, SAMPLE_RATE, log_mel_spectrogram
+
+# The encoder downsamples the mel frames by 2, so there are 50 features per second
+SAMPLES_PER_FEATURE = 2 * HOP_LENGTH
+FEATURES_PER_SECOND = SAMPLE_RATE // SAMPLES_PER_FEATURE
+
+
+class StreamingAudio2Feature:
+    """
+    Incremental counterpart of `Audio2Feature.audio2feat` + `feature2chunks` for live audio. `push` takes 16 kHz
+    mono PCM chunks of any size and returns the audio windows of the video frames (in the `get_sliced_feature`
+    layout) whose right context became available, and `flush` returns the remaining ones at the end of the stream.
+
+    Whenever at least `hop_seconds` of new features can be finalized, the last `context_seconds` of audio (with at
+    least `min_left_context_seconds` before the first new feature) are encoded as one padded whisper segment, and
+    the new features are kept, except for the last `lookahead_seconds` which wait for more right context. Finalized
+    features are never revised. A window is emitted once its last feature is final, which bounds the latency of a
+    frame to its 2 frames of right context plus `hop_seconds` and `lookahead_seconds`.
+
+    The features drift from the offline ones because the encoder sees a different segmentation of the audio, and
+    because the log-mel spectrogram is normalized by the maximum of the context instead of the whole audio. With
+    `variable_length_segments` set on the encoder, the contexts are encoded without padding to 30 seconds.
+    `eval/benchmark_streaming_audio.py` measures both the latency and the drift.
+    """
+
+    def __init__(
+        self,
+        audio_encoder: Audio2Feature,
+        fps: int = 25,
+        audio_feat_length=(2, 2),
+        context_seconds: float = 10.0,
+        min_left_context_seconds: float = 2.0,
+        hop_seconds: float = 0.2,
+        lookahead_seconds: float = 0.1,
+    ):
+        if not min_left_context_seconds < context_seconds <= CHUNK_LENGTH:
+            raise ValueError(f"context_seconds must be in ({min_left_context_seconds}, {CHUNK_LENGTH}]")
+        self.audio_encoder = audio_encoder
+        self.fps = fps
+        self.audio_feat_length = audio_feat_length
+        self.context_samples = int(context_seconds * FEATURES_PER_SECOND) * SAMPLES_PER_FEATURE
+        self.min_left_context_samples = int(min_left_context_seconds * FEATURES_PER_SECOND) * SAMPLES_PER_FEATURE
+        self.hop_features = max(int(hop_seconds * FEATURES_PER_SECOND), 1)
+        self.lookahead_features = int(round(lookahead_seconds * FEATURES_PER_SECOND))
+        self.reset()
+
+    def reset(self):
+        # Tails of the audio and of the finalized features, starting at the global indices of the offsets
+        self.samples = torch.zeros(0)
+        self.samples_offset = 0
+        self.num_samples = 0
+        self.features = None
+        self.features_offset = 0
+        self.num_features = 0
+        self.num_windows = 0
+
+    def _finalize_features(self, final: bool):
+        while True:
+            num_available = self.num_samples // HOP_LENGTH // 2
+            target = num_available if final else num_available - self.lookahead_features
+            if target - self.num_features < (1 if final else self.hop_features):
+                return
+
+            first_new_sample = self.num_features * SAMPLES_PER_FEATURE
+            start = min(self.num_samples - self.context_samples, first_new_sample - self.min_left_context_samples)
+            start = max(start, 0) // SAMPLES_PER_FEATURE * SAMPLES_PER_FEATURE
+            end = min(self.num_samples, start + self.context_samples)
+            segment_features = (end - start) // HOP_LENGTH // 2
+            if not (final and end == self.num_samples):
+                segment_features -= self.lookahead_features
+            new_num_features = min(target, start // SAMPLES_PER_FEATURE + segment_features)
+            if new_num_features <= self.num_features:
+                return
+
+            samples = self.samples[start - self.samples_offset : end - self.samples_offset]
+            mel = self.audio_encoder.pad_segment(log_mel_spectrogram(samples))
+            embeddings = self.audio_encoder.encode_segments(mel[None])[0]
+            first = self.num_features - start // SAMPLES_PER_FEATURE
+            new_features = embeddings[first : first + new_num_features - self.num_features]
+            self.features = new_features if self.features is None else torch.cat([self.features, new_features])
+            self.num_features = new_num_features
+
+            # The next segment never starts before the context of the first feature that is not final yet
+            keep_from = max(self.num_features * SAMPLES_PER_FEATURE - self.context_samples, 0)
+            if keep_from > self.samples_offset:
+                self.samples = self.samples[keep_from - self.samples_offset :]
+                self.samples_offset = keep_from
+
+    def _emit_windows(self, num_windows: int) -> torch.Tensor:
+        frame_indices = range(self.num_windows, num_windows)
+        indices = get_audio_window_indices(frame_indices, self.num_features, self.audio_feat_length, self.fps)
+        windows = self.features[(indices - self.features_offset).to(self.features.device)].flatten(1, 2)
+        self.num_windows = num_windows
+
+        # Drop the features before the first one of the next window
+        next_indices = get_audio_window_indices([num_windows], self.num_features, self.audio_feat_length, self.fps)
+        keep_from = int(next_indices[0, 0])
+        if keep_from > self.features_offset:
+            self.features = self.features[keep_from - self.features_offset :]
+            self.features_offset = keep_from
+        return windows
+
+    def _num_ready_windows(self) -> int:
+        num_windows = self.num_windows
+        # The last index of a window only grows with the frame index, so the ready windows are a prefix
+        while True:
+            last_index = get_audio_window_indices([num_windows], 2**62, self.audio_feat_length, self.fps)[0, -1]
+            if last_index >= self.num_features:
+                return num_windows
+            num_windows += 1
+
+    def push(self, audio_samples: torch.Tensor) -> torch.Tensor:
+        """Appends 16 kHz mono samples and returns the (n, 50, D) windows of the frames that became ready"""
+        audio_samples = quantize_audio(torch.as_tensor(audio_samples).reshape(-1))
+        self.samples = torch.cat([self.samples, audio_samples])
+        self.num_samples += len(audio_samples)
+        self._finalize_features(final=False)
+        return self._emit_windows(self._num_ready_windows()) if self.features is not None else None
+
+    def flush(self) -> torch.Tensor:
+        """Finalizes the stream and returns the windows of all the frames `feature2chunks` would return"""
+        self._finalize_features(final=True)
+        if self.features is None:
+            return None
+        num_windows = self.audio_encoder.get_num_chunks(range(self.num_features), self.fps)
+        return self._emit_windows(max(num_windows, self.num_windows))
@@ -142,33 +142,45 @@ class AudioEncoder(nn.Module):
 
     def forward(self, x: Tensor, include_embeddings: bool = False):
         """
-        x : torch.Tensor, shape = (batch_size, n_mels, n_ctx)
-            the mel spectrogram of the audio
+        x : torch.Tensor, shape = (batch_size, n_mels, n_frames)
+            the mel spectrogram of the audio, usually padded to the n_frames = 2 * n_ctx frames of a 30-second
+            segment. Shorter inputs are encoded without padding, with the first n_frames / 2 positional embeddings,
+            which costs proportionally less but gives embeddings that differ from those of the padded segment
         include_embeddings: bool
             whether to include intermediate steps in the output
         """
-        x = F.gelu(self.conv1(x))
-        x = F.gelu(self.conv2(x))
-        x = x.permute(0, 2, 1)
-
-        assert x.shape[1:] == self.positional_embedding.shape, "incorrect audio shape"
-        x = (x + self.positional_embedding).to(x.dtype)
-
         if include_embeddings:
-            embeddings = [x.cpu().detach().numpy()]
+            x, embeddings = self.forward_with_embeddings(x)
+            return x, embeddings.cpu().detach().numpy()
 
+        x = self._embed(x)
         for block in self.blocks:
             x = block(x)
-            if include_embeddings:
-                embeddings.append(x.cpu().detach().numpy())
+        x = self.ln_post(x)
+        return x
 
+    def forward_with_embeddings(self, x: Tensor):
+        """
+        Same as `forward(x, include_embeddings=True)`, but the embeddings stay a tensor on the device of `x`, of shape
+        (batch_size, n_layer + 1, n_frames // 2, n_state)
+        """
+        x = self._embed(x)
+        embeddings = [x]
+        for block in self.blocks:
+            x = block(x)
+            embeddings.append(x)
         x = self.ln_post(x)
+        return x, torch.stack(embeddings, dim=1)
 
-        if include_embeddings:
-            embeddings = np.stack(embeddings, axis=1)
-            return x, embeddings
-        else:
-            return x
+    def _embed(self, x: Tensor):
+        x = F.gelu(self.conv1(x))
+        x = F.gelu(self.conv2(x))
+        x = x.permute(0, 2, 1)
+
+        assert x.shape[1] <= self.positional_embedding.shape[0], "incorrect audio shape"
+        assert x.shape[2] == self.positional_embedding.shape[1], "incorrect audio shape"
+        x = (x + self.positional_embedding[: x.shape[1]]).to(x.dtype)
+        return x
 
 
 class TextDecoder(nn.Module):
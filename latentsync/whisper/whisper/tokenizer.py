@@ -1,11 +1,13 @@
 import os
 from dataclasses import dataclass
 from functools import lru_cache
-from typing import List, Optional, Tuple, Union
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
-from transformers import GPT2TokenizerFast
+
+if TYPE_CHECKING:
+    from transformers import GPT2TokenizerFast
 
 LANGUAGES = {
     "en": "english",
@@ -272,6 +274,9 @@ class Tokenizer:
 
 @lru_cache(maxsize=None)
 def build_tokenizer(name: str = "gpt2"):
+    # transformers is only needed to decode text, which the lipsync feature extraction never does
+    from transformers import GPT2TokenizerFast
+
     os.environ["TOKENIZERS_PARALLELISM"] = "false"
     path = os.path.join(os.path.dirname(__file__), "assets", name)
     tokenizer = GPT2TokenizerFast.from_pretrained(path)
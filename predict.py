@@ -5,6 +5,8 @@ from cog import BasePredictor, Input, Path
 import os
 import time
 import subprocess
+from omegaconf import OmegaConf
+from latentsync.pipelines.lipsync_session import LipsyncSession
 
 MODEL_CACHE = "checkpoints"
 MODEL_URL = "https://weights.replicate.delivery/default/chunyu-li/LatentSync/model.tar"
@@ -29,6 +31,10 @@ class Predictor(BasePredictor):
         os.system("ln -s $(pwd)/checkpoints/auxiliary/s3fd-619a316812.pth ~/.cache/torch/hub/checkpoints/s3fd-619a316812.pth")
         os.system("ln -s $(pwd)/checkpoints/auxiliary/vgg16-397923af.pth ~/.cache/torch/hub/checkpoints/vgg16-397923af.pth")
 
+        # Load the models once, they stay resident for every prediction
+        config = OmegaConf.load("configs/unet/second_stage.yaml")
+        self.session = LipsyncSession(config, "checkpoints/latentsync_unet.pt")
+
     def predict(
         self,
         video: Path = Input(
@@ -51,10 +57,7 @@ class Predictor(BasePredictor):
 
         video_path = str(video)
         audio_path = str(audio)
-        config_path = "configs/unet/second_stage.yaml"
-        ckpt_path = "checkpoints/latentsync_unet.pt"
         output_path = "/tmp/video_out.mp4"
-    
-        # Run the following command:
-        os.system(f"python -m scripts.inference --unet_config_path {config_path} --inference_ckpt_path {ckpt_path} --guidance_scale {str(guidance_scale)} --video_path {video_path} --audio_path {audio_path} --video_out_path {output_path} --seed {seed}")    
+
+        self.session.run(video_path, audio_path, output_path, seed=seed, guidance_scale=guidance_scale)
         return Path(output_path)
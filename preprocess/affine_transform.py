@@ -12,15 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from latentsync.utils.util import read_video, write_video
+from latentsync.utils.util import read_video, FFmpegVideoWriter
 from latentsync.utils.image_processor import ImageProcessor
 import torch
 from einops import rearrange
 import os
 import tqdm
-import subprocess
 from multiprocessing import Process
-import shutil
 
 paths = []
 
@@ -56,26 +54,14 @@ class FaceDetector:
         self.image_processor.close()
 
 
-def combine_video_audio(video_frames, video_input_path, video_output_path, process_temp_dir):
-    video_name = os.path.basename(video_input_path)[:-4]
-    audio_temp = os.path.join(process_temp_dir, f"{video_name}_temp.wav")
-    video_temp = os.path.join(process_temp_dir, f"{video_name}_temp.mp4")
-
-    write_video(video_temp, video_frames, fps=25)
-
-    command = f"ffmpeg -y -loglevel error -i {video_input_path} -q:a 0 -map a {audio_temp}"
-    subprocess.run(command, shell=True)
-
+def combine_video_audio(video_frames, video_input_path, video_output_path):
     os.makedirs(os.path.dirname(video_output_path), exist_ok=True)
-    command = f"ffmpeg -y -loglevel error -i {video_temp} -i {audio_temp} -c:v libx264 -c:a aac -map 0:v -map 1:a -q:v 0 -q:a 0 {video_output_path}"
-    subprocess.run(command, shell=True)
-
-    os.remove(audio_temp)
-    os.remove(video_temp)
+    # Encode the frames and mux them with the audio stream of the input video in one ffmpeg pass
+    with FFmpegVideoWriter(video_output_path, fps=25, audio_path=video_input_path) as video_writer:
+        video_writer.write(video_frames)
 
 
-def func(paths, process_temp_dir, device_id, resolution):
-    os.makedirs(process_temp_dir, exist_ok=True)
+def func(paths, device_id, resolution):
     face_detector = FaceDetector(resolution, f"cuda:{device_id}")
 
     for video_input, video_output in paths:
@@ -88,7 +74,11 @@ def func(paths, process_temp_dir, device_id, resolution):
             continue
 
         os.makedirs(os.path.dirname(video_output), exist_ok=True)
-        combine_video_audio(video_frames, video_input, video_output, process_temp_dir)
+        try:
+            combine_video_audio(video_frames, video_input, video_output)
+        except RuntimeError as e:  # ffmpeg failed, keep going with the other videos
+            print(f"Exception: {e} - {video_input}")
+            continue
         print(f"Saved: {video_output}")
 
     face_detector.close()
@@ -99,17 +89,13 @@ def split(a, n):
     return (a[i * k + min(i, m) : (i + 1) * k + min(i + 1, m)] for i in range(n))
 
 
-def affine_transform_multi_gpus(input_dir, output_dir, temp_dir, resolution, num_workers):
+def affine_transform_multi_gpus(input_dir, output_dir, resolution, num_workers):
     print(f"Recursively gathering video paths of {input_dir} ...")
     gather_video_paths(input_dir, output_dir)
     num_devices = torch.cuda.device_count()
     if num_devices == 0:
         raise RuntimeError("No GPUs found")
 
-    if os.path.exists(temp_dir):
-        shutil.rmtree(temp_dir)
-    os.makedirs(temp_dir, exist_ok=True)
-
     split_paths = list(split(paths, num_workers * num_devices))
 
     processes = []
@@ -117,9 +103,7 @@ def affine_transform_multi_gpus(input_dir, output_dir, temp_dir, resolution, num
     for i in range(num_devices):
         for j in range(num_workers):
             process_index = i * num_workers + j
-            process = Process(
-                target=func, args=(split_paths[process_index], os.path.join(temp_dir, f"process_{i}"), i, resolution)
-            )
+            process = Process(target=func, args=(split_paths[process_index], i, resolution))
             process.start()
             processes.append(process)
 
@@ -130,8 +114,7 @@ def affine_transform_multi_gpus(input_dir, output_dir, temp_dir, resolution, num
 if __name__ == "__main__":
     input_dir = "/mnt/bn/maliva-gen-ai-v2/chunyu.li/avatars/resampled/train"
     output_dir = "/mnt/bn/maliva-gen-ai-v2/chunyu.li/avatars/affine_transformed/train"
-    temp_dir = "temp"
     resolution = 256
     num_workers = 10  # How many processes per device
 
-    affine_transform_multi_gpus(input_dir, output_dir, temp_dir, resolution, num_workers)
+    affine_transform_multi_gpus(input_dir, output_dir, resolution, num_workers)
@@ -4,78 +4,65 @@
 
 import argparse
 from omegaconf import OmegaConf
-import torch
-from diffusers import AutoencoderKL, DDIMScheduler
-from latentsync.models.unet import UNet3DConditionModel
-from latentsync.pipelines.lipsync_pipeline import LipsyncPipeline
-from diffusers.utils.import_utils import is_xformers_available
-from accelerate.utils import set_seed
-from latentsync.whisper.audio2feature import Audio2Feature
+from latentsync.pipelines.lipsync_session import LipsyncSession, get_weight_dtype
 
 
-def main(config, args):
-    # Check if the GPU supports float16
-    is_fp16_supported = torch.cuda.is_available() and torch.cuda.get_device_capability()[0] > 7
-    dtype = torch.float16 if is_fp16_supported else torch.float32
-
+def main(config, args, session: LipsyncSession = None):
+    """Runs the inference of `args`, on `session` if given, otherwise on a session loaded for this run only"""
     print(f"Input video path: {args.video_path}")
     print(f"Input audio path: {args.audio_path}")
     print(f"Loaded checkpoint path: {args.inference_ckpt_path}")
     print(f"Super-resolution option: {args.superres}")
 
-    scheduler = DDIMScheduler.from_pretrained("configs")
-
-    if config.model.cross_attention_dim == 768:
-        whisper_model_path = "checkpoints/whisper/small.pt"
-    elif config.model.cross_attention_dim == 384:
-        whisper_model_path = "checkpoints/whisper/tiny.pt"
-    else:
-        raise NotImplementedError("cross_attention_dim must be 768 or 384")
-
-    audio_encoder = Audio2Feature(model_path=whisper_model_path, device="cuda", num_frames=config.data.num_frames)
-
-    vae = AutoencoderKL.from_pretrained("stabilityai/sd-vae-ft-mse", torch_dtype=dtype)
-    vae.config.scaling_factor = 0.18215
-    vae.config.shift_factor = 0
-
-    unet, _ = UNet3DConditionModel.from_pretrained(
-        OmegaConf.to_container(config.model),
-        args.inference_ckpt_path,  # load checkpoint
-        device="cpu",
-    )
-    unet = unet.to(dtype=dtype)
-
-    # set xformers
-    # if is_xformers_available():
-    #     unet.enable_xformers_memory_efficient_attention()
-
-    pipeline = LipsyncPipeline(
-        vae=vae,
-        audio_encoder=audio_encoder,
-        unet=unet,
-        scheduler=scheduler,
-    ).to("cpu")
-
-    if args.seed != -1:
-        set_seed(args.seed)
-    else:
-        torch.seed()
-
-    print(f"Initial seed: {torch.initial_seed()}")
+    if session is None:
+        session = LipsyncSession(
+            config, args.inference_ckpt_path, get_weight_dtype(), variable_length_audio=args.variable_length_audio
+        )
+
+    memory_budget = int(args.memory_budget_gib * 2**30) if args.memory_budget_gib is not None else None
+
+    if args.avatar_dir is not None:
+        return session.run(
+            args.video_path,
+            args.audio_path,
+            args.video_out_path,
+            seed=args.seed,
+            avatar_dir=args.avatar_dir,
+            num_inference_steps=args.inference_steps,
+            guidance_scale=args.guidance_scale,
+            guidance_interval=tuple(args.guidance_interval),
+            guidance_every=args.guidance_every,
+            deep_cache_interval=args.deep_cache_interval,
+            warm_start_strength=args.warm_start_strength,
+            skip_silent_windows=args.skip_silent_windows,
+            superres=args.superres,
+            pipelined=args.pipelined,
+            windows_per_batch=args.windows_per_batch,
+            memory_budget=memory_budget,
+        )
 
     # Pass superres to pipeline
-    pipeline(
-        video_path=args.video_path,
-        audio_path=args.audio_path,
-        video_out_path=args.video_out_path,
+    return session.run(
+        args.video_path,
+        args.audio_path,
+        args.video_out_path,
+        seed=args.seed,
         video_mask_path=args.video_out_path.replace(".mp4", "_mask.mp4"),
-        num_frames=config.data.num_frames,
         num_inference_steps=args.inference_steps,
         guidance_scale=args.guidance_scale,
-        weight_dtype=dtype,
-        width=config.data.resolution,
-        height=config.data.resolution,
+        guidance_interval=tuple(args.guidance_interval),
+        guidance_every=args.guidance_every,
+        deep_cache_interval=args.deep_cache_interval,
+        warm_start_strength=args.warm_start_strength,
+        skip_silent_windows=args.skip_silent_windows,
         superres=args.superres,  # <--- pass this
+        warp_quality=args.warp_quality,
+        track_landmarks=args.track_landmarks,
+        landmark_smoothing=args.landmark_smoothing,
+        streaming=args.streaming,
+        pipelined=args.pipelined,
+        windows_per_batch=args.windows_per_batch,
+        memory_budget=memory_budget,
     )
 
 
@@ -89,6 +76,77 @@ if __name__ == "__main__":
     parser.add_argument("--inference_steps", type=int, default=20)
     parser.add_argument("--guidance_scale", type=float, default=1.0)
     parser.add_argument("--seed", type=int, default=1247)
+    parser.add_argument(
+        "--guidance_interval",
+        type=float,
+        nargs=2,
+        default=[0.0, 1.0],
+        metavar=("START", "END"),
+        help="Only run classifier-free guidance for the denoising steps within this fraction of the schedule.",
+    )
+    parser.add_argument(
+        "--guidance_every",
+        type=int,
+        default=1,
+        help="Only run classifier-free guidance on one in every k steps of the guidance interval.",
+    )
+    parser.add_argument(
+        "--deep_cache_interval",
+        type=int,
+        default=1,
+        help="Only run the whole UNet on one in every k denoising steps and reuse its deep features on the others.",
+    )
+    parser.add_argument(
+        "--warm_start_strength",
+        type=float,
+        default=1.0,
+        help="Start every window but the first from the previous window's result noised to this fraction of the "
+        "schedule, and only run that fraction of the denoising steps. 1.0 starts every window from pure noise.",
+    )
+    parser.add_argument(
+        "--skip_silent_windows",
+        action="store_true",
+        help="Keep the original frames of the windows without speech instead of lipsyncing them.",
+    )
+    parser.add_argument("--windows_per_batch", type=int, default=1)
+    parser.add_argument(
+        "--memory_budget_gib",
+        type=float,
+        default=None,
+        help="Pick the attention slicing, the VAE micro-batch size and the windows per batch (at most "
+        "--windows_per_batch) so that the peak CUDA memory stays within this many GiB. Ignored with a notice "
+        "when CUDA is not available.",
+    )
+
+    parser.add_argument(
+        "--warp_quality",
+        type=str,
+        default=None,
+        choices=["fast", "balanced", "high"],
+        help="Align the faces of every window with one batched grid_sample of this quality instead of OpenCV.",
+    )
+
+    parser.add_argument(
+        "--track_landmarks",
+        action="store_true",
+        help="Only run the face detector on keyframes and track the face from the previous landmarks in between.",
+    )
+
+    parser.add_argument(
+        "--landmark_smoothing",
+        type=str,
+        default="causal",
+        choices=["causal", "offline"],
+        help="Smooth the face alignment frame by frame, or over the whole clip with a zero-phase filter "
+        "(over each window batch with --streaming, so not across the seams between batches).",
+    )
+
+    parser.add_argument(
+        "--variable_length_audio",
+        action="store_true",
+        help="Encode the last whisper segment of the audio without padding it to 30 seconds. Faster for short "
+        "clips, with slightly different audio features.",
+    )
 
     # NEW: superres argument
     parser.add_argument(
@@ -99,6 +157,26 @@ if __name__ == "__main__":
         help="Apply super-resolution to generated sub-frame if needed.",
     )
 
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Process the video window by window to keep the memory usage bounded for long videos.",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="Like --streaming, but run alignment, denoising, restoring and encoding concurrently.",
+    )
+
+    parser.add_argument(
+        "--avatar_dir",
+        type=str,
+        default=None,
+        help="Avatar bundle of the video. It is prepared from --video_path if it does not exist yet, and reused "
+        "to skip the face alignment and VAE encoding of the video. The bundle refers to the video, which must stay "
+        "unchanged at its path.",
+    )
+
     args = parser.parse_args()
     config = OmegaConf.load(args.unet_config_path)
 
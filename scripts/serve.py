@@ -0,0 +1,119 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Thin HTTP front-end of `LipsyncServer`, e.g.
+
+python -m scripts.serve --inference_ckpt_path checkpoints/latentsync_unet.pt --port 8000
+
+POST /jobs with a JSON body {"video_path": ..., "audio_path": ..., "video_out_path": ..., "seed": ..., ...} queues
+a job, any other key being passed to the pipeline call, and answers {"job_id": ...}. GET /jobs/<job_id> returns
+the status and the latency of a job, and GET /metrics the metrics of the server. The paths are local to the server.
+"""
+
+import argparse
+import json
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from omegaconf import OmegaConf
+from latentsync.pipelines.lipsync_server import LipsyncServer
+from latentsync.pipelines.lipsync_session import LipsyncSession
+
+
+def make_handler(server: LipsyncServer):
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, status: HTTPStatus, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path != "/jobs":
+                return self.send_json(HTTPStatus.NOT_FOUND, dict(error=f"Unknown path {self.path}"))
+            try:
+                params = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                video_path = params.pop("video_path")
+                audio_path = params.pop("audio_path")
+                video_out_path = params.pop("video_out_path")
+                if "guidance_interval" in params:
+                    params["guidance_interval"] = tuple(params["guidance_interval"])
+                job = server.submit(video_path, audio_path, video_out_path, **params)
+            except (ValueError, KeyError, TypeError) as e:
+                return self.send_json(HTTPStatus.BAD_REQUEST, dict(error=f"{type(e).__name__}: {e}"))
+            self.send_json(HTTPStatus.ACCEPTED, dict(job_id=job.job_id))
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                return self.send_json(HTTPStatus.OK, server.metrics())
+            if self.path.startswith("/jobs/"):
+                job = server.get_job(self.path[len("/jobs/") :])
+                if job is not None:
+                    return self.send_json(HTTPStatus.OK, job.to_dict())
+            self.send_json(HTTPStatus.NOT_FOUND, dict(error=f"Unknown path {self.path}"))
+
+    return Handler
+
+
+def main(config, args):
+    session = LipsyncSession(config, args.inference_ckpt_path, variable_length_audio=args.variable_length_audio)
+    server = LipsyncServer(
+        session,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_concurrent_jobs=args.max_concurrent_jobs,
+        finished_job_ttl=args.finished_job_ttl,
+        max_finished_jobs=args.max_finished_jobs,
+    )
+    http_server = ThreadingHTTPServer((args.host, args.port), make_handler(server))
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--unet_config_path", type=str, default="configs/unet/second_stage.yaml")
+    parser.add_argument("--inference_ckpt_path", type=str, required=True)
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max_batch_size", type=int, default=8, help="Maximum number of windows per UNet batch.")
+    parser.add_argument(
+        "--max_wait_ms",
+        type=float,
+        default=20.0,
+        help="Maximum time a window waits for other windows to batch with.",
+    )
+    parser.add_argument("--max_concurrent_jobs", type=int, default=4)
+    parser.add_argument(
+        "--finished_job_ttl",
+        type=float,
+        default=3600.0,
+        help="Seconds a finished job stays available to GET /jobs/<job_id>.",
+    )
+    parser.add_argument("--max_finished_jobs", type=int, default=1000)
+    parser.add_argument("--variable_length_audio", action="store_true")
+
+    args = parser.parse_args()
+    config = OmegaConf.load(args.unet_config_path)
+
+    main(config, args)
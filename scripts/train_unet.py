@@ -205,6 +205,8 @@ def main(config):
         scheduler=noise_scheduler,
     ).to(device)
     pipeline.set_progress_bar_config(disable=True)
+    # The validation video is the same at every validation step, so its VAE latents only need to be encoded once
+    pipeline.enable_latent_cache()
 
     # DDP warpper
     unet = DDP(unet, device_ids=[local_rank], output_device=local_rank)
@@ -465,6 +467,8 @@ def main(config):
                         num_frames=config.data.num_frames,
                         num_inference_steps=config.run.inference_steps,
                         guidance_scale=config.run.guidance_scale,
+                        guidance_interval=tuple(config.run.get("guidance_interval", (0.0, 1.0))),
+                        guidance_every=config.run.get("guidance_every", 1),
                         weight_dtype=torch.float16,
                         width=config.data.resolution,
                         height=config.data.resolution,
@@ -0,0 +1,139 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the import time of the main entry points with `python -X importtime` and exits with an error when one of
+them is above its budget or imports a dependency that should only be imported on first use, e.g.
+
+python -m tools.check_import_time
+python -m tools.check_import_time --modules latentsync.utils.util:1500 --repeats 5
+
+Every import runs in a fresh interpreter from the root of the repo, the time of an empty interpreter is subtracted
+and the fastest of the repeats is kept. The budgets are in milliseconds and depend on the machine, torch alone takes
+about a second to import, so they catch regressions rather than give absolute numbers.
+"""
+
+import argparse
+import subprocess
+import sys
+from collections import defaultdict
+
+DEFAULT_BUDGETS_MS = {
+    "latentsync.utils.audio": 2000,
+    "latentsync.utils.util": 2500,
+    "latentsync.utils.image_processor": 3000,
+    "latentsync.pipelines.lipsync_pipeline": 6000,
+    "scripts.inference": 6000,
+}
+
+# Imported by the functions that need them, the entry points above must not pay for them
+DEFERRED_PACKAGES = [
+    "mediapipe",
+    "face_alignment",
+    "matplotlib",
+    "librosa",
+    "imageio",
+    "decord",
+    "accelerate",
+    "safetensors",
+]
+# diffusers.modeling_utils imports these itself when they are installed, so only the modules that do not load it can
+# defer them
+DIFFUSERS_IMPORTS = {"accelerate", "safetensors"}
+
+
+def parse_importtime(stderr: str):
+    """Returns the total time in microseconds and the self time of every imported module."""
+    total_us = 0
+    self_us = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # header
+        name = fields[2].rstrip()
+        # Nested imports are indented, the cumulative time of the top-level ones covers them
+        if not name.startswith("  "):
+            total_us += int(fields[1])
+        self_us[name.strip()] = int(fields[0])
+    return total_us, self_us
+
+
+def measure(statement: str):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement], capture_output=True, text=True, check=False
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"`{statement}` failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def check_module(module: str, budget_ms: float, repeats: int, baseline_us: int, top: int):
+    runs = [measure(f"import {module}") for _ in range(repeats)]
+    total_us, self_us = min(runs, key=lambda run: run[0])
+    import_ms = (total_us - baseline_us) / 1000
+
+    errors = []
+    if import_ms > budget_ms:
+        errors.append(f"{import_ms:.0f}ms is above the budget of {budget_ms:.0f}ms")
+    deferred = {name.split(".")[0] for name in self_us} & set(DEFERRED_PACKAGES)
+    if "diffusers.modeling_utils" in self_us:
+        deferred -= DIFFUSERS_IMPORTS
+    deferred = sorted(deferred)
+    if deferred:
+        errors.append(f"imports {', '.join(deferred)}, which should be imported on first use")
+
+    status = "FAIL" if errors else "ok"
+    print(f"{module:<44}{import_ms:>10.0f}{budget_ms:>10.0f}  {status}")
+    for error in errors:
+        print(f"    {error}")
+    if errors and top > 0:
+        package_us = defaultdict(int)
+        for name, us in self_us.items():
+            package_us[name.split(".")[0]] += us
+        heaviest = sorted(package_us.items(), key=lambda item: item[1], reverse=True)[:top]
+        print("    heaviest packages: " + ", ".join(f"{name} {us / 1000:.0f}ms" for name, us in heaviest))
+    return not errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time budget check")
+    parser.add_argument(
+        "--modules",
+        type=str,
+        nargs="+",
+        default=[f"{module}:{budget}" for module, budget in DEFAULT_BUDGETS_MS.items()],
+        help="Modules to import, each optionally followed by its budget in ms, e.g. latentsync.utils.util:1500.",
+    )
+    parser.add_argument("--budget_ms", type=float, default=6000, help="Budget of the modules given without one.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--top", type=int, default=8, help="Number of heaviest packages to show on failure.")
+    args = parser.parse_args()
+
+    baseline_us = min(measure("pass")[0] for _ in range(args.repeats))
+
+    print(f"{'module':<44}{'time (ms)':>10}{'budget':>10}")
+    passed = True
+    for entry in args.modules:
+        module, _, budget = entry.partition(":")
+        budget_ms = float(budget) if budget else args.budget_ms
+        passed &= check_module(module, budget_ms, args.repeats, baseline_us, args.top)
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
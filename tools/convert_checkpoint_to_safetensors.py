@@ -0,0 +1,77 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Converts a UNet training checkpoint (.pt) to an inference checkpoint in the safetensors format, e.g.
+
+python -m tools.convert_checkpoint_to_safetensors --ckpt_path checkpoints/latentsync_unet.pt \
+    --output_path checkpoints/latentsync_unet.safetensors
+
+Only the state dict is kept, in float16 by default, and the global step is stored in the metadata. With a UNet
+config, the entries the model of that config would not load (training-only modules, mismatched projections) are
+dropped too.
+"""
+
+import argparse
+import os
+
+import torch
+from accelerate import init_empty_weights
+from omegaconf import OmegaConf
+from safetensors.torch import save_file
+
+from latentsync.models.unet import UNet3DConditionModel, load_checkpoint
+
+DTYPES = {"fp16": torch.float16, "bf16": torch.bfloat16, "fp32": torch.float32}
+
+
+def convert_checkpoint(ckpt_path: str, output_path: str, unet_config_path: str = None, dtype=torch.float16):
+    state_dict, global_step = load_checkpoint(ckpt_path)
+    num_keys = len(state_dict)
+
+    if unet_config_path is not None:
+        config = OmegaConf.load(unet_config_path)
+        with init_empty_weights():
+            unet = UNet3DConditionModel.from_config(OmegaConf.to_container(config.model))
+        model_keys = set(unet.state_dict())
+        state_dict = {key: value for key, value in unet.filter_state_dict(state_dict).items() if key in model_keys}
+
+    # safetensors does not store tensors that share memory, so every tensor gets its own contiguous copy
+    tensors = {
+        key: (value.to(dtype) if value.is_floating_point() else value).contiguous().clone()
+        for key, value in state_dict.items()
+    }
+    save_file(tensors, output_path, metadata={"global_step": str(global_step)})
+
+    print(f"Kept {len(tensors)} of {num_keys} tensors, global step {global_step}")
+    print(
+        f"{ckpt_path}: {os.path.getsize(ckpt_path) / 2**20:.1f}MiB -> "
+        f"{output_path}: {os.path.getsize(output_path) / 2**20:.1f}MiB"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ckpt_path", type=str, required=True)
+    parser.add_argument("--output_path", type=str, required=True)
+    parser.add_argument(
+        "--unet_config_path",
+        type=str,
+        default=None,
+        help="Drop the entries the UNet of this config does not load.",
+    )
+    parser.add_argument("--dtype", type=str, default="fp16", choices=list(DTYPES))
+    args = parser.parse_args()
+
+    convert_checkpoint(args.ckpt_path, args.output_path, args.unet_config_path, DTYPES[args.dtype])